@@ -19,19 +19,34 @@ import os
 import subprocess
 import torch
 import json
+import threading
+from contextlib import contextmanager
 from functools import lru_cache
 import shutil
-from pedalboard import Pedalboard, Reverb
-from pedalboard.io import AudioFile
-from pydub import AudioSegment
 from audio_separator.separator import Separator
 import logging
+import librosa
+import soundfile as sf
 import yaml
-from typing import Optional, Dict, Any, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Dict, Any, List, Tuple, Union
 
 from programs.applio_code.rvc.infer.infer import VoiceConverter
 from programs.applio_code.rvc.lib.tools.model_download import model_download_pipeline
-from programs.music_separation_code.inference import proc_file
+from programs.applio_code.rvc.lib.tools.encoder import encode_audio
+from programs.applio_code.rvc.lib.tools.manifest import (
+    BatchManifest,
+    hash_file,
+    hash_params,
+)
+from programs.music_separation_code.inference import AUDIO_EXTENSIONS, SeparationEngine
+from programs.pipeline_code.audio import AudioBuffer, as_buffer, as_file
+from programs.pipeline_code.cache import StageCache
+from programs.pipeline_code.graph import Cancelled, Source, StageGraph, file_identity
+from programs.pipeline_code.mixer import mix_to_file
+from programs.pipeline_code.pitch import pitch_shift, pitch_shift_file
+from programs.pipeline_code.resources import MemoryBudget, ResourcePool, WarmPool
+from programs.pipeline_code.telemetry import JsonLinesSink, MetricsSink, Telemetry
 from assets.presence.discord_presence import RPCManager, track_presence
 
 
@@ -164,11 +179,91 @@ MODELS_CONFIG = {
 config_file = os.path.join(now_dir, "assets", "config.json")
 
 
-@lru_cache(maxsize=None)
-def import_voice_converter():
-    """Cached import of VoiceConverter to avoid repeated imports."""
+@lru_cache(maxsize=1)
+def get_converter_pool() -> WarmPool:
+    """
+    Shared voice converters, one per RVC model, kept with their model loaded so the
+    songs and requests using a model share its weights. Up to four idle converters
+    stay loaded.
+    """
     from programs.applio_code.rvc.infer.infer import VoiceConverter
-    return VoiceConverter()
+
+    return WarmPool(
+        lambda model_path: VoiceConverter(),
+        per_key=1,
+        max_idle=4,
+        dispose=lambda converter: converter.cleanup_model(),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_separation_engine():
+    """Shared in-process separation engine, so separation models stay loaded between songs."""
+    return SeparationEngine()
+
+
+@lru_cache(maxsize=4)
+def load_uvr_separator(
+    model_file_dir: str,
+    model_filename: str,
+    output_single_stem: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    use_tta: Optional[bool] = None,
+) -> Separator:
+    """
+    Cached audio-separator instance with its model loaded, keyed by model and settings.
+    The least recently used ones are dropped once more than four are loaded.
+
+    Args:
+        model_file_dir (str): Directory holding the model files
+        model_filename (str): Model file name, as passed to Separator.load_model
+        output_single_stem (Optional[str]): Only write this stem if set
+        batch_size (Optional[int]): VR batch size, None for non-VR models
+        use_tta (Optional[bool]): VR test time augmentation, None for non-VR models
+    """
+    separator = Separator(
+        model_file_dir=model_file_dir,
+        log_level=logging.WARNING,
+        normalization_threshold=1.0,
+        output_format="wav",
+        output_single_stem=output_single_stem,
+        vr_params=(
+            {"batch_size": batch_size, "enable_tta": use_tta}
+            if batch_size is not None
+            else None
+        ),
+    )
+    separator.load_model(model_filename=model_filename)
+    # Held by one caller at a time, see uvr_separator
+    separator.lock = threading.Lock()
+    return separator
+
+
+@contextmanager
+def uvr_separator(
+    model_file_dir: str,
+    model_filename: str,
+    output_dir: str,
+    output_single_stem: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    use_tta: Optional[bool] = None,
+) -> Iterator[Separator]:
+    """
+    Context manager yielding a loaded audio-separator instance writing to `output_dir`,
+    reusing the one from a previous song or stage when the model and settings match.
+    
+    The instance is held exclusively until the block exits, since its output directory
+    and per-call state are shared: read its outputs inside the block, so concurrent
+    songs can't write to or read from each other's folders.
+    """
+    separator = load_uvr_separator(
+        model_file_dir, model_filename, output_single_stem, batch_size, use_tta
+    )
+    with separator.lock:
+        # The loaded model keeps its own copy of the output directory
+        separator.output_dir = output_dir
+        separator.model_instance.output_dir = output_dir
+        yield separator
 
 
 def load_config_presence():
@@ -346,9 +441,10 @@ def add_audio_effects(
     reverb_damping: float,
     reverb_width: float,
     output_path: str,
+    effects: Optional[List[Dict[str, Any]]] = None,
 ) -> str:
     """
-    Add reverb effects to an audio file.
+    Add reverb and other effects to an audio file, streaming it block by block.
     
     Args:
         audio_path (str): Path to the input audio file
@@ -358,28 +454,51 @@ def add_audio_effects(
         reverb_damping (float): Damping factor (0.0-1.0)
         reverb_width (float): Width of the reverb (0.0-1.0)
         output_path (str): Path to save the output audio file
+        effects (List[Dict[str, Any]], optional): Effects applied after the reverb,
+            e.g. [{"type": "compressor", "threshold_db": -18}], see EffectsChain
         
     Returns:
         str: Path to the output audio file with reverb applied
     """
-    board = Pedalboard([
-        Reverb(
-            room_size=reverb_size,
-            dry_level=reverb_dry,
-            wet_level=reverb_wet,
-            damping=reverb_damping,
-            width=reverb_width,
-        )
-    ])
-    
-    with AudioFile(audio_path) as f:
-        with AudioFile(output_path, "w", f.samplerate, f.num_channels) as o:
-            while f.tell() < f.frames:
-                chunk = f.read(int(f.samplerate))
-                effected = board(chunk, f.samplerate, reset=False)
-                o.write(effected)
+    chain = [
+        reverb_effect(reverb_size, reverb_wet, reverb_dry, reverb_damping, reverb_width)
+    ] + list(effects or [])
+    output_format = os.path.splitext(output_path)[1][1:] or "wav"
+    return mix_to_file(
+        [audio_path], [0.0], output_path, output_format, limiter=False, effects=[chain]
+    )
+
+
+def reverb_effect(
+    room_size: float, wet_gain: float, dry_gain: float, damping: float, width: float
+) -> Dict[str, Any]:
+    """Reverb entry of an effects chain."""
+    return {
+        "type": "reverb",
+        "room_size": room_size,
+        "wet_level": wet_gain,
+        "dry_level": dry_gain,
+        "damping": damping,
+        "width": width,
+    }
+
+
+def shift_audio_pitch(
+    audio_path: str, semitones: int, output_path: str, output_format: str = "wav"
+) -> str:
+    """
+    Shift the pitch of an audio file without changing its duration.
     
-    return output_path
+    Args:
+        audio_path (str): Path to the input audio file
+        semitones (int): Pitch shift in semitones
+        output_path (str): Path to save the output audio file
+        output_format (str): Format for the output file
+        
+    Returns:
+        str: Path to the pitch shifted audio file
+    """
+    return pitch_shift_file(audio_path, output_path, semitones, output_format)
 
 
 def merge_audios(
@@ -393,7 +512,8 @@ def merge_audios(
     output_format: str,
 ) -> str:
     """
-    Merge multiple audio tracks with volume adjustments.
+    Merge multiple audio tracks with volume adjustments, streaming them block by block
+    through a true-peak limiter into the encoder. The mix has the length of the vocals.
     
     Args:
         vocals_path (str): Path to the main vocals track
@@ -408,15 +528,12 @@ def merge_audios(
     Returns:
         str: Path to the merged output audio file
     """
-    main_vocal_audio = AudioSegment.from_file(vocals_path, format="flac") + main_gain
-    instrumental_audio = AudioSegment.from_file(inst_path, format="flac") + inst_gain
-    backing_vocal_audio = AudioSegment.from_file(backing_path, format="flac") + backing_Vol
-    
-    combined_audio = main_vocal_audio.overlay(
-        instrumental_audio.overlay(backing_vocal_audio)
+    return mix_to_file(
+        [vocals_path, inst_path, backing_path],
+        [main_gain, inst_gain, backing_Vol],
+        output_path,
+        output_format,
     )
-    combined_audio.export(output_path, format=output_format)
-    return output_path
 
 
 def check_fp16_support(device: str) -> bool:
@@ -443,6 +560,850 @@ def check_fp16_support(device: str) -> bool:
         return False
 
 
+def separate_audio(
+    model_info: Dict[str, Any],
+    input_file: str,
+    store_dir: str,
+    devices: str,
+    extract_instrumental: bool = False,
+) -> None:
+    """
+    Run a music separation model in-process, reusing it if it's already loaded.
+    
+    Args:
+        model_info (Dict[str, Any]): Model entry from MODELS_CONFIG
+        input_file (str): Path to the audio file to separate
+        store_dir (str): Directory where the separated stems are written
+        devices (str): Device specification (e.g. '0 1' for GPUs 0 and 1, 'cpu')
+        extract_instrumental (bool): Whether to also write the inverted instrumental
+    """
+    if devices == "cpu":
+        force_cpu, device_ids = True, 0
+    else:
+        force_cpu, device_ids = False, [int(device) for device in devices.split()]
+    get_separation_engine().separate(
+        input_file,
+        store_dir,
+        model_info["type"],
+        model_info["config"],
+        model_info["model"],
+        force_cpu=force_cpu,
+        device_ids=device_ids,
+        extract_instrumental=extract_instrumental,
+        flac_file=True,
+        pcm_type="PCM_16",
+    )
+
+
+def separate_array(
+    model_info: Dict[str, Any],
+    audio: AudioBuffer,
+    devices: str,
+    extract_instrumental: bool = False,
+) -> Dict[str, AudioBuffer]:
+    """
+    Run a music separation model in-process on in-memory audio.
+    
+    Args:
+        model_info (Dict[str, Any]): Model entry from MODELS_CONFIG
+        audio (AudioBuffer): Audio to separate
+        devices (str): Device specification (e.g. '0 1' for GPUs 0 and 1, 'cpu')
+        extract_instrumental (bool): Whether to also return the inverted instrumental
+        
+    Returns:
+        Dict[str, AudioBuffer]: The stems by instrument name
+    """
+    if devices == "cpu":
+        force_cpu, device_ids = True, 0
+    else:
+        force_cpu, device_ids = False, [int(device) for device in devices.split()]
+    stems, sample_rate = get_separation_engine().separate_array(
+        audio.samples.T,
+        audio.sample_rate,
+        model_info["type"],
+        model_info["config"],
+        model_info["model"],
+        force_cpu=force_cpu,
+        device_ids=device_ids,
+        extract_instrumental=extract_instrumental,
+    )
+    return {
+        instrument: AudioBuffer(samples, sample_rate)
+        for instrument, samples in stems.items()
+    }
+
+
+STAGE_CACHE_DIR = os.path.join(now_dir, "audio_files", "cache")
+
+
+@lru_cache(maxsize=1)
+def get_stage_cache() -> StageCache:
+    """
+    Shared cache of full inference stage outputs, bounded by
+    file_management.stage_cache_size_gb in the config (10 GB by default, null for no
+    limit). With 0, nothing is cached and the stages only pass their outputs in memory.
+    """
+    with open(config_file, "r", encoding="utf8") as file:
+        file_management = json.load(file).get("file_management", {})
+    size_gb = file_management.get("stage_cache_size_gb", 10)
+    if size_gb == 0:
+        return None
+    cache = StageCache(
+        STAGE_CACHE_DIR, int(size_gb * 2**30) if size_gb is not None else None
+    )
+    cache.clear_scratch()
+    return cache
+
+
+def stage_concurrency() -> Dict[str, Any]:
+    """
+    Worker pool size and resource limits of the full inference stages, from the
+    performance section of the config: up to max_threads stages run at once, and with
+    memory_optimization only one separation or RVC model runs at a time (two otherwise).
+    The RVC stages, which also load an embedder model each, run one at a time.
+    """
+    with open(config_file, "r", encoding="utf8") as file:
+        performance = json.load(file).get("performance", {})
+    return {
+        "workers": performance.get("max_threads", 4),
+        "limits": {
+            "model": 1 if performance.get("memory_optimization", True) else 2,
+            "rvc": 1,
+        },
+    }
+
+
+@lru_cache(maxsize=1)
+def get_resource_pool() -> ResourcePool:
+    """
+    Resource limits of stage_concurrency, shared by every full inference run and
+    service job of the process so concurrent requests queue for the same model slots.
+    """
+    return ResourcePool(stage_concurrency()["limits"])
+
+
+@lru_cache(maxsize=1)
+def get_telemetry_sinks() -> Tuple[Callable[[Dict[str, Any]], None], ...]:
+    """
+    Sinks of the full inference stage events, from the telemetry section of the config:
+    a JSON lines file at jsonl_path (audio_files/telemetry.jsonl by default, null to
+    disable) rotated past jsonl_max_mb (10 by default, null for no limit) and, if
+    metrics_port is set, a metrics endpoint on localhost.
+    """
+    with open(config_file, "r", encoding="utf8") as file:
+        telemetry = json.load(file).get("telemetry", {})
+    sinks = []
+    jsonl_path = telemetry.get("jsonl_path", "audio_files/telemetry.jsonl")
+    if jsonl_path:
+        max_mb = telemetry.get("jsonl_max_mb", 10)
+        sinks.append(
+            JsonLinesSink(
+                os.path.join(now_dir, jsonl_path),
+                int(max_mb * 2**20) if max_mb is not None else None,
+            )
+        )
+    if telemetry.get("metrics_port"):
+        try:
+            sinks.append(MetricsSink(telemetry["metrics_port"]))
+        except OSError as e:
+            logging.error(f"Could not serve the stage metrics: {e}")
+    return tuple(sinks)
+
+
+def get_telemetry(
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None, **labels: Any
+) -> Optional[Telemetry]:
+    """
+    Telemetry of a full inference run: the configured sinks plus `progress_callback`,
+    with `labels` (e.g. the song) added to every event. None without any sink.
+    """
+    sinks = list(get_telemetry_sinks())
+    if progress_callback is not None:
+        sinks.append(progress_callback)
+    return Telemetry(sinks, labels) if sinks else None
+
+
+def keep_intermediates() -> bool:
+    """
+    Whether file_management.keep_intermediates asks for the outputs of every stage, not
+    only the converted vocals, to be saved when the audios aren't deleted.
+    """
+    with open(config_file, "r", encoding="utf8") as file:
+        file_management = json.load(file).get("file_management", {})
+    return bool(file_management.get("keep_intermediates", False))
+
+
+def prepare_separation_model(model_info: Dict[str, Any], fp16: bool) -> None:
+    """
+    Download a music separation model if necessary and disable mixed precision in its
+    config when FP16 isn't supported. UVR models are downloaded by audio-separator.
+    
+    Args:
+        model_info (Dict[str, Any]): Model entry from MODELS_CONFIG
+        fp16 (bool): Whether the device supports FP16 inference
+    """
+    if "arch" in model_info:
+        return
+    model_ckpt_path = os.path.join(model_info["path"], "model.ckpt")
+    if not os.path.exists(model_ckpt_path):
+        download_file(model_info["model_url"], model_info["path"], "model.ckpt")
+    
+    config_json_path = os.path.join(model_info["path"], "config.yaml")
+    if not os.path.exists(config_json_path):
+        download_file(model_info["config_url"], model_info["path"], "config.yaml")
+    
+    if not fp16:
+        with open(model_info["config"], "r") as file:
+            config = yaml.safe_load(file)
+        config["training"]["use_amp"] = False
+        with open(model_info["config"], "w") as file:
+            yaml.safe_dump(config, file)
+
+
+def separation_fingerprint(model_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Identity of the files behind a separation model, so replacing a checkpoint or
+    editing a config invalidates the cached results. UVR models are identified by name.
+    """
+    if "arch" in model_info:
+        return None
+    return {
+        "config": hash_file(model_info["config"]),
+        "model": file_identity(model_info["model"]),
+    }
+
+
+def uvr_settings(
+    model_info: Dict[str, Any], batch_size: int, use_tta: bool
+) -> Dict[str, Any]:
+    """VR batch size and TTA for VR models, None for the models that don't use them."""
+    if model_info.get("arch") == "vr":
+        return {"batch_size": batch_size, "use_tta": use_tta}
+    return {"batch_size": None, "use_tta": None}
+
+
+def stage_input(audio: Union[str, AudioBuffer], output_dir: str) -> str:
+    """
+    Expose a stage input as a file under a fixed name, for the separators that only read
+    files, so the files they write never depend on the song name and can be told apart
+    by their stem label. In-memory inputs are written as float WAV.
+    
+    Args:
+        audio (Union[str, AudioBuffer]): Path to the input audio file, or the audio
+        output_dir (str): Stage output directory
+        
+    Returns:
+        str: Path to the renamed input
+    """
+    input_dir = os.path.join(output_dir, "input")
+    os.makedirs(input_dir, exist_ok=True)
+    if isinstance(audio, AudioBuffer):
+        return as_file(audio, os.path.join(input_dir, "input"))
+    path = audio
+    link = os.path.join(input_dir, "input" + os.path.splitext(path)[1])
+    try:
+        os.symlink(os.path.abspath(path), link)
+    except OSError:
+        shutil.copyfile(path, link)
+    return link
+
+
+def pick_stem(stems: Dict[str, Any], *labels: str) -> Any:
+    """
+    Pick a separated stem by label, trying the labels in order.
+    
+    Args:
+        stems (Dict[str, Any]): Stems (or their files) by name
+        *labels (str): Stem labels to look for, case-insensitively
+        
+    Returns:
+        Any: The matching stem
+        
+    Raises:
+        KeyError: If no stem matches any of the labels
+    """
+    for label in labels:
+        for name in sorted(stems):
+            if label.lower() in name.lower():
+                return stems[name]
+    raise KeyError(f"No '{labels[0]}' stem among {sorted(stems)}")
+
+
+def find_stem(folder: str, *labels: str) -> AudioBuffer:
+    """
+    Load the output file of a separator by stem label, trying the labels in order.
+    
+    Args:
+        folder (str): Stage output directory
+        *labels (str): Stem labels to look for, case-insensitively
+        
+    Returns:
+        AudioBuffer: The decoded stem
+        
+    Raises:
+        FileNotFoundError: If no file matches any of the labels
+    """
+    files = {
+        file: os.path.join(folder, file)
+        for file in os.listdir(folder)
+        if os.path.isfile(os.path.join(folder, file))
+    }
+    try:
+        return AudioBuffer.read(pick_stem(files, *labels))
+    except KeyError:
+        raise FileNotFoundError(f"No '{labels[0]}' output was written in {folder}")
+
+
+def stage_separate_vocals(
+    inputs: Dict[str, Any], output_dir: str, model_name: str, devices: str
+) -> Dict[str, AudioBuffer]:
+    """Split the song into vocals and instrumental."""
+    model_info = get_model_info_by_name(model_name)
+    print("Separating vocals...")
+    stems = separate_array(
+        model_info, as_buffer(inputs["audio"]), devices, extract_instrumental=True
+    )
+    return {
+        "vocals": pick_stem(stems, "vocals"),
+        "instrumental": pick_stem(stems, "instrumental"),
+    }
+
+
+def stage_karaoke(
+    inputs: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    batch_size: Optional[int],
+    use_tta: Optional[bool],
+    devices: str,
+) -> Dict[str, AudioBuffer]:
+    """Split the vocals into lead and backing vocals."""
+    model_info = get_model_info_by_name(model_name)
+    print("Separating lead and backing vocals...")
+    if "arch" in model_info:
+        with uvr_separator(
+            os.path.join(now_dir, "models", "karaoke"),
+            model_info["full_name"],
+            output_dir,
+            batch_size=batch_size,
+            use_tta=use_tta,
+        ) as separator:
+            separator.separate(stage_input(inputs["audio"], output_dir))
+            return {
+                "lead": find_stem(output_dir, "karaoke", "vocals"),
+                "backing": find_stem(output_dir, "instrumental"),
+            }
+    stems = separate_array(
+        model_info, as_buffer(inputs["audio"]), devices, extract_instrumental=True
+    )
+    return {
+        "lead": pick_stem(stems, "karaoke", "vocals"),
+        "backing": pick_stem(stems, "instrumental"),
+    }
+
+
+def stage_dereverb(
+    inputs: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    batch_size: Optional[int],
+    use_tta: Optional[bool],
+    devices: str,
+) -> Dict[str, AudioBuffer]:
+    """Remove the reverb from the lead vocals."""
+    model_info = get_model_info_by_name(model_name)
+    print("Removing reverb...")
+    labels = ("noreverb", "no reverb", "dry")
+    if "arch" in model_info:
+        with uvr_separator(
+            os.path.join(now_dir, "models", "dereverb"),
+            model_info["full_name"],
+            output_dir,
+            output_single_stem="No Reverb",
+            batch_size=batch_size,
+            use_tta=use_tta,
+        ) as separator:
+            separator.separate(stage_input(inputs["audio"], output_dir))
+            return {"audio": find_stem(output_dir, *labels)}
+    stems = separate_array(model_info, as_buffer(inputs["audio"]), devices)
+    return {"audio": pick_stem(stems, *labels)}
+
+
+def stage_deecho(
+    inputs: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    batch_size: Optional[int],
+    use_tta: Optional[bool],
+) -> Dict[str, AudioBuffer]:
+    """Remove the echo from the lead vocals."""
+    model_info = get_model_info_by_name(model_name)
+    print("Removing echo...")
+    with uvr_separator(
+        os.path.join(now_dir, "models", "deecho"),
+        model_info["full_name"],
+        output_dir,
+        output_single_stem="No Echo",
+        batch_size=batch_size,
+        use_tta=use_tta,
+    ) as separator:
+        separator.separate(stage_input(inputs["audio"], output_dir))
+        return {"audio": find_stem(output_dir, "no echo")}
+
+
+def stage_denoise(
+    inputs: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    batch_size: Optional[int],
+    use_tta: Optional[bool],
+    devices: str,
+) -> Dict[str, AudioBuffer]:
+    """Remove the noise from the lead vocals."""
+    model_info = get_model_info_by_name(model_name)
+    print("Removing noise")
+    labels = ("dry", "no noise")
+    if "arch" in model_info:
+        with uvr_separator(
+            os.path.join(now_dir, "models", "denoise"),
+            model_info["full_name"],
+            output_dir,
+            output_single_stem="No Noise",
+            batch_size=batch_size,
+            use_tta=use_tta,
+        ) as separator:
+            separator.separate(stage_input(inputs["audio"], output_dir))
+            return {"audio": find_stem(output_dir, *labels)}
+    try:
+        stems = separate_array(model_info, as_buffer(inputs["audio"]), devices)
+    except Exception as e:
+        logging.error(f"Denoise separation failed: {e}")
+        raise
+    return {"audio": pick_stem(stems, *labels)}
+
+
+def stage_rvc(
+    inputs: Dict[str, Any], output_dir: str, **convert_params: Any
+) -> Dict[str, AudioBuffer]:
+    """Convert a vocal track with an RVC model."""
+    print("Making RVC inference...")
+    audio = as_buffer(inputs["audio"])
+    with get_converter_pool().use(os.path.abspath(convert_params["model_path"])) as vc:
+        converted, sample_rate = vc.convert_array(
+            audio.samples, audio.sample_rate, **convert_params
+        )
+    return {"audio": AudioBuffer(converted, sample_rate)}
+
+
+def stage_instrumental_pitch(
+    inputs: Dict[str, Any], output_dir: str, semitones: int
+) -> Dict[str, AudioBuffer]:
+    """
+    Shift the pitch of the instrumental with a phase vocoder, keeping its duration so
+    it stays aligned with the vocals.
+    """
+    print("Changing instrumental pitch...")
+    return {"audio": pitch_shift(as_buffer(inputs["audio"]), semitones)}
+
+
+def stage_merge(
+    inputs: Dict[str, Any],
+    output_dir: str,
+    vocals_volume: float,
+    instrumentals_volume: float,
+    backing_vocals_volume: float,
+    export_format: str,
+    vocal_effects: List[Dict[str, Any]],
+) -> Dict[str, str]:
+    """
+    Mix the converted vocals, instrumental and backing vocals and encode the result,
+    running the vocals through their effects chain in the same pass.
+    """
+    print("Merging audios...")
+    output_file = os.path.join(output_dir, f"final.{export_format.lower()}")
+    mix_to_file(
+        [inputs["vocals"], inputs["instrumental"], inputs["backing"]],
+        [vocals_volume, instrumentals_volume, backing_vocals_volume],
+        output_file,
+        export_format,
+        effects=[vocal_effects, None, None],
+    )
+    return {"audio": output_file}
+
+
+def export_intermediates(
+    graph: StageGraph,
+    directory: str,
+    formats: Optional[Dict[str, str]] = None,
+    stages: Optional[List[str]] = None,
+) -> None:
+    """
+    Save the in-memory outputs of the stages of a run as <directory>/<stage>/<output>.
+    
+    Args:
+        graph (StageGraph): Graph that was run
+        directory (str): Song folder
+        formats (Optional[Dict[str, str]]): Export format by stage, FLAC by default
+        stages (Optional[List[str]]): Stages to save, all of them by default
+    """
+    formats = formats or {}
+    for name, outputs in graph.results.items():
+        if stages is not None and name not in stages:
+            continue
+        export_format = formats.get(name, "flac")
+        stage_dir = os.path.join(directory, name)
+        os.makedirs(stage_dir, exist_ok=True)
+        for output_name, audio in outputs.items():
+            if isinstance(audio, AudioBuffer):
+                encode_audio(
+                    audio.samples,
+                    audio.sample_rate,
+                    os.path.join(stage_dir, f"{output_name}.{export_format.lower()}"),
+                    export_format.upper(),
+                )
+
+
+def setup_devices(devices: str) -> Tuple[str, bool]:
+    """
+    Normalize the device selection and check FP16 support.
+    
+    Args:
+        devices (str): Device specification from the UI (e.g. '0-1' for GPUs 0 and 1)
+        
+    Returns:
+        Tuple[str, bool]: Space separated devices ('cpu' without CUDA) and FP16 support
+    """
+    if torch.cuda.is_available():
+        n_gpu = torch.cuda.device_count()
+        devices = devices.replace("-", " ")
+        print(f"Number of GPUs available: {n_gpu}")
+        first_device = devices.split()[0] if devices else "cpu"
+        return devices, check_fp16_support(first_device)
+    print("Using CPU")
+    return "cpu", False
+
+
+def prepare_inference_models(settings: Dict[str, Any], fp16: bool) -> None:
+    """
+    Download the separation models a full inference uses, before any stage reads them.
+    
+    Args:
+        settings (Dict[str, Any]): Arguments of full_inference_program
+        fp16 (bool): Whether the device supports FP16 inference
+    """
+    model_names = [
+        settings["vocal_model"],
+        settings["karaoke_model"],
+        settings["dereverb_model"],
+    ]
+    if settings["denoise"]:
+        model_names.append(settings["denoise_model"])
+    for model_name in model_names:
+        prepare_separation_model(get_model_info_by_name(model_name), fp16)
+
+
+def add_inference_stages(
+    graph: StageGraph,
+    source: Source,
+    settings: Dict[str, Any],
+    devices: str,
+    prefix: str = "",
+) -> str:
+    """
+    Add the full inference stages of a song to a graph.
+    
+    Args:
+        graph (StageGraph): Graph to add the stages to
+        source (Source): The song
+        settings (Dict[str, Any]): Arguments of full_inference_program
+        devices (str): Devices as returned by setup_devices
+        prefix (str): Prefix of the stage names, to add several songs to one graph
+        
+    Returns:
+        str: Name of the final merge stage
+    """
+    batch_size = settings["batch_size"]
+    use_tta = settings["use_tta"]
+
+    def add(kind, func, inputs, **kwargs):
+        return graph.add(prefix + kind, func, inputs, kind=kind, **kwargs)
+
+    # Step 1: Separate vocals
+    model_info = get_model_info_by_name(settings["vocal_model"])
+    vocals = add(
+        "vocals",
+        stage_separate_vocals,
+        {"audio": source},
+        params={"model_name": settings["vocal_model"]},
+        options={"devices": devices},
+        fingerprint=separation_fingerprint(model_info),
+        resources=["model"],
+    )
+
+    # Step 2: Karaoke separation
+    model_info = get_model_info_by_name(settings["karaoke_model"])
+    karaoke = add(
+        "karaoke",
+        stage_karaoke,
+        {"audio": (vocals, "vocals")},
+        params=dict(
+            model_name=settings["karaoke_model"],
+            **uvr_settings(model_info, batch_size, use_tta),
+        ),
+        options={"devices": devices},
+        fingerprint=separation_fingerprint(model_info),
+        resources=["model"],
+    )
+
+    # Step 3: Dereverb
+    model_info = get_model_info_by_name(settings["dereverb_model"])
+    lead_vocals = (
+        add(
+            "dereverb",
+            stage_dereverb,
+            {"audio": (karaoke, "lead")},
+            params=dict(
+                model_name=settings["dereverb_model"],
+                **uvr_settings(model_info, batch_size, use_tta),
+            ),
+            options={"devices": devices},
+            fingerprint=separation_fingerprint(model_info),
+            resources=["model"],
+        ),
+        "audio",
+    )
+
+    # Step 4: Deecho (if requested)
+    if settings["deecho"]:
+        model_info = get_model_info_by_name(settings["deecho_model"])
+        lead_vocals = (
+            add(
+                "deecho",
+                stage_deecho,
+                {"audio": lead_vocals},
+                params=dict(
+                    model_name=settings["deecho_model"],
+                    **uvr_settings(model_info, batch_size, use_tta),
+                ),
+                resources=["model"],
+            ),
+            "audio",
+        )
+
+    # Step 5: Denoise (if requested)
+    if settings["denoise"]:
+        model_info = get_model_info_by_name(settings["denoise_model"])
+        lead_vocals = (
+            add(
+                "denoise",
+                stage_denoise,
+                {"audio": lead_vocals},
+                params=dict(
+                    model_name=settings["denoise_model"],
+                    **uvr_settings(model_info, batch_size, use_tta),
+                ),
+                options={"devices": devices},
+                fingerprint=separation_fingerprint(model_info),
+                resources=["model"],
+            ),
+            "audio",
+        )
+
+    # Step 6: Apply RVC voice conversion
+    converted_vocals = (
+        add(
+            "rvc",
+            stage_rvc,
+            {"audio": lead_vocals},
+            params={
+                "model_path": settings["model_path"],
+                "index_path": settings["index_path"],
+                "embedder_model": settings["embedder_model"],
+                "pitch": settings["pitch"],
+                "f0_method": settings["pitch_extract"],
+                "filter_radius": settings["filter_radius"],
+                "index_rate": settings["index_rate"],
+                "volume_envelope": settings["rms_mix_rate"],
+                "protect": settings["protect"],
+                "split_audio": settings["split_audio"],
+                "f0_autotune": settings["autotune"],
+                "hop_length": settings["hop_lenght"],
+            },
+            fingerprint={
+                "model": file_identity(settings["model_path"]),
+                "index": file_identity(settings["index_path"]),
+            },
+            resources=["model", "rvc"],
+        ),
+        "audio",
+    )
+
+    # Step 7: Process backing vocals (if requested)
+    backing_vocals = (karaoke, "backing")
+    if settings["infer_backing_vocals"]:
+        backing_vocals = (
+            add(
+                "backing_rvc",
+                stage_rvc,
+                {"audio": backing_vocals},
+                params={
+                    "model_path": settings["infer_backing_vocals_model"],
+                    "index_path": settings["infer_backing_vocals_index"],
+                    "embedder_model": settings["embedder_model_back"],
+                    "pitch": settings["pitch_back"],
+                    "f0_method": settings["pitch_extract_back"],
+                    "filter_radius": settings["filter_radius_back"],
+                    "index_rate": settings["index_rate_back"],
+                    "volume_envelope": settings["rms_mix_rate_back"],
+                    "protect": settings["protect_back"],
+                    "split_audio": settings["split_audio_back"],
+                    "f0_autotune": settings["autotune_back"],
+                    "hop_length": settings["hop_length_back"],
+                },
+                fingerprint={
+                    "model": file_identity(settings["infer_backing_vocals_model"]),
+                    "index": file_identity(settings["infer_backing_vocals_index"]),
+                },
+                resources=["model", "rvc"],
+            ),
+            "audio",
+        )
+
+    # Step 8: Apply post-processing (pitch shift; the vocal effects run in the merge)
+    instrumental = (vocals, "instrumental")
+    if settings["change_inst_pitch"] != 0:
+        instrumental = (
+            add(
+                "instrumental_pitch",
+                stage_instrumental_pitch,
+                {"audio": instrumental},
+                params={"semitones": settings["change_inst_pitch"]},
+            ),
+            "audio",
+        )
+
+    # Step 9: Merge all audio tracks
+    return add(
+        "merge",
+        stage_merge,
+        {
+            "vocals": converted_vocals,
+            "instrumental": instrumental,
+            "backing": backing_vocals,
+        },
+        params={
+            "vocals_volume": settings["vocals_volume"],
+            "instrumentals_volume": settings["instrumentals_volume"],
+            "backing_vocals_volume": settings["backing_vocals_volume"],
+            "export_format": settings["export_format_final"],
+            "vocal_effects": vocal_effects_chain(settings),
+        },
+    )
+
+
+def vocal_effects_chain(settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The reverb of the settings, if enabled, followed by their custom vocal effects."""
+    chain = []
+    if settings["reverb"]:
+        chain.append(
+            reverb_effect(
+                settings["reverb_room_size"],
+                settings["reverb_wet_gain"],
+                settings["reverb_dry_gain"],
+                settings["reverb_damping"],
+                settings["reverb_width"],
+            )
+        )
+    return chain + list(settings.get("vocal_effects") or [])
+
+
+def song_folder(input_audio_path: str, input_hash: Optional[str] = None) -> str:
+    """
+    Name of a song's folder in audio_files: the song's name, followed by the start of
+    its content hash when given so songs of a batch sharing a name (e.g. song.mp3 and
+    song.wav) keep their outputs apart.
+    """
+    music_folder = os.path.splitext(os.path.basename(input_audio_path))[0]
+    return f"{music_folder}_{input_hash[:8]}" if input_hash else music_folder
+
+
+def song_final_path(
+    input_audio_path: str, export_format: str, music_folder: Optional[str] = None
+) -> str:
+    """Path of a song's final mix: audio_files/<folder>/final/<song>_final.<format>."""
+    return os.path.join(
+        now_dir,
+        "audio_files",
+        music_folder or song_folder(input_audio_path),
+        "final",
+        f"{os.path.basename(input_audio_path).split('.')[0]}_final.{export_format.lower()}",
+    )
+
+
+def run_song(
+    graph: StageGraph,
+    merge: str,
+    input_audio_path: str,
+    settings: Dict[str, Any],
+    music_folder: Optional[str] = None,
+) -> str:
+    """
+    Run a song's stages, copy its mix to the final folder and clean up as requested.
+    
+    Args:
+        graph (StageGraph): Graph holding the song's stages
+        merge (str): Name of the song's merge stage
+        input_audio_path (str): Path to the song
+        settings (Dict[str, Any]): Arguments of full_inference_program
+        music_folder (str, optional): Folder of the song's outputs in audio_files,
+            see song_folder. Named after the song by default
+        
+    Returns:
+        str: Path to the final output audio file
+    """
+    music_folder = music_folder or song_folder(input_audio_path)
+    input_audio_basename = os.path.splitext(os.path.basename(input_audio_path))[0]
+    final_output_path = song_final_path(
+        input_audio_path, settings["export_format_final"], music_folder
+    )
+    os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
+    with graph:
+        try:
+            merged = graph.run(merge)[merge]["audio"]
+            shutil.copyfile(merged, final_output_path)
+            print("Audios merged successfully")
+            print(graph.format_timeline())
+        except Exception as e:
+            logging.error(f"Full inference failed for {input_audio_basename}: {e}")
+            raise
+        if not settings["delete_audios"]:
+            # The converted vocals are kept in their chosen formats, the outputs of
+            # the other stages only on request
+            export_intermediates(
+                graph,
+                os.path.join(now_dir, "audio_files", music_folder),
+                {
+                    "rvc": settings["export_format_rvc"],
+                    "backing_rvc": settings["export_format_rvc_back"],
+                },
+                None if keep_intermediates() else ["rvc", "backing_rvc"],
+            )
+
+    # Step 10: Cleanup (if requested)
+    if settings["delete_audios"]:
+        print("Cleaning up temporary files...")
+        if graph.cache is not None:
+            for name in graph.stages:
+                graph.cache.remove(graph.key(name))
+        main_directory = os.path.join(now_dir, "audio_files", music_folder)
+        folder_to_keep = "final"
+        for folder_name in os.listdir(main_directory):
+            folder_path = os.path.join(main_directory, folder_name)
+            if os.path.isdir(folder_path) and folder_name != folder_to_keep:
+                shutil.rmtree(folder_path)
+    return final_output_path
+
+
 @track_presence("Infer the Audio")
 def full_inference_program(
     model_path: str,
@@ -496,6 +1457,9 @@ def full_inference_program(
     split_audio_back: bool,
     autotune_back: bool,
     embedder_model_back: str,
+    vocal_effects: Optional[List[Dict[str, Any]]] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Tuple[str, str]:
     """
     Main inference function that orchestrates the entire audio processing pipeline.
@@ -514,7 +1478,7 @@ def full_inference_program(
         index_path (str): Path to the index file for the model
         input_audio_path (str): Path to the input audio file
         output_path (str): Path to save the final output (not used in this implementation)
-        export_format_rvc (str): Audio format for RVC output (e.g. 'wav', 'flac')
+        export_format_rvc (str): Audio format of the kept RVC output (e.g. 'wav', 'flac')
         split_audio (bool): Whether to split audio for processing
         autotune (bool): Whether to apply autotune
         vocal_model (str): Name of the vocal separation model
@@ -557,584 +1521,230 @@ def full_inference_program(
         protect_back (float): Protect value for backing vocals
         pitch_extract_back (str): Pitch extraction method for backing vocals
         hop_length_back (int): Hop length for backing vocal processing
-        export_format_rvc_back (str): Export format for backing vocal output
+        export_format_rvc_back (str): Export format of the kept backing vocal output
         split_audio_back (bool): Whether to split audio for backing vocal processing
         autotune_back (bool): Whether to apply autotune to backing vocals
         embedder_model_back (str): Embedder model for backing vocals
+        vocal_effects (List[Dict[str, Any]], optional): Effects applied to the converted
+            vocals after the reverb while mixing, e.g. EQ, compression or a limiter,
+            see EffectsChain
+        progress_callback (Callable, optional): Called with every stage event, in
+            addition to the configured telemetry sinks, e.g. a ProgressSink
+        cancel_event (threading.Event, optional): Stops the run between stages once
+            set, raising Cancelled
         
     Returns:
         Tuple[str, str]: A tuple containing:
             - Status message indicating success
             - Path to the final output audio file
     """
-    # Device setup
-    if torch.cuda.is_available():
-        n_gpu = torch.cuda.device_count()
-        devices = devices.replace("-", " ")
-        print(f"Number of GPUs available: {n_gpu}")
-        first_device = devices.split()[0] if devices else "cpu"
-        fp16 = check_fp16_support(first_device)
-    else:
-        devices = "cpu"
-        print("Using CPU")
-        fp16 = False
+    settings = dict(locals())
+    del settings["progress_callback"], settings["cancel_event"]
+    devices, fp16 = setup_devices(devices)
+    prepare_inference_models(settings, fp16)
+
+    # Every stage is keyed by its input content, model and parameters, so only the
+    # stages affected by a change run again and the rest come from the stage cache.
+    # Stems are passed between the stages in memory as float32, and stages that don't
+    # depend on each other (e.g. the lead vocal chain, the backing vocal conversion and
+    # the instrumental pitch change) run concurrently.
+    graph = StageGraph(
+        get_stage_cache(),
+        stage_concurrency()["workers"],
+        pool=get_resource_pool(),
+        telemetry=get_telemetry(progress_callback, song=input_audio_path),
+        cancel=cancel_event,
+    )
+    merge = add_inference_stages(graph, Source(input_audio_path), settings, devices)
+    result = run_song(graph, merge, input_audio_path, settings)
 
-    # Initialize variables
-    music_folder = os.path.splitext(os.path.basename(input_audio_path))[0]
-    input_audio_basename = os.path.splitext(os.path.basename(input_audio_path))[0]
+    return (
+        f"Audio file {os.path.basename(input_audio_path).split('.')[0]} converted with success",
+        result,
+    )
 
-    # Step 1: Separate vocals
-    vocals_dir = os.path.join(now_dir, "audio_files", music_folder, "vocals")
-    inst_dir = os.path.join(now_dir, "audio_files", music_folder, "instrumentals")
-    os.makedirs(vocals_dir, exist_ok=True)
-    os.makedirs(inst_dir, exist_ok=True)
-    
-    model_info = get_model_info_by_name(vocal_model)
-    
-    # Download model if necessary
-    model_ckpt_path = os.path.join(model_info["path"], "model.ckpt")
-    if not os.path.exists(model_ckpt_path):
-        download_file(model_info["model_url"], model_info["path"], "model.ckpt")
-    
-    config_json_path = os.path.join(model_info["path"], "config.yaml")
-    if not os.path.exists(config_json_path):
-        download_file(model_info["config_url"], model_info["path"], "config.yaml")
-    
-    if not fp16:
-        with open(model_info["config"], "r") as file:
-            config = yaml.safe_load(file)
-        config["training"]["use_amp"] = False
-        with open(model_info["config"], "w") as file:
-            yaml.safe_dump(config, file)
-    
-    search_result = search_with_word(vocals_dir, "vocals")
-    if search_result:
-        print("Vocals already separated...")
-    else:
-        print("Separating vocals...")
-        command = [
-            "python",
-            os.path.join(now_dir, "programs", "music_separation_code", "inference.py"),
-            "--model_type", model_info["type"],
-            "--config_path", model_info["config"],
-            "--start_check_point", model_info["model"],
-            "--input_file", input_audio_path,
-            "--store_dir", vocals_dir,
-            "--flac_file", "--pcm_type", "PCM_16",
-            "--extract_instrumental",
-        ]
-
-        if devices == "cpu":
-            command.append("--force_cpu")
-        else:
-            device_ids = [str(int(device)) for device in devices.split()]
-            command.extend(["--device_ids"] + device_ids)
 
-        try:
-            subprocess.run(command, check=True, timeout=300)  # 5 minute timeout
-        except subprocess.TimeoutExpired:
-            logging.error(f"Vocal separation command timed out: {' '.join(command)}")
-            raise
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Vocal separation failed with return code {e.returncode}: {' '.join(command)}")
-            raise
-        
-        # Rename instrumental file
-        instrumental_file = search_with_two_words(
-            vocals_dir,
-            os.path.basename(input_audio_path).split(".")[0],
-            "instrumental",
-        )
-        if instrumental_file:
-            try:
-                os.rename(
-                    os.path.join(vocals_dir, instrumental_file),
-                    os.path.join(
-                        inst_dir,
-                        f"{os.path.basename(input_audio_path).split('.')[0]}_instrumentals.flac",
-                    ),
-                )
-            except OSError as e:
-                logging.error(f"Failed to rename instrumental file: {e}")
-                raise
-    
-    inst_file = os.path.join(
-        inst_dir,
-        search_with_two_words(
-            inst_dir, os.path.basename(input_audio_path).split(".")[0], "instrumentals"
-        ),
-    )
+# Decoded stems a song keeps in memory at most, for the batch memory estimate
+STEMS_PER_SONG = 16
 
-    # Step 2: Karaoke separation
-    karaoke_dir = os.path.join(now_dir, "audio_files", music_folder, "karaoke")
-    os.makedirs(karaoke_dir, exist_ok=True)
-    
-    vocals_file = search_with_word(vocals_dir, "vocals")
-    input_file = os.path.join(vocals_dir, vocals_file) if vocals_file else None
-    
-    model_info = get_model_info_by_name(karaoke_model)
-    if model_info["name"] == "Mel-Roformer Karaoke by aufr33 and viperx":
-        # Handle Mel-Roformer model
-        model_ckpt_path = os.path.join(model_info["path"], "model.ckpt")
-        if not os.path.exists(model_ckpt_path):
-            download_file(model_info["model_url"], model_info["path"], "model.ckpt")
-        
-        config_json_path = os.path.join(model_info["path"], "config.yaml")
-        if not os.path.exists(config_json_path):
-            download_file(model_info["config_url"], model_info["path"], "config.yaml")
-        
-        if not fp16:
-            with open(model_info["config"], "r") as file:
-                config = yaml.safe_load(file)
-            config["training"]["use_amp"] = False
-            with open(model_info["config"], "w") as file:
-                yaml.safe_dump(config, file)
-        
-        if input_file:
-            command = [
-                "python",
-                os.path.join(now_dir, "programs", "music_separation_code", "inference.py"),
-                "--model_type", model_info["type"],
-                "--config_path", model_info["config"],
-                "--start_check_point", model_info["model"],
-                "--input_file", input_file,
-                "--store_dir", karaoke_dir,
-                "--flac_file", "--pcm_type", "PCM_16",
-                "--extract_instrumental",
-            ]
-            
-            if devices == "cpu":
-                command.append("--force_cpu")
-            else:
-                device_ids = [str(int(device)) for device in devices.split()]
-                command.extend(["--device_ids"] + device_ids)
-            
-            subprocess.run(command, check=True)
-    else:
-        # Handle VR model (UVR-BVE)
-        separator = Separator(
-            model_file_dir=os.path.join(now_dir, "models", "karaoke"),
-            log_level=logging.WARNING,
-            normalization_threshold=1.0,
-            output_format="flac",
-            output_dir=karaoke_dir,
-            vr_params={
-                "batch_size": batch_size,
-                "enable_tta": use_tta,
-            },
-        )
-        separator.load_model(model_filename=model_info["full_name"])
-        if input_file:
-            separator.separate(input_file)
-        
-        vocals_result = search_with_two_words(
-            karaoke_dir,
-            os.path.basename(input_audio_path).split(".")[0],
-            "Vocals",
-        )
-        instrumental_result = search_with_two_words(
-            karaoke_dir,
-            os.path.basename(input_audio_path).split(".")[0],
-            "Instrumental",
-        )
-        
-        if vocals_result and "UVR-BVE-4B_SN-44100-1" in os.path.basename(vocals_result):
-            os.rename(
-                os.path.join(karaoke_dir, vocals_result),
-                os.path.join(
-                    karaoke_dir,
-                    f"{os.path.basename(input_audio_path).split('.')[0]}_karaoke.flac",
-                ),
-            )
-        if instrumental_result and "UVR-BVE-4B_SN-44100-1" in os.path.basename(instrumental_result):
-            os.rename(
-                os.path.join(karaoke_dir, instrumental_result),
-                os.path.join(
-                    karaoke_dir,
-                    f"{os.path.basename(input_audio_path).split('.')[0]}_instrumental.flac",
-                ),
-            )
 
-    # Step 3: Dereverb
-    dereverb_dir = os.path.join(now_dir, "audio_files", music_folder, "dereverb")
-    os.makedirs(dereverb_dir, exist_ok=True)
-    
-    karaoke_file = search_with_word(karaoke_dir, "karaoke")
-    input_file = os.path.join(karaoke_dir, karaoke_file) if karaoke_file else None
+def song_memory(input_audio_path: str) -> int:
+    """
+    Estimate the memory the in-memory stems of a song take during full inference.
     
-    model_info = get_model_info_by_name(dereverb_model)
-    if model_info["name"] in ["BS-Roformer Dereverb by anvuew", "MDX23C DeReverb by aufr33 and jarredou"]:
-        # Handle model-specific dereverb
-        model_ckpt_path = os.path.join(model_info["path"], "model.ckpt")
-        if not os.path.exists(model_ckpt_path):
-            download_file(model_info["model_url"], model_info["path"], "model.ckpt")
-        
-        config_json_path = os.path.join(model_info["path"], "config.yaml")
-        if not os.path.exists(config_json_path):
-            download_file(model_info["config_url"], model_info["path"], "config.yaml")
-        
-        if not fp16:
-            with open(model_info["config"], "r") as file:
-                config = yaml.safe_load(file)
-            config["training"]["use_amp"] = False
-            with open(model_info["config"], "w") as file:
-                yaml.safe_dump(config, file)
-        
-        if input_file:
-            command = [
-                "python",
-                os.path.join(now_dir, "programs", "music_separation_code", "inference.py"),
-                "--model_type", model_info["type"],
-                "--config_path", model_info["config"],
-                "--start_check_point", model_info["model"],
-                "--input_file", input_file,
-                "--store_dir", dereverb_dir,
-                "--flac_file", "--pcm_type", "PCM_16",
-            ]
-            
-            if devices == "cpu":
-                command.append("--force_cpu")
-            else:
-                device_ids = [str(int(device)) for device in devices.split()]
-                command.extend(["--device_ids"] + device_ids)
-            
-            subprocess.run(command, check=True)
-    else:
-        # Handle VR models
-        separator = Separator(
-            model_file_dir=os.path.join(now_dir, "models", "dereverb"),
-            log_level=logging.WARNING,
-            normalization_threshold=1.0,
-            output_format="flac",
-            output_dir=dereverb_dir,
-            output_single_stem="No Reverb",
-            vr_params={"batch_size": batch_size, "enable_tta": use_tta} if model_info["arch"] == "vr" else None,
-        )
-        separator.load_model(model_filename=model_info["full_name"])
-        if input_file:
-            separator.separate(input_file)
-        
-        search_result = search_with_two_words(
-            dereverb_dir,
-            os.path.basename(input_audio_path).split(".")[0],
-            "No Reverb",
-        )
+    Args:
+        input_audio_path (str): Path to the song
         
-        if search_result and ("UVR-DeEcho-DeReverb" in os.path.basename(search_result) or 
-                             "MDX Reverb HQ by FoxJoy" in os.path.basename(search_result)):
-            os.rename(
-                os.path.join(dereverb_dir, search_result),
-                os.path.join(
-                    dereverb_dir,
-                    f"{os.path.basename(input_audio_path).split('.')[0]}_noreverb.flac",
-                ),
-            )
+    Returns:
+        int: Estimated size in bytes
+    """
+    try:
+        duration = sf.info(input_audio_path).duration
+    except RuntimeError:
+        duration = librosa.get_duration(path=input_audio_path)
+    # Stereo float32 at 44.1 kHz
+    return int(duration * 44100 * 2 * 4 * STEMS_PER_SONG)
 
-    # Step 4: Deecho (if requested)
-    deecho_dir = os.path.join(now_dir, "audio_files", music_folder, "deecho")
-    os.makedirs(deecho_dir, exist_ok=True)
-    if deecho:
-        print("Removing echo...")
-        model_info = get_model_info_by_name(deecho_model)
-
-        noreverb_file = search_with_word(dereverb_dir, "noreverb")
-        input_file = os.path.join(dereverb_dir, noreverb_file) if noreverb_file else None
-
-        if input_file:
-            separator = Separator(
-                model_file_dir=os.path.join(now_dir, "models", "deecho"),
-                log_level=logging.WARNING,
-                normalization_threshold=1.0,
-                output_format="flac",
-                output_dir=deecho_dir,
-                output_single_stem="No Echo",
-                vr_params={
-                    "batch_size": batch_size,
-                    "enable_tta": use_tta,
-                },
-            )
-            separator.load_model(model_filename=model_info["full_name"])
-            separator.separate(input_file)
-            
-            search_result = search_with_two_words(
-                deecho_dir,
-                os.path.basename(input_audio_path).split(".")[0],
-                "No Echo",
-            )
-            
-            if search_result and ("UVR-De-Echo-Normal" in os.path.basename(search_result) or 
-                                 "UVR-Deecho-Agggressive" in os.path.basename(search_result)):
-                os.rename(
-                    os.path.join(deecho_dir, search_result),
-                    os.path.join(
-                        deecho_dir,
-                        f"{os.path.basename(input_audio_path).split('.')[0]}_noecho.flac",
-                    ),
-                )
 
-    # Step 5: Denoise (if requested)
-    denoise_dir = os.path.join(now_dir, "audio_files", music_folder, "denoise")
-    os.makedirs(denoise_dir, exist_ok=True)
-    if denoise:
-        model_info = get_model_info_by_name(denoise_model)
-        print("Removing noise")
-        
-        # Determine input file based on processing chain
-        if deecho:
-            # Use deecho output if deecho was applied
-            deecho_file = search_with_word(deecho_dir, "noecho")
-            input_file = os.path.join(deecho_dir, deecho_file) if deecho_file else None
-        else:
-            # Use dereverb output otherwise
-            noreverb_file = search_with_word(dereverb_dir, "noreverb")
-            input_file = os.path.join(dereverb_dir, noreverb_file) if noreverb_file else None
-
-        if input_file and (model_info["name"] == "Mel-Roformer Denoise Normal by aufr33" or 
-                          model_info["name"] == "Mel-Roformer Denoise Aggressive by aufr33"):
-            model_ckpt_path = os.path.join(model_info["path"], "model.ckpt")
-            if not os.path.exists(model_ckpt_path):
-                download_file(model_info["model_url"], model_info["path"], "model.ckpt")
-            
-            config_json_path = os.path.join(model_info["path"], "config.yaml")
-            if not os.path.exists(config_json_path):
-                download_file(model_info["config_url"], model_info["path"], "config.yaml")
-            
-            if not fp16:
-                with open(model_info["config"], "r") as file:
-                    config = yaml.safe_load(file)
-                config["training"]["use_amp"] = False
-                with open(model_info["config"], "w") as file:
-                    yaml.safe_dump(config, file)
-            
-            command = [
-                "python",
-                os.path.join(now_dir, "programs", "music_separation_code", "inference.py"),
-                "--model_type", model_info["type"],
-                "--config_path", model_info["config"],
-                "--start_check_point", model_info["model"],
-                "--input_file", input_file,
-                "--store_dir", denoise_dir,
-                "--flac_file", "--pcm_type", "PCM_16",
-            ]
-            
-            if devices == "cpu":
-                command.append("--force_cpu")
-            else:
-                device_ids = [str(int(device)) for device in devices.split()]
-                command.extend(["--device_ids"] + device_ids)
-            
-            try:
-                subprocess.run(command, check=True, timeout=300)  # 5 minute timeout
-            except subprocess.TimeoutExpired:
-                logging.error(f"Denoise separation command timed out: {' '.join(command)}")
-                raise
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Denoise separation failed with return code {e.returncode}: {' '.join(command)}")
-                raise
-        elif input_file:
-            # Handle VR models
-            separator = Separator(
-                model_file_dir=os.path.join(now_dir, "models", "denoise"),
-                log_level=logging.WARNING,
-                normalization_threshold=1.0,
-                output_format="flac",
-                output_dir=denoise_dir,
-                output_single_stem="No Noise",
-                vr_params={
-                    "batch_size": batch_size,
-                    "enable_tta": use_tta,
-                },
-            )
-            separator.load_model(model_filename=model_info["full_name"])
-            separator.separate(input_file)
-            
-            search_result = search_with_two_words(
-                denoise_dir,
-                os.path.basename(input_audio_path).split(".")[0],
-                "No Noise",
+def batch_memory_budget() -> Optional[int]:
+    """performance.batch_memory_gb from the config in bytes (8 GB by default, null for no limit)."""
+    with open(config_file, "r", encoding="utf8") as file:
+        performance = json.load(file).get("performance", {})
+    budget_gb = performance.get("batch_memory_gb", 8)
+    return int(budget_gb * 2**30) if budget_gb is not None else None
+
+
+def list_songs(input_audio_paths: Union[str, List[str]]) -> List[str]:
+    """Expand a folder of songs, or a list of files and folders, into sorted song paths."""
+    if isinstance(input_audio_paths, str):
+        input_audio_paths = [input_audio_paths]
+    songs = []
+    for path in input_audio_paths:
+        if os.path.isdir(path):
+            songs.extend(
+                sorted(
+                    os.path.join(path, file)
+                    for file in os.listdir(path)
+                    if file.lower().endswith(AUDIO_EXTENSIONS)
+                )
             )
-            if search_result and "UVR Denoise" in os.path.basename(search_result):
-                os.rename(
-                    os.path.join(denoise_dir, search_result),
-                    os.path.join(
-                        denoise_dir,
-                        f"{os.path.basename(input_audio_path).split('.')[0]}_dry.flac",
-                    ),
+        else:
+            songs.append(path)
+    return songs
+
+
+@track_presence("Infer a batch of songs")
+def full_inference_batch(
+    input_audio_paths: Union[str, List[str]],
+    max_songs: int = 3,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    **settings: Any,
+) -> Tuple[str, List[str]]:
+    """
+    Run full inference on several songs, pipelined so one song can be separated while
+    the previous one is converted and the one before is mixed and encoded.
+    
+    Every song runs its own stage graph, but all of them share the stage cache, the
+    loaded models and one set of resource limits, so the model stages of different
+    songs queue for the same slots. Songs are started in order while the estimated
+    memory of the songs in flight fits in performance.batch_memory_gb. A manifest in
+    audio_files records every finished song with the hash of its content and settings,
+    so an interrupted batch skips them when it's started again, and the stage cache
+    resumes the song that was in progress. The outputs of each song go to
+    audio_files/<song>_<start of its content hash>, so songs sharing a name don't
+    overwrite or clean up each other's files.
+    
+    Args:
+        input_audio_paths (Union[str, List[str]]): Songs, or folders of songs
+        max_songs (int): Maximum number of songs in flight
+        progress_callback (Callable, optional): Called with the stage events of every
+            song, e.g. a ProgressSink
+        cancel_event (threading.Event, optional): Stops the batch between stages once
+            set, raising Cancelled. The unfinished songs are converted by the next run
+        **settings (Any): Arguments of full_inference_program except input_audio_path
+        
+    Returns:
+        Tuple[str, List[str]]: A tuple containing:
+            - Status message
+            - Paths to the final output audio files of the converted songs
+    """
+    songs = list_songs(input_audio_paths)
+    devices, fp16 = setup_devices(settings["devices"])
+    prepare_inference_models(settings, fp16)
+
+    cache = get_stage_cache()
+    concurrency = stage_concurrency()
+    pool = get_resource_pool()
+    budget = MemoryBudget(batch_memory_budget())
+    os.makedirs(os.path.join(now_dir, "audio_files"), exist_ok=True)
+    manifest = BatchManifest(
+        os.path.join(now_dir, "audio_files", "full_inference_batch.json")
+    )
+    params_hash = hash_params(
+        {
+            "settings": {
+                name: value
+                for name, value in settings.items()
+                if name not in ("devices", "delete_audios", "output_path")
+            },
+            "models": {
+                name: file_identity(settings[name])
+                for name in (
+                    "model_path",
+                    "index_path",
+                    "infer_backing_vocals_model",
+                    "infer_backing_vocals_index",
                 )
-
-    # Step 6: Apply RVC voice conversion
-    # Determine final input path based on processing chain
-    if denoise:
-        dry_file = search_with_two_words(denoise_dir, os.path.basename(input_audio_path).split(".")[0], "dry")
-        final_path = os.path.join(denoise_dir, dry_file) if dry_file else None
-    elif deecho:
-        noecho_file = search_with_two_words(deecho_dir, os.path.basename(input_audio_path).split(".")[0], "noecho")
-        final_path = os.path.join(deecho_dir, noecho_file) if noecho_file else None
-    elif search_with_word(dereverb_dir, "noreverb"):
-        noreverb_file = search_with_word(dereverb_dir, "noreverb")
-        final_path = os.path.join(dereverb_dir, noreverb_file) if noreverb_file else None
-    else:
-        final_path = None
-
-    rvc_dir = os.path.join(now_dir, "audio_files", music_folder, "rvc")
-    os.makedirs(rvc_dir, exist_ok=True)
-    print("Making RVC inference...")
-    output_rvc = os.path.join(
-        rvc_dir,
-        f"{os.path.basename(input_audio_path).split('.')[0]}_rvc.wav",
+            },
+        }
     )
-    
-    try:
-        inference_vc = import_voice_converter()
-        inference_vc.convert_audio(
-            audio_input_path=final_path,
-            audio_output_path=output_rvc,
-            model_path=model_path,
-            index_path=index_path,
-            embedder_model=embedder_model,
-            pitch=pitch,
-            f0_file=None,
-            f0_method=pitch_extract,
-            filter_radius=filter_radius,
-            index_rate=index_rate,
-            volume_envelope=rms_mix_rate,
-            protect=protect,
-            split_audio=split_audio,
-            f0_autotune=autotune,
-            hop_length=hop_lenght,
-            export_format=export_format_rvc,
-            embedder_model_custom=None,
-        )
-        logging.info(f"RVC conversion completed successfully for {input_audio_basename}")
-    except Exception as e:
-        logging.error(f"RVC conversion failed for {input_audio_basename}: {e}")
-        raise
 
-    # Step 7: Process backing vocals (if requested)
-    backing_vocals = os.path.join(karaoke_dir, search_with_word(karaoke_dir, "instrumental"))
-    if infer_backing_vocals:
-        print("Inferring backing vocals...")
-        instrumental_file = search_with_word(karaoke_dir, "instrumental")
-        if instrumental_file:
-            input_file = os.path.join(karaoke_dir, instrumental_file)
-            output_backing_vocals = os.path.join(
-                karaoke_dir, f"{input_audio_basename}_instrumental_output.wav"
-            )
-            inference_vc.convert_audio(
-                audio_input_path=input_file,
-                audio_output_path=output_backing_vocals,
-                model_path=infer_backing_vocals_model,
-                index_path=infer_backing_vocals_index,
-                embedder_model=embedder_model_back,
-                pitch=pitch_back,
-                f0_file=None,
-                f0_method=pitch_extract_back,
-                filter_radius=filter_radius_back,
-                index_rate=index_rate_back,
-                volume_envelope=rms_mix_rate_back,
-                protect=protect_back,
-                split_audio=split_audio_back,
-                f0_autotune=autotune_back,
-                hop_length=hop_length_back,
-                export_format=export_format_rvc_back,
-                embedder_model_custom=None,
-            )
-            backing_vocals = output_backing_vocals
-
-    # Step 8: Apply post-processing (reverb, pitch shift)
-    if reverb:
-        print("Applying reverb...")
-        last_rvc_file = get_last_modified_file(rvc_dir)
-        if last_rvc_file:
-            input_file = os.path.join(rvc_dir, last_rvc_file)
-            output_file = os.path.join(
-                rvc_dir,
-                os.path.basename(input_audio_path),
+    def process(song, source, memory, music_folder):
+        try:
+            graph = StageGraph(
+                cache,
+                concurrency["workers"],
+                pool=pool,
+                telemetry=get_telemetry(progress_callback, song=song),
+                cancel=cancel_event,
             )
-            add_audio_effects(
-                input_file,
-                reverb_room_size,
-                reverb_wet_gain,
-                reverb_dry_gain,
-                reverb_damping,
-                reverb_width,
-                output_file,
+            merge = add_inference_stages(graph, source, settings, devices)
+            result = run_song(graph, merge, song, settings, music_folder)
+            manifest.update(os.path.abspath(song), status="done", output=result)
+            return result
+        except Cancelled:
+            return None
+        except Exception as e:
+            logging.exception(f"Full inference failed for {song}: {e}")
+            manifest.update(os.path.abspath(song), status="failed", error=str(e))
+            return None
+        finally:
+            budget.release(memory)
+
+    results = []
+    futures = []
+    print(f"Converting {len(songs)} songs...")
+    with ThreadPoolExecutor(max(1, int(max_songs))) as executor:
+        for song in songs:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            input_hash = hash_file(song)
+            music_folder = song_folder(song, input_hash)
+            final_output_path = song_final_path(
+                song, settings["export_format_final"], music_folder
             )
-    
-    if change_inst_pitch != 0:
-        print("Changing instrumental pitch...")
-        inst_path = os.path.join(
-            now_dir,
-            "audio_files",
-            music_folder,
-            "instrumentals",
-            search_with_word(
-                os.path.join(now_dir, "audio_files", music_folder, "instrumentals"),
-                "instrumentals",
-            ),
-        )
-        if os.path.exists(inst_path):
-            audio = AudioSegment.from_file(inst_path)
-            factor = 2 ** (change_inst_pitch / 12)
-            new_frame_rate = int(audio.frame_rate * factor)
-            audio = audio._spawn(audio.raw_data, overrides={"frame_rate": new_frame_rate})
-            audio = audio.set_frame_rate(audio.frame_rate)
-            
-            output_dir_pitch = os.path.join(
-                now_dir, "audio_files", music_folder, "instrumentals"
+            if manifest.is_done(
+                os.path.abspath(song), input_hash, params_hash, final_output_path
+            ):
+                print(f"Skipping '{song}', already converted with these settings.")
+                results.append(final_output_path)
+                continue
+            manifest.update(
+                os.path.abspath(song),
+                input_hash=input_hash,
+                params_hash=params_hash,
+                output=final_output_path,
+                status="pending",
             )
-            output_path_pitch = os.path.join(
-                output_dir_pitch, "inst_with_changed_pitch.flac"
+            memory = song_memory(song)
+            # Blocks until enough of the songs in flight are done
+            budget.acquire(memory)
+            source = Source(song, content_hash=input_hash)
+            futures.append(
+                executor.submit(process, song, source, memory, music_folder)
             )
-            audio.export(output_path_pitch, format="flac")
-
-    # Step 9: Merge all audio tracks
-    final_dir = os.path.join(now_dir, "audio_files", music_folder, "final")
-    os.makedirs(final_dir, exist_ok=True)
-
-    # Determine vocals file to use
-    last_rvc_file = get_last_modified_file(rvc_dir)
-    vocals_file = os.path.join(rvc_dir, last_rvc_file) if last_rvc_file else output_rvc
-
-    # Determine karaoke file to use
-    karaoke_file = search_with_word(karaoke_dir, "Instrumental") or search_with_word(karaoke_dir, "instrumental")
-    karaoke_file = os.path.join(karaoke_dir, karaoke_file) if karaoke_file else None
-    
-    final_output_path = os.path.join(
-        final_dir,
-        f"{os.path.basename(input_audio_path).split('.')[0]}_final.{export_format_final.lower()}",
-    )
-    print("Merging audios...")
-    try:
-        result = merge_audios(
-            vocals_file,
-            inst_file,
-            backing_vocals,
-            final_output_path,
-            vocals_volume,
-            instrumentals_volume,
-            backing_vocals_volume,
-            export_format_final,
+        results.extend(
+            result for result in (future.result() for future in futures) if result
         )
-        print("Audios merged successfully")
-    except Exception as e:
-        logging.error(f"Audio merging failed: {e}")
-        raise
-    
-    # Step 10: Cleanup (if requested)
-    if delete_audios:
-        print("Cleaning up temporary files...")
-        main_directory = os.path.join(now_dir, "audio_files", music_folder)
-        folder_to_keep = "final"
-        for folder_name in os.listdir(main_directory):
-            folder_path = os.path.join(main_directory, folder_name)
-            if os.path.isdir(folder_path) and folder_name != folder_to_keep:
-                shutil.rmtree(folder_path)
-    
-    return (
-        f"Audio file {os.path.basename(input_audio_path).split('.')[0]} converted with success",
-        result,
-    )
+    if cancel_event is not None and cancel_event.is_set():
+        raise Cancelled(f"The batch was cancelled after {len(results)} songs")
+
+    failed = len(songs) - len(results)
+    message = f"{len(results)} of {len(songs)} songs converted with success"
+    if failed:
+        message += f", {failed} failed (see the log)"
+    return message, results
 
 
 def download_model(link: str) -> str:
@@ -1,21 +1,39 @@
 import os
 import sys
 import time
+import queue
+import threading
 import torch
-import librosa
 import logging
 import traceback
+import librosa
 import numpy as np
 import soundfile as sf
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from scipy.io import wavfile
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
-from programs.applio_code.rvc.infer.pipeline import Pipeline as VC
-from programs.applio_code.rvc.lib.utils import load_audio_infer, load_embedding
-from programs.applio_code.rvc.lib.tools.split_audio import process_audio, merge_audio
+from programs.applio_code.rvc.infer.pipeline import LookaheadLimiter, Pipeline as VC
+from programs.applio_code.rvc.lib.utils import (
+    StreamingAudioReader,
+    load_audio_infer,
+    load_embedding,
+)
+from programs.applio_code.rvc.lib.tools.split_audio import detect_nonsilent, merge_chunks
+from programs.applio_code.rvc.lib.tools.encoder import (
+    AudioStreamWriter,
+    BackgroundEncoder,
+    encode_audio,
+)
+from programs.applio_code.rvc.lib.tools.manifest import (
+    BatchManifest,
+    hash_file,
+    hash_params,
+)
 from programs.applio_code.rvc.lib.algorithm.synthesizers import Synthesizer
 from programs.applio_code.rvc.configs.config import Config
 
@@ -46,6 +64,7 @@ class VoiceConverter:
         self.version = None  # Model version
         self.n_spk = None  # Number of speakers in the model
         self.use_f0 = None  # Whether the model uses F0
+        self.loaded_model = None  # Path, size and mtime of the loaded model file
 
     def load_hubert(self, embedder_model: str, embedder_model_custom: str = None):
         """
@@ -68,23 +87,8 @@ class VoiceConverter:
         try:
             if output_format != "WAV":
                 print(f"Converting audio to {output_format} format...")
-                audio, sample_rate = librosa.load(input_path, sr=None)
-                common_sample_rates = [
-                    8000,
-                    11025,
-                    12000,
-                    16000,
-                    22050,
-                    24000,
-                    32000,
-                    44100,
-                    48000,
-                ]
-                target_sr = min(common_sample_rates, key=lambda x: abs(x - sample_rate))
-                audio = librosa.resample(
-                    audio, orig_sr=sample_rate, target_sr=target_sr
-                )
-                sf.write(output_path, audio, target_sr, format=output_format.lower())
+                audio, sample_rate = sf.read(input_path, dtype="float32")
+                encode_audio(audio, sample_rate, output_path, output_format)
             return output_path
         except Exception as error:
             print(f"An error occurred converting the audio format: {error}")
@@ -110,24 +114,23 @@ class VoiceConverter:
         export_format: str,
         resample_sr: int = 0,
         sid: int = 0,
+        stream: bool = False,
+        encoder: BackgroundEncoder = None,
     ):
         """
         Performs voice conversion on the input audio.
+
+        With `stream`, the input is read, converted and encoded block by block so memory
+        use stays flat regardless of the input duration (not combined with split_audio
+        or an F0 file). Inputs soundfile can't decode are converted in memory. With
+        `encoder`, the result is handed to that writer thread and encoded while the
+        caller moves on to the next conversion.
         """
         self.get_vc(model_path, sid)
 
         try:
             start_time = time.time()
             print(f"Converting audio '{audio_input_path}'...")
-            audio = load_audio_infer(
-                audio_input_path,
-                16000,
-            )
-            audio_max = np.abs(audio).max() / 0.95
-
-            if audio_max > 1:
-                audio /= audio_max
-
             if not self.hubert_model or embedder_model != self.last_embedder_model:
                 self.load_hubert(embedder_model, embedder_model_custom)
                 self.last_embedder_model = embedder_model
@@ -144,87 +147,57 @@ class VoiceConverter:
             if self.tgt_sr != resample_sr >= 16000:
                 self.tgt_sr = resample_sr
 
-            if split_audio:
-                result, new_dir_path = process_audio(audio_input_path)
-                if result == "Error":
-                    return "Error with Split Audio", None
+            pipeline_kwargs = dict(
+                model=self.hubert_model,
+                net_g=self.net_g,
+                sid=sid,
+                pitch=pitch,
+                f0_method=f0_method,
+                file_index=file_index,
+                index_rate=index_rate,
+                pitch_guidance=self.use_f0,
+                filter_radius=filter_radius,
+                tgt_sr=self.tgt_sr,
+                resample_sr=resample_sr,
+                volume_envelope=volume_envelope,
+                version=self.version,
+                protect=protect,
+                hop_length=hop_length,
+                f0_autotune=f0_autotune,
+                f0_file=f0_file,
+            )
 
-                dir_path = (
-                    new_dir_path.strip().strip('"').strip("\n").strip('"').strip()
-                )
-                if dir_path:
-                    paths = [
-                        os.path.join(root, name)
-                        for root, _, files in os.walk(dir_path, topdown=False)
-                        for name in files
-                        if name.endswith(".wav") and root == dir_path
-                    ]
-                try:
-                    for path in paths:
-                        self.convert_audio(
-                            audio_input_path=path,
-                            audio_output_path=path,
-                            model_path=model_path,
-                            index_path=index_path,
-                            sid=sid,
-                            pitch=pitch,
-                            f0_file=None,
-                            f0_method=f0_method,
-                            index_rate=index_rate,
-                            resample_sr=resample_sr,
-                            volume_envelope=volume_envelope,
-                            protect=protect,
-                            hop_length=hop_length,
-                            split_audio=False,
-                            f0_autotune=f0_autotune,
-                            filter_radius=filter_radius,
-                            export_format=export_format,
-                            embedder_model=embedder_model,
-                            embedder_model_custom=embedder_model_custom,
-                        )
-                except Exception as error:
-                    print(f"An error occurred processing the segmented audio: {error}")
-                    print(traceback.format_exc())
-                    return f"Error {error}"
-                print("Finished processing segmented audio, now merging audio...")
-                merge_timestamps_file = os.path.join(
-                    os.path.dirname(new_dir_path),
-                    f"{os.path.basename(audio_input_path).split('.')[0]}_timestamps.txt",
+            reader = None
+            if stream and not split_audio and not f0_file:
+                reader = self._open_stream(audio_input_path)
+            if reader is not None:
+                del pipeline_kwargs["f0_file"]
+                audio_output_path = self._convert_stream(
+                    self.vc,
+                    reader,
+                    audio_input_path,
+                    audio_output_path,
+                    export_format,
+                    pipeline_kwargs,
                 )
-                self.tgt_sr, audio_opt = merge_audio(merge_timestamps_file)
-                os.remove(merge_timestamps_file)
-                sf.write(audio_output_path, audio_opt, self.tgt_sr, format="WAV")
-            else:
-                audio_opt = self.vc.pipeline(
-                    model=self.hubert_model,
-                    net_g=self.net_g,
-                    sid=sid,
-                    audio=audio,
-                    input_audio_path=audio_input_path,
-                    pitch=pitch,
-                    f0_method=f0_method,
-                    file_index=file_index,
-                    index_rate=index_rate,
-                    pitch_guidance=self.use_f0,
-                    filter_radius=filter_radius,
-                    tgt_sr=self.tgt_sr,
-                    resample_sr=resample_sr,
-                    volume_envelope=volume_envelope,
-                    version=self.version,
-                    protect=protect,
-                    hop_length=hop_length,
-                    f0_autotune=f0_autotune,
-                    f0_file=f0_file,
+                elapsed_time = time.time() - start_time
+                print(
+                    f"Conversion completed at '{audio_output_path}' in {elapsed_time:.2f} seconds."
                 )
+                return
 
-            if audio_output_path:
-                sf.write(audio_output_path, audio_opt, self.tgt_sr, format="WAV")
-            output_path_format = audio_output_path.replace(
-                ".wav", f".{export_format.lower()}"
+            audio = self._load_input(audio_input_path)
+            audio_opt = self._convert_loaded(
+                self.vc, audio, audio_input_path, split_audio, pipeline_kwargs
             )
-            audio_output_path = self.convert_audio_format(
-                audio_output_path, output_path_format, export_format
+
+            audio_output_path = (
+                f"{os.path.splitext(audio_output_path)[0]}.{export_format.lower()}"
             )
+            if encoder is not None:
+                encoder.submit(audio_opt, self.tgt_sr, audio_output_path, export_format)
+            else:
+                encode_audio(audio_opt, self.tgt_sr, audio_output_path, export_format)
 
             elapsed_time = time.time() - start_time
             print(
@@ -235,6 +208,81 @@ class VoiceConverter:
             print(f"An error occurred during audio conversion: {error}")
             print(traceback.format_exc())
 
+    def convert_array(
+        self,
+        audio: np.ndarray,
+        sample_rate: int,
+        model_path: str,
+        index_path: str,
+        embedder_model: str,
+        pitch: int,
+        f0_method: str,
+        index_rate: float,
+        volume_envelope: int,
+        protect: float,
+        hop_length: int,
+        split_audio: bool,
+        f0_autotune: bool,
+        filter_radius: int,
+        embedder_model_custom: str = None,
+        resample_sr: int = 0,
+        sid: int = 0,
+        name: str = "audio",
+    ):
+        """
+        Performs voice conversion on an in-memory input of shape (samples,) or
+        (samples, channels) and returns the float32 result and its sampling rate, without
+        decoding or encoding any file. Unlike convert_audio, errors are raised.
+        """
+        self.get_vc(model_path, sid)
+        start_time = time.time()
+        print(f"Converting audio '{name}'...")
+        if not self.hubert_model or embedder_model != self.last_embedder_model:
+            self.load_hubert(embedder_model, embedder_model_custom)
+            self.last_embedder_model = embedder_model
+
+        file_index = (
+            index_path.strip()
+            .strip('"')
+            .strip("\n")
+            .strip('"')
+            .strip()
+            .replace("trained", "added")
+        )
+
+        if self.tgt_sr != resample_sr >= 16000:
+            self.tgt_sr = resample_sr
+
+        pipeline_kwargs = dict(
+            model=self.hubert_model,
+            net_g=self.net_g,
+            sid=sid,
+            pitch=pitch,
+            f0_method=f0_method,
+            file_index=file_index,
+            index_rate=index_rate,
+            pitch_guidance=self.use_f0,
+            filter_radius=filter_radius,
+            tgt_sr=self.tgt_sr,
+            resample_sr=resample_sr,
+            volume_envelope=volume_envelope,
+            version=self.version,
+            protect=protect,
+            hop_length=hop_length,
+            f0_autotune=f0_autotune,
+            f0_file=None,
+        )
+        audio_opt = self._convert_loaded(
+            self.vc,
+            self._prepare_input(audio, sample_rate),
+            name,
+            split_audio,
+            pipeline_kwargs,
+            return_float=True,
+        )
+        print(f"Conversion completed in {time.time() - start_time:.2f} seconds.")
+        return audio_opt, self.tgt_sr
+
     def convert_audio_batch(
         self,
         audio_input_paths: str,
@@ -257,18 +305,29 @@ class VoiceConverter:
         resample_sr: int = 0,
         sid: int = 0,
         pid_file_path: str = None,
+        num_workers: int = 1,
+        prefetch: int = 2,
+        stream: bool = False,
     ):
         """
         Performs voice conversion on a batch of input audio files.
+
+        Upcoming files are decoded and resampled on background threads, `num_workers`
+        conversion threads share the loaded model weights, and encoding runs on a writer
+        thread. A manifest in the output folder records the input hash, parameters and
+        status of every file, so interrupted batches resume and changed inputs are
+        rendered again. With `stream`, files are converted block by block as in
+        convert_audio, so memory use doesn't grow with their duration.
         """
-        pid = os.getpid()
-        with open(pid_file_path, "w") as pid_file:
-            pid_file.write(str(pid))
+        if pid_file_path:
+            with open(pid_file_path, "w") as pid_file:
+                pid_file.write(str(os.getpid()))
         try:
             if not self.hubert_model or embedder_model != self.last_embedder_model:
                 self.load_hubert(embedder_model, embedder_model_custom)
                 self.last_embedder_model = embedder_model
             self.get_vc(model_path, sid)
+            model_sr = self.tgt_sr
             file_index = (
                 index_path.strip()
                 .strip('"')
@@ -277,140 +336,371 @@ class VoiceConverter:
                 .strip()
                 .replace("trained", "added")
             )
+            if self.tgt_sr != resample_sr >= 16000:
+                self.tgt_sr = resample_sr
+
             start_time = time.time()
             print(f"Converting audio batch '{audio_input_paths}'...")
-            audio_files = [
+            audio_files = sorted(
                 f
                 for f in os.listdir(audio_input_paths)
                 if f.endswith((".mp3", ".wav", ".flac", ".m4a", ".ogg", ".opus"))
-            ]
+            )
             print(f"Detected {len(audio_files)} audio files for inference.")
-            for i, audio_input_path in enumerate(audio_files):
-                audio_output_paths = os.path.join(
+
+            os.makedirs(audio_output_path, exist_ok=True)
+            manifest = BatchManifest(
+                os.path.join(audio_output_path, "batch_manifest.json")
+            )
+            params_hash = hash_params(
+                {
+                    "model": model_path,
+                    "model_mtime": os.path.getmtime(model_path),
+                    "index": file_index,
+                    "embedder_model": embedder_model,
+                    "embedder_model_custom": embedder_model_custom,
+                    "pitch": pitch,
+                    "f0_file": getattr(f0_file, "name", f0_file),
+                    "f0_method": f0_method,
+                    "index_rate": index_rate,
+                    "volume_envelope": volume_envelope,
+                    "protect": protect,
+                    "hop_length": hop_length,
+                    "split_audio": split_audio,
+                    "f0_autotune": f0_autotune,
+                    "filter_radius": filter_radius,
+                    "export_format": export_format,
+                    "resample_sr": resample_sr,
+                    "sid": sid,
+                }
+            )
+
+            jobs = []
+            for name in audio_files:
+                input_path = os.path.join(audio_input_paths, name)
+                output_path = os.path.join(
                     audio_output_path,
-                    f"{os.path.splitext(os.path.basename(audio_input_path))[0]}_output.{export_format.lower()}",
+                    f"{os.path.splitext(name)[0]}_output.{export_format.lower()}",
                 )
-                if os.path.exists(audio_output_paths):
+                input_hash = hash_file(input_path)
+                if manifest.is_done(name, input_hash, params_hash, output_path):
+                    print(f"Skipping '{name}', already converted with these settings.")
                     continue
-                print(f"Converting audio '{audio_input_path}'...")
-                audio_input_path = os.path.join(audio_input_paths, audio_input_path)
-
-                audio = load_audio_infer(
-                    audio_input_path,
-                    16000,
+                manifest.update(
+                    name,
+                    input_hash=input_hash,
+                    params_hash=params_hash,
+                    output=output_path,
+                    status="pending",
                 )
-                audio_max = np.abs(audio).max() / 0.95
-
-                if audio_max > 1:
-                    audio /= audio_max
-
-                if self.tgt_sr != resample_sr >= 16000:
-                    self.tgt_sr = resample_sr
-
-                if split_audio:
-                    result, new_dir_path = process_audio(audio_input_path)
-                    if result == "Error":
-                        return "Error with Split Audio", None
-
-                    dir_path = (
-                        new_dir_path.strip().strip('"').strip("\n").strip('"').strip()
+                jobs.append((name, input_path, output_path))
+
+            pipeline_kwargs = dict(
+                model=self.hubert_model,
+                net_g=self.net_g,
+                sid=sid,
+                pitch=pitch,
+                f0_method=f0_method,
+                file_index=file_index,
+                index_rate=index_rate,
+                pitch_guidance=self.use_f0,
+                filter_radius=filter_radius,
+                tgt_sr=self.tgt_sr,
+                resample_sr=resample_sr,
+                volume_envelope=volume_envelope,
+                version=self.version,
+                protect=protect,
+                hop_length=hop_length,
+                f0_autotune=f0_autotune,
+                f0_file=f0_file,
+            )
+            num_workers = max(1, int(num_workers))
+            prefetch = max(1, int(prefetch))
+            decode_queue = queue.Queue(maxsize=prefetch)
+            encoder = BackgroundEncoder(max_pending=num_workers)
+            stats = []
+
+            def written(name, duration, convert_time):
+                def on_done(output_path, error):
+                    if error is not None:
+                        manifest.update(name, status="failed", error=str(error))
+                        return
+                    manifest.update(
+                        name,
+                        status="done",
+                        audio_seconds=round(duration, 3),
+                        convert_seconds=round(convert_time, 3),
                     )
-                    if dir_path:
-                        paths = [
-                            os.path.join(root, name)
-                            for root, _, files in os.walk(dir_path, topdown=False)
-                            for name in files
-                            if name.endswith(".wav") and root == dir_path
-                        ]
+                    stats.append((duration, convert_time))
+                    print(
+                        f"Conversion completed at '{output_path}' "
+                        f"({duration:.2f}s of audio in {convert_time:.2f}s, "
+                        f"{duration / max(convert_time, 1e-6):.2f}x realtime)."
+                    )
+
+                return on_done
+
+            stream_kwargs = None
+            if stream and not split_audio and not f0_file:
+                stream_kwargs = dict(pipeline_kwargs)
+                del stream_kwargs["f0_file"]
+
+            def decode(job):
+                if stream_kwargs is not None:
+                    reader = self._open_stream(job[1])
+                    if reader is not None:
+                        return reader
+                return self._load_input(job[1])
+
+            def feed():
+                with ThreadPoolExecutor(max_workers=prefetch) as pool:
+                    pending = deque()
+                    for job in jobs:
+                        pending.append((job, pool.submit(decode, job)))
+                        if len(pending) >= prefetch:
+                            decode_queue.put(pending.popleft())
+                    while pending:
+                        decode_queue.put(pending.popleft())
+                for _ in range(num_workers):
+                    decode_queue.put(None)
+
+            def convert():
+                vc = VC(model_sr, self.config)
+                while True:
+                    item = decode_queue.get()
+                    if item is None:
+                        break
+                    (name, input_path, output_path), future = item
                     try:
-                        for path in paths:
-                            self.convert_audio(
-                                audio_input_path=path,
-                                audio_output_path=path,
-                                model_path=model_path,
-                                index_path=index_path,
-                                sid=sid,
-                                pitch=pitch,
-                                f0_file=None,
-                                f0_method=f0_method,
-                                index_rate=index_rate,
-                                resample_sr=resample_sr,
-                                volume_envelope=volume_envelope,
-                                protect=protect,
-                                hop_length=hop_length,
-                                split_audio=False,
-                                f0_autotune=f0_autotune,
-                                filter_radius=filter_radius,
-                                export_format=export_format,
-                                embedder_model=embedder_model,
-                                embedder_model_custom=embedder_model_custom,
+                        audio = future.result()
+                        manifest.update(name, status="running")
+                        convert_start = time.time()
+                        if isinstance(audio, StreamingAudioReader):
+                            self._convert_stream(
+                                vc,
+                                audio,
+                                input_path,
+                                output_path,
+                                export_format,
+                                stream_kwargs,
                             )
-                    except Exception as error:
-                        print(
-                            f"An error occurred processing the segmented audio: {error}"
+                            duration = audio.length / 16000
+                            done = written(name, duration, time.time() - convert_start)
+                            done(output_path, None)
+                            continue
+                        audio_opt = self._convert_loaded(
+                            vc, audio, input_path, split_audio, pipeline_kwargs
                         )
+                        encoder.submit(
+                            audio_opt,
+                            self.tgt_sr,
+                            output_path,
+                            export_format,
+                            on_done=written(
+                                name,
+                                audio.shape[0] / 16000,
+                                time.time() - convert_start,
+                            ),
+                        )
+                    except Exception as error:
+                        print(f"An error occurred converting '{name}': {error}")
                         print(traceback.format_exc())
-                        return f"Error {error}"
-                    print("Finished processing segmented audio, now merging audio...")
-                    merge_timestamps_file = os.path.join(
-                        os.path.dirname(new_dir_path),
-                        f"{os.path.basename(audio_input_path).split('.')[0]}_timestamps.txt",
-                    )
-                    self.tgt_sr, audio_opt = merge_audio(merge_timestamps_file)
-                    os.remove(merge_timestamps_file)
-                else:
-                    audio_opt = self.vc.pipeline(
-                        model=self.hubert_model,
-                        net_g=self.net_g,
-                        sid=sid,
-                        audio=audio,
-                        input_audio_path=audio_input_path,
-                        pitch=pitch,
-                        f0_method=f0_method,
-                        file_index=file_index,
-                        index_rate=index_rate,
-                        pitch_guidance=self.use_f0,
-                        filter_radius=filter_radius,
-                        tgt_sr=self.tgt_sr,
-                        resample_sr=resample_sr,
-                        volume_envelope=volume_envelope,
-                        version=self.version,
-                        protect=protect,
-                        hop_length=hop_length,
-                        f0_autotune=f0_autotune,
-                        f0_file=f0_file,
-                    )
+                        manifest.update(name, status="failed", error=str(error))
+
+            feeder = threading.Thread(target=feed, daemon=True)
+            workers = [
+                threading.Thread(target=convert, daemon=True)
+                for _ in range(num_workers)
+            ]
+            for thread in [feeder, *workers]:
+                thread.start()
+            feeder.join()
+            for worker in workers:
+                worker.join()
+            encoder.close()
 
-                if audio_output_paths:
-                    sf.write(audio_output_paths, audio_opt, self.tgt_sr, format="WAV")
-                output_path_format = audio_output_paths.replace(
-                    ".wav", f".{export_format.lower()}"
-                )
-                audio_output_paths = self.convert_audio_format(
-                    audio_output_paths, output_path_format, export_format
-                )
-                print(f"Conversion completed at '{audio_output_paths}'.")
             elapsed_time = time.time() - start_time
-            print(f"Batch conversion completed in {elapsed_time:.2f} seconds.")
-            os.remove(pid_file_path)
+            total_audio = sum(duration for duration, _ in stats)
+            print(
+                f"Batch conversion completed in {elapsed_time:.2f} seconds: "
+                f"{len(stats)}/{len(jobs)} files, {total_audio:.2f}s of audio "
+                f"({total_audio / max(elapsed_time, 1e-6):.2f}x realtime, "
+                f"{len(stats) * 60 / max(elapsed_time, 1e-6):.2f} files/min)."
+            )
+            if pid_file_path and os.path.exists(pid_file_path):
+                os.remove(pid_file_path)
         except Exception as error:
             print(f"An error occurred during audio conversion: {error}")
             print(traceback.format_exc())
 
+    @staticmethod
+    def _load_input(audio_input_path):
+        """
+        Loads an input file at 16 kHz and scales it down if it would clip.
+        """
+        audio = load_audio_infer(audio_input_path, 16000)
+        audio_max = np.abs(audio).max() / 0.95
+        if audio_max > 1:
+            audio /= audio_max
+        return audio
+
+    @staticmethod
+    def _prepare_input(audio, sample_rate):
+        """
+        Brings an in-memory (samples,) or (samples, channels) input to mono 16 kHz and
+        scales it down if it would clip, like _load_input.
+        """
+        audio = np.asarray(audio, dtype=np.float64)
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        if sample_rate != 16000:
+            audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=16000)
+        audio_max = np.abs(audio).max() / 0.95
+        if audio_max > 1:
+            audio = audio / audio_max
+        return audio
+
+    def _convert_loaded(
+        self,
+        vc,
+        audio,
+        audio_input_path,
+        split_audio,
+        pipeline_kwargs,
+        return_float=False,
+    ):
+        """
+        Converts an already loaded 16 kHz input with the given pipeline instance. The
+        result is limited and returned as int16, or as float32 with `return_float`.
+        """
+        if not split_audio:
+            audio_opt = vc.pipeline(
+                audio=audio,
+                input_audio_path=audio_input_path,
+                return_float=return_float,
+                **pipeline_kwargs,
+            )
+            if return_float:
+                resample_sr = pipeline_kwargs["resample_sr"]
+                tgt_sr = pipeline_kwargs["tgt_sr"]
+                output_sr = (
+                    resample_sr
+                    if resample_sr >= 16000 and tgt_sr != resample_sr
+                    else tgt_sr
+                )
+                audio_opt = LookaheadLimiter(output_sr).process(audio_opt, final=True)
+                audio_opt = audio_opt.astype(np.float32)
+            return audio_opt
+
+        segments = detect_nonsilent(audio, 16000)
+        print(f"Converting {len(segments)} non-silent segments...")
+        index_cache = vc.load_index(
+            pipeline_kwargs["file_index"], pipeline_kwargs["index_rate"]
+        )
+        resample_sr = pipeline_kwargs["resample_sr"]
+        tgt_sr = pipeline_kwargs["tgt_sr"]
+        output_sr = resample_sr if resample_sr >= 16000 and tgt_sr != resample_sr else tgt_sr
+        # The windows of every segment go through the generator in batches
+        chunks = vc.pipeline_batch(
+            audios=[audio[start:end] for start, end in segments],
+            input_audio_path=audio_input_path,
+            index_cache=index_cache,
+            return_float=True,
+            **{
+                name: value
+                for name, value in pipeline_kwargs.items()
+                if name != "f0_file"
+            },
+        )
+        audio_opt = merge_chunks(
+            chunks,
+            [start * output_sr // 16000 for start, _ in segments],
+            -(-audio.shape[0] * output_sr // 16000),
+        )
+        audio_opt = LookaheadLimiter(output_sr).process(audio_opt, final=True)
+        if return_float:
+            return audio_opt.astype(np.float32)
+        return (audio_opt * 32768).astype(np.int16)
+
+    @staticmethod
+    def _open_stream(audio_input_path):
+        """
+        Opens an input for streaming, or returns None if soundfile can't decode it (e.g.
+        m4a or opus on older libsndfile), for it to be converted in memory instead.
+        """
+        try:
+            return StreamingAudioReader(audio_input_path, 16000)
+        except RuntimeError as error:
+            print(f"Can't stream '{audio_input_path}' ({error}), loading it in memory.")
+            return None
+
+    def _convert_stream(
+        self,
+        vc,
+        reader,
+        audio_input_path,
+        audio_output_path,
+        export_format,
+        pipeline_kwargs,
+    ):
+        """
+        Converts a file block by block from `reader`, writing each converted block as
+        soon as it is ready. The reader is closed.
+        """
+        resample_sr = pipeline_kwargs["resample_sr"]
+        tgt_sr = pipeline_kwargs["tgt_sr"]
+        output_sr = resample_sr if resample_sr >= 16000 and tgt_sr != resample_sr else tgt_sr
+        output_path = f"{os.path.splitext(audio_output_path)[0]}.{export_format.lower()}"
+        try:
+            with AudioStreamWriter(output_path, output_sr, export_format) as writer:
+                for block in vc.pipeline_stream(
+                    reader=reader,
+                    input_audio_path=audio_input_path,
+                    **pipeline_kwargs,
+                ):
+                    writer.write(block)
+        finally:
+            reader.close()
+        return output_path
+
     def get_vc(self, weight_root, sid):
         """
-        Loads the voice conversion model and sets up the pipeline.
+        Loads the voice conversion model and sets up the pipeline. The model that is
+        already loaded is kept if its file hasn't changed.
         """
         if sid == "" or sid == []:
             self.cleanup_model()
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
 
+        identity = self.model_identity(weight_root)
+        if (
+            identity is not None
+            and identity == self.loaded_model
+            and self.cpt is not None
+            and self.vc is not None
+        ):
+            # A resample_sr of the previous conversion may have replaced it
+            self.tgt_sr = self.cpt["config"][-1]
+            return
+
         self.load_model(weight_root)
+        self.loaded_model = None
 
         if self.cpt is not None:
             self.setup_network()
             self.setup_vc_instance()
+            self.loaded_model = identity
+
+    @staticmethod
+    def model_identity(weight_root):
+        """
+        Returns the path, size and modification time of a model file, or None.
+        """
+        if not weight_root or not os.path.isfile(weight_root):
+            return None
+        stat = os.stat(weight_root)
+        return os.path.abspath(weight_root), stat.st_size, stat.st_mtime_ns
 
     def cleanup_model(self):
         """
@@ -426,6 +716,7 @@ class VoiceConverter:
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         self.cpt = None
+        self.loaded_model = None
 
     def load_model(self, weight_root):
         """
@@ -2,6 +2,7 @@ import os
 import gc
 import re
 import sys
+import math
 import torch
 import torch.nn.functional as F
 import torchcrepe
@@ -9,6 +10,7 @@ import faiss
 import librosa
 import numpy as np
 from scipy import signal
+from scipy.ndimage import minimum_filter1d, uniform_filter1d
 from torch import Tensor
 
 now_dir = os.getcwd()
@@ -28,6 +30,8 @@ SAMPLE_RATE = 16000  # Hz
 bh, ah = signal.butter(
     N=FILTER_ORDER, Wn=CUTOFF_FREQUENCY, btype="high", fs=SAMPLE_RATE
 )
+# Extra input read around each streamed window so the high-pass filter settles
+STREAM_FILTER_MARGIN = SAMPLE_RATE
 
 input_audio_path2wav = {}
 
@@ -37,55 +41,254 @@ class AudioProcessor:
     A class for processing audio signals, specifically for adjusting RMS levels.
     """
 
+    @staticmethod
+    def rms(audio: Tensor, frame_length: int, hop_length: int) -> Tensor:
+        """
+        Frame-wise RMS of a 1D tensor on its own device, matching librosa.feature.rms
+        (centered, zero-padded frames).
+
+        Args:
+            audio: The audio signal as a 1D tensor.
+            frame_length: Length of each analysis frame.
+            hop_length: Number of samples between frames.
+        """
+        power = F.pad(
+            audio.float().square().view(1, 1, -1),
+            (frame_length // 2, frame_length // 2),
+        )
+        return F.avg_pool1d(power, frame_length, hop_length).sqrt().view(-1)
+
+    @staticmethod
+    def envelope_gain(
+        source_rms: Tensor, target_rms: Tensor, length: int, rate: float
+    ) -> Tensor:
+        """
+        Stretches both RMS envelopes to `length` samples and returns the per-sample gain
+        that blends the target envelope towards the source one.
+
+        Args:
+            source_rms: RMS envelope of the source audio.
+            target_rms: RMS envelope of the target audio.
+            length: Number of target samples.
+            rate: The blending rate between the source and target RMS levels.
+        """
+        source_rms = F.interpolate(
+            source_rms.float().view(1, 1, -1), size=length, mode="linear"
+        ).view(-1)
+        target_rms = F.interpolate(
+            target_rms.float().view(1, 1, -1), size=length, mode="linear"
+        ).view(-1)
+        target_rms = torch.clamp(target_rms, min=1e-6)
+        return torch.pow(source_rms, 1 - rate) * torch.pow(target_rms, rate - 1)
+
     @staticmethod
     def change_rms(
-        source_audio: np.ndarray,
+        source_audio,
         source_rate: int,
-        target_audio: np.ndarray,
+        target_audio,
         target_rate: int,
         rate: float,
-    ) -> np.ndarray:
+    ):
         """
         Adjust the RMS level of target_audio to match the RMS of source_audio, with a given blending rate.
 
+        NumPy arrays are processed on the CPU and returned as NumPy arrays; tensors stay on
+        the device of target_audio.
+
         Args:
-            source_audio: The source audio signal as a NumPy array.
+            source_audio: The source audio signal as a NumPy array or tensor.
             source_rate: The sampling rate of the source audio.
             target_audio: The target audio signal to adjust.
             target_rate: The sampling rate of the target audio.
             rate: The blending rate between the source and target RMS levels.
         """
+        is_numpy = isinstance(target_audio, np.ndarray)
+        target = torch.as_tensor(target_audio)
+        source = torch.as_tensor(source_audio, device=target.device)
+
         # Calculate RMS of both audio data
-        rms1 = librosa.feature.rms(
-            y=source_audio,
-            frame_length=source_rate // 2 * 2,
-            hop_length=source_rate // 2,
+        rms1 = AudioProcessor.rms(source, source_rate // 2 * 2, source_rate // 2)
+        rms2 = AudioProcessor.rms(target, target_rate // 2 * 2, target_rate // 2)
+
+        # Adjust target audio RMS based on the source audio RMS
+        adjusted_audio = target * AudioProcessor.envelope_gain(
+            rms1, rms2, target.shape[0], rate
         )
-        rms2 = librosa.feature.rms(
-            y=target_audio,
-            frame_length=target_rate // 2 * 2,
-            hop_length=target_rate // 2,
+        return adjusted_audio.cpu().numpy() if is_numpy else adjusted_audio
+
+    @staticmethod
+    def change_rms_stream(
+        source_envelope: Tensor,
+        target_audio: Tensor,
+        target_rate: int,
+        rate: float,
+    ) -> Tensor:
+        """
+        Realtime counterpart of change_rms: the source envelope comes from a StreamingRMS,
+        and the target envelope uses the same trailing window over the current block.
+
+        Args:
+            source_envelope: Per-sample source RMS covering the same span as target_audio.
+            target_audio: The target audio block to adjust.
+            target_rate: The sampling rate of the target audio.
+            rate: The blending rate between the source and target RMS levels.
+        """
+        frame_length = target_rate // 2 * 2
+        energy = torch.cumsum(target_audio.double().square(), 0)
+        window_energy = energy - F.pad(energy, (frame_length, 0))[: energy.shape[0]]
+        counts = torch.arange(
+            1, energy.shape[0] + 1, device=energy.device, dtype=energy.dtype
+        ).clamp(max=frame_length)
+        target_envelope = (window_energy.clamp(min=0) / counts).sqrt()
+        return target_audio * AudioProcessor.envelope_gain(
+            source_envelope, target_envelope, target_audio.shape[0], rate
         )
 
-        # Interpolate RMS to match target audio length
-        rms1 = F.interpolate(
-            torch.from_numpy(rms1).float().unsqueeze(0),
-            size=target_audio.shape[0],
-            mode="linear",
-        ).squeeze()
-        rms2 = F.interpolate(
-            torch.from_numpy(rms2).float().unsqueeze(0),
-            size=target_audio.shape[0],
-            mode="linear",
-        ).squeeze()
-        rms2 = torch.maximum(rms2, torch.zeros_like(rms2) + 1e-6)
 
-        # Adjust target audio RMS based on the source audio RMS
-        adjusted_audio = (
-            target_audio
-            * (torch.pow(rms1, 1 - rate) * torch.pow(rms2, rate - 1)).numpy()
+class StreamingRMS:
+    """
+    Trailing-window RMS of a sample stream that keeps its running state between blocks,
+    so each realtime block only costs its own length instead of the whole input buffer.
+    """
+
+    def __init__(self, frame_length: int, buffer_length: int):
+        """
+        Args:
+            frame_length: Length of the RMS window in samples.
+            buffer_length: Number of most recent per-sample RMS values kept in `envelope`.
+        """
+        self.frame_length = frame_length
+        self.buffer_length = buffer_length
+        self.squares = None
+        self.energy = None
+        self.envelope = None
+
+    def reset(self, device):
+        self.squares = torch.zeros(
+            self.frame_length, dtype=torch.float64, device=device
+        )
+        self.energy = torch.zeros((), dtype=torch.float64, device=device)
+        self.envelope = torch.zeros(self.buffer_length, device=device)
+
+    def push(self, block: Tensor) -> Tensor:
+        """
+        Adds the newest samples and returns their RMS; `envelope` is shifted to match.
+        """
+        if self.squares is None or self.squares.device != block.device:
+            self.reset(block.device)
+        if block.shape[0] == 0:
+            return block.float()
+        new = block.detach().double().square()
+        history = torch.cat([self.squares, new])
+        # Running window energy: add each new sample and drop the one leaving the window
+        energy = self.energy + torch.cumsum(new - history[: new.shape[0]], 0)
+        self.squares = history[-self.frame_length :]
+        self.energy = energy[-1]
+        block_rms = (energy.clamp(min=0) / self.frame_length).sqrt().float()
+        self.envelope = torch.cat([self.envelope, block_rms])[-self.buffer_length :]
+        return block_rms
+
+
+class LookaheadLimiter:
+    """
+    A look-ahead peak limiter that keeps the output below a threshold without a global gain change.
+    """
+
+    def __init__(self, sample_rate, threshold=0.99, lookahead_ms=5.0):
+        """
+        Initializes the limiter.
+
+        Args:
+            sample_rate: The sampling rate of the audio to limit.
+            threshold: The maximum absolute output amplitude.
+            lookahead_ms: How far ahead of a peak the gain starts to drop, in milliseconds.
+        """
+        self.threshold = threshold
+        self.lookahead = max(1, int(sample_rate * lookahead_ms / 1000))
+        self.reach = self.lookahead + self.lookahead // 2
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.gain_history = np.ones(self.reach, dtype=np.float32)
+
+    def process(self, block, final=False):
+        """
+        Limits a block of audio. Output lags input by the look-ahead until `final` flushes it.
+
+        The gain each sample needs is spread with a sliding minimum over the look-ahead
+        and smoothed with a moving average, so it is already reduced when a peak arrives.
+
+        Args:
+            block: The next block of audio.
+            final: Whether this is the last block of the stream.
+        """
+        audio = np.concatenate([self.pending, np.asarray(block, dtype=np.float32)])
+        n_out = audio.shape[0] if final else max(audio.shape[0] - self.reach, 0)
+        if n_out == 0:
+            self.pending = audio
+            return audio[:0]
+        required = self.threshold / np.maximum(np.abs(audio), self.threshold)
+        future = np.ones(self.reach if final else 0, dtype=np.float32)
+        gain = np.concatenate([self.gain_history, required, future])
+        gain = minimum_filter1d(gain, size=2 * self.lookahead + 1)
+        gain = uniform_filter1d(gain, size=2 * (self.lookahead // 2) + 1)
+        output = audio[:n_out] * gain[self.reach : self.reach + n_out]
+        self.gain_history = np.concatenate([self.gain_history, required])[
+            n_out : n_out + self.reach
+        ]
+        self.pending = audio[n_out:]
+        return output
+
+
+class StreamResampler:
+    """
+    Resamples a stream of audio blocks, keeping context around block edges to avoid clicks.
+    """
+
+    def __init__(self, orig_sr, target_sr, context=1024):
+        """
+        Initializes the resampler.
+
+        Args:
+            orig_sr: The sampling rate of the incoming blocks.
+            target_sr: The sampling rate of the output.
+            context: Input samples kept on each side of an emitted span.
+        """
+        divisor = math.gcd(orig_sr, target_sr)
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+        self.up = target_sr // divisor
+        self.down = orig_sr // divisor
+        self.context = -(-context // self.down) * self.down
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0
+
+    def process(self, block, final=False):
+        """
+        Resamples the next block. Output lags input by the context until `final` flushes it.
+
+        Args:
+            block: The next block of audio at `orig_sr`.
+            final: Whether this is the last block of the stream.
+        """
+        self.buffer = np.concatenate([self.buffer, np.asarray(block, dtype=np.float32)])
+        if final:
+            end = self.buffer.shape[0]
+        else:
+            available = self.buffer.shape[0] - self.context - self.offset
+            end = self.offset + max(available, 0) // self.down * self.down
+        if end <= self.offset:
+            return np.zeros(0, dtype=np.float32)
+        lo = max(self.offset - self.context, 0)
+        hi = min(end + self.context, self.buffer.shape[0])
+        resampled = librosa.resample(
+            self.buffer[lo:hi], orig_sr=self.orig_sr, target_sr=self.target_sr
         )
-        return adjusted_audio
+        first = (self.offset - lo) // self.down * self.up
+        count = -(-(end - self.offset) * self.up // self.down)
+        output = resampled[first : first + count]
+        keep = max(end - self.context, 0)
+        self.buffer = self.buffer[keep:]
+        self.offset = end - keep
+        return output
 
 
 class Autotune:
@@ -356,13 +559,19 @@ class Pipeline:
                 x, self.f0_min, self.f0_max, p_len, int(hop_length), "tiny"
             )
         elif f0_method == "rmvpe":
-            self.model_rmvpe = RMVPE0Predictor(
-                os.path.join(
-                    "programs", "applio_code", "rvc", "models", "predictors", "rmvpe.pt"
-                ),
-                is_half=self.is_half,
-                device=self.device,
-            )
+            if getattr(self, "model_rmvpe", None) is None:
+                self.model_rmvpe = RMVPE0Predictor(
+                    os.path.join(
+                        "programs",
+                        "applio_code",
+                        "rvc",
+                        "models",
+                        "predictors",
+                        "rmvpe.pt",
+                    ),
+                    is_half=self.is_half,
+                    device=self.device,
+                )
             f0 = self.model_rmvpe.infer_from_audio(x, thred=0.03)
         elif f0_method == "fcpe":
             self.model_fcpe = FCPEF0Predictor(
@@ -447,6 +656,26 @@ class Pipeline:
             version: Model version ("v1" or "v2").
             protect: Protection level for preserving the original pitch.
         """
+        features = self.extract_features(
+            model, audio0, pitch, pitchf, index, big_npy, index_rate, version, protect
+        )
+        audio1 = self.synthesize(net_g, sid, [features])[0]
+        del features
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return audio1
+
+    def extract_features(
+        self, model, audio0, pitch, pitchf, index, big_npy, index_rate, version, protect
+    ):
+        """
+        Computes the generator inputs of an audio segment: its HuBERT features blended
+        with the index and protected where unvoiced, at the frame rate of the pitch.
+
+        Returns (feats, p_len, pitch, pitchf) for `synthesize`, the pitch contours
+        being None without pitch guidance. The arguments are those of
+        `voice_conversion`.
+        """
         feats = torch.from_numpy(audio0)
         if self.is_half:
             feats = feats.half()
@@ -456,14 +685,13 @@ class Pipeline:
             feats = feats.mean(-1)
         assert feats.dim() == 1, feats.dim()
         feats = feats.view(1, -1)
-        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
 
         with torch.no_grad():
             feats = model(feats.to(self.device))["last_hidden_state"]
             feats = (
                 model.final_proj(feats[0]).unsqueeze(0) if version == "v1" else feats
             )
-        if protect < 0.5 and pitch != None and pitchf != None:
+        if protect < 0.5 and pitch is not None and pitchf is not None:
             feats0 = feats.clone()
         if (
             isinstance(index, type(None)) == False
@@ -487,41 +715,79 @@ class Pipeline:
             )
 
         feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
-        if protect < 0.5 and pitch != None and pitchf != None:
+        if protect < 0.5 and pitch is not None and pitchf is not None:
             feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(
                 0, 2, 1
             )
         p_len = audio0.shape[0] // self.window
         if feats.shape[1] < p_len:
             p_len = feats.shape[1]
-            if pitch != None and pitchf != None:
+            if pitch is not None and pitchf is not None:
                 pitch = pitch[:, :p_len]
                 pitchf = pitchf[:, :p_len]
 
-        if protect < 0.5 and pitch != None and pitchf != None:
+        if protect < 0.5 and pitch is not None and pitchf is not None:
             pitchff = pitchf.clone()
             pitchff[pitchf > 0] = 1
             pitchff[pitchf < 1] = protect
             pitchff = pitchff.unsqueeze(-1)
             feats = feats * pitchff + feats0 * (1 - pitchff)
             feats = feats.to(feats0.dtype)
-        p_len = torch.tensor([p_len], device=self.device).long()
+        return feats, p_len, pitch, pitchf
+
+    def synthesize(self, net_g, sid, items):
+        """
+        Runs the generator once on a batch of `extract_features` results and returns
+        the audio of each. Shorter items are zero-padded to the longest one, and the
+        padding is masked by their lengths, so each result matches a separate run.
+
+        Args:
+            net_g: The generative model for synthesizing speech.
+            sid: Speaker ID for the target voice, as a (1,) tensor.
+            items: List of (feats, p_len, pitch, pitchf) from `extract_features`.
+        """
+        lengths = [feats.shape[1] for feats, _, _, _ in items]
+        longest = max(lengths)
+        feats = torch.cat(
+            [F.pad(feats, (0, 0, 0, longest - feats.shape[1])) for feats, *_ in items]
+        )
+        p_len = torch.tensor([p_len for _, p_len, _, _ in items], device=self.device)
+        sid = sid.repeat(len(items))
         with torch.no_grad():
-            if pitch != None and pitchf != None:
-                audio1 = (
-                    (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
-                    .data.cpu()
-                    .float()
-                    .numpy()
+            if items[0][2] is not None:
+                pitch, pitchf = (
+                    torch.cat(
+                        [
+                            F.pad(contour, (0, longest - contour.shape[1]))
+                            for contour in contours
+                        ]
+                    )
+                    for contours in zip(*[item[2:] for item in items])
                 )
+                audio = net_g.infer(feats, p_len.long(), pitch, pitchf, sid)[0]
             else:
-                audio1 = (
-                    (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
-                )
-        del feats, p_len, padding_mask
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        return audio1
+                audio = net_g.infer(feats, p_len.long(), sid=sid)[0]
+        hop = audio.shape[-1] // longest
+        audio = audio[:, 0].data.cpu().float().numpy()
+        del feats, p_len
+        return [audio[i, : length * hop] for i, length in enumerate(lengths)]
+
+    @staticmethod
+    def load_index(file_index, index_rate):
+        """
+        Loads a FAISS index and its reconstructed vectors, or returns (None, None) when unused.
+
+        Args:
+            file_index: Path to the FAISS index file.
+            index_rate: Blending rate for speaker embedding retrieval.
+        """
+        if file_index != "" and os.path.exists(file_index) and index_rate != 0:
+            try:
+                index = faiss.read_index(file_index)
+                return index, index.reconstruct_n(0, index.ntotal)
+            except Exception as error:
+                print(f"An error occurred reading the FAISS index: {error}")
+        return None, None
 
     def pipeline(
         self,
@@ -544,6 +810,8 @@ class Pipeline:
         hop_length,
         f0_autotune,
         f0_file,
+        index_cache=None,
+        return_float=False,
     ):
         """
         The main pipeline function for performing voice conversion.
@@ -568,16 +836,71 @@ class Pipeline:
             hop_length: Hop length for F0 estimation methods.
             f0_autotune: Whether to apply autotune to the F0 contour.
             f0_file: Path to a file containing an F0 contour to use.
+            index_cache: Optional (index, big_npy) pair from `load_index`, reused across calls.
+            return_float: Return the float output before limiting and int16 conversion.
         """
-        if file_index != "" and os.path.exists(file_index) == True and index_rate != 0:
-            try:
-                index = faiss.read_index(file_index)
-                big_npy = index.reconstruct_n(0, index.ntotal)
-            except Exception as error:
-                print(f"An error occurred reading the FAISS index: {error}")
-                index = big_npy = None
+        if index_cache is not None:
+            index, big_npy = index_cache
         else:
-            index = big_npy = None
+            index, big_npy = self.load_index(file_index, index_rate)
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        audio, windows = self.prepare_windows(
+            audio,
+            input_audio_path,
+            pitch,
+            f0_method,
+            pitch_guidance,
+            filter_radius,
+            hop_length,
+            f0_autotune,
+            f0_file,
+        )
+        audio_opt = np.concatenate(
+            [
+                self.voice_conversion(
+                    model,
+                    net_g,
+                    sid,
+                    window,
+                    window_pitch,
+                    window_pitchf,
+                    index,
+                    big_npy,
+                    index_rate,
+                    version,
+                    protect,
+                )[self.t_pad_tgt : -self.t_pad_tgt]
+                for window, window_pitch, window_pitchf in windows
+            ]
+        )
+        audio_opt = self.postprocess(
+            audio, audio_opt, tgt_sr, resample_sr, volume_envelope, return_float
+        )
+        del windows, sid
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return audio_opt
+
+    def prepare_windows(
+        self,
+        audio,
+        input_audio_path,
+        pitch,
+        f0_method,
+        pitch_guidance,
+        filter_radius,
+        hop_length,
+        f0_autotune,
+        f0_file,
+    ):
+        """
+        High-passes an input and cuts it into the windows converted one at a time, at
+        the quietest point near every `t_center` samples, each padded by `t_pad`.
+
+        Returns the filtered input and a list of (audio, pitch, pitchf) windows, the
+        pitch contours being None without pitch guidance. The arguments are those of
+        `pipeline`.
+        """
         audio = signal.filtfilt(bh, ah, audio)
         audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
         opt_ts = []
@@ -594,9 +917,6 @@ class Pipeline:
                         == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
                     )[0][0]
                 )
-        s = 0
-        audio_opt = []
-        t = None
         audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
         p_len = audio_pad.shape[0] // self.window
         inp_f0 = None
@@ -610,7 +930,7 @@ class Pipeline:
                 inp_f0 = np.array(inp_f0, dtype="float32")
             except Exception as error:
                 print(f"An error occurred reading the F0 file: {error}")
-        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        pitchf = None
         if pitch_guidance == True:
             pitch, pitchf = self.get_f0(
                 input_audio_path,
@@ -629,88 +949,283 @@ class Pipeline:
                 pitchf = pitchf.astype(np.float32)
             pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
             pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
+        else:
+            pitch = None
+
+        def window(start, stop):
+            frames = slice(start // self.window, stop and stop // self.window)
+            if pitch is None:
+                return audio_pad[start : stop and stop + self.window], None, None
+            return (
+                audio_pad[start : stop and stop + self.window],
+                pitch[:, frames],
+                pitchf[:, frames],
+            )
+
+        windows = []
+        s = 0
         for t in opt_ts:
             t = t // self.window * self.window
-            if pitch_guidance == True:
-                audio_opt.append(
-                    self.voice_conversion(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        pitch[:, s // self.window : (t + self.t_pad2) // self.window],
-                        pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
-            else:
-                audio_opt.append(
-                    self.voice_conversion(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        None,
-                        None,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
+            windows.append(window(s, t + self.t_pad2))
             s = t
-        if pitch_guidance == True:
-            audio_opt.append(
-                self.voice_conversion(
-                    model,
-                    net_g,
-                    sid,
-                    audio_pad[t:],
-                    pitch[:, t // self.window :] if t is not None else pitch,
-                    pitchf[:, t // self.window :] if t is not None else pitchf,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
-                    protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
+        windows.append(window(s, None))
+        return audio, windows
+
+    def postprocess(
+        self, audio, audio_opt, tgt_sr, resample_sr, volume_envelope, return_float
+    ):
+        """
+        Matches the loudness of the converted audio to the filtered input, resamples it
+        to `resample_sr` if set and, unless `return_float`, limits it to int16.
+        """
+        if volume_envelope != 1:
+            audio_opt = AudioProcessor.change_rms(
+                audio, self.sample_rate, audio_opt, tgt_sr, volume_envelope
+            )
+        output_sr = tgt_sr
+        if resample_sr >= self.sample_rate and tgt_sr != resample_sr:
+            audio_opt = librosa.resample(
+                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
             )
+            output_sr = resample_sr
+        if not return_float:
+            audio_opt = LookaheadLimiter(output_sr).process(audio_opt, final=True)
+            audio_opt = (audio_opt * 32768).astype(np.int16)
+        return audio_opt
+
+    def pipeline_batch(
+        self,
+        model,
+        net_g,
+        sid,
+        audios,
+        input_audio_path,
+        pitch,
+        f0_method,
+        file_index,
+        index_rate,
+        pitch_guidance,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        volume_envelope,
+        version,
+        protect,
+        hop_length,
+        f0_autotune,
+        index_cache=None,
+        return_float=False,
+    ):
+        """
+        Converts several inputs, e.g. the non-silent chunks of a track, as `pipeline`
+        would, but runs the generator on batches of their windows. Windows are sorted
+        by length and batched while the padded batch holds at most `t_max` samples, so
+        a batch needs no more memory than the longest window `pipeline` converts.
+
+        HuBERT still runs on one window at a time: the group norm of its first layer
+        spans the whole input, so padding would change the features.
+
+        Args:
+            audios: The input signals.
+            The remaining arguments are the same as for `pipeline`, without `audio` and `f0_file`.
+        """
+        if index_cache is not None:
+            index, big_npy = index_cache
         else:
-            audio_opt.append(
-                self.voice_conversion(
+            index, big_npy = self.load_index(file_index, index_rate)
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        prepared = [
+            self.prepare_windows(
+                audio,
+                input_audio_path,
+                pitch,
+                f0_method,
+                pitch_guidance,
+                filter_radius,
+                hop_length,
+                f0_autotune,
+                None,
+            )
+            for audio in audios
+        ]
+        converted = [[None] * len(windows) for _, windows in prepared]
+        order = sorted(
+            (
+                (i, j)
+                for i, (_, windows) in enumerate(prepared)
+                for j in range(len(windows))
+            ),
+            key=lambda item: prepared[item[0]][1][item[1]][0].shape[0],
+        )
+
+        def convert(batch):
+            features = [
+                self.extract_features(
                     model,
-                    net_g,
-                    sid,
-                    audio_pad[t:],
-                    None,
-                    None,
+                    *prepared[i][1][j],
                     index,
                     big_npy,
                     index_rate,
                     version,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
-        audio_opt = np.concatenate(audio_opt)
-        if volume_envelope != 1:
-            audio_opt = AudioProcessor.change_rms(
-                audio, self.sample_rate, audio_opt, tgt_sr, volume_envelope
+                )
+                for i, j in batch
+            ]
+            outputs = self.synthesize(net_g, sid, features)
+            for (i, j), output in zip(batch, outputs):
+                converted[i][j] = output[self.t_pad_tgt : -self.t_pad_tgt]
+            del features
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        batch = []
+        for i, j in order:
+            length = prepared[i][1][j][0].shape[0]
+            if batch and (len(batch) + 1) * length > self.t_max:
+                convert(batch)
+                batch = []
+            batch.append((i, j))
+        if batch:
+            convert(batch)
+        outputs = [
+            self.postprocess(
+                audio,
+                np.concatenate(chunks),
+                tgt_sr,
+                resample_sr,
+                volume_envelope,
+                return_float,
             )
+            for (audio, _), chunks in zip(prepared, converted)
+        ]
+        del prepared, sid
+        return outputs
+
+    def pipeline_stream(
+        self,
+        model,
+        net_g,
+        sid,
+        reader,
+        input_audio_path,
+        pitch,
+        f0_method,
+        file_index,
+        index_rate,
+        pitch_guidance,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        volume_envelope,
+        version,
+        protect,
+        hop_length,
+        f0_autotune,
+    ):
+        """
+        Streaming variant of `pipeline` whose memory use does not grow with the input length.
+
+        Input windows are read from `reader` only when needed and converted with the same
+        segmentation and padding as `pipeline`. Converted audio is yielded as int16 blocks
+        after a look-ahead limiter, ready to be written by a streaming encoder.
+
+        Args:
+            reader: A `StreamingAudioReader` returning 16 kHz mono windows of the input.
+            The remaining arguments are the same as for `pipeline`, without `audio` and `f0_file`.
+        """
+        index, big_npy = self.load_index(file_index, index_rate)
+        length = reader.length
+        scale = max(reader.peak() / 0.95, 1.0)
+        output_sr = tgt_sr
+        resampler = None
         if resample_sr >= self.sample_rate and tgt_sr != resample_sr:
-            audio_opt = librosa.resample(
-                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
+            resampler = StreamResampler(tgt_sr, resample_sr)
+            output_sr = resample_sr
+        limiter = LookaheadLimiter(output_sr)
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+
+        def read(start, stop):
+            # High-passed input in [start, stop), reflect-padded outside the file
+            lo = max(start - STREAM_FILTER_MARGIN, 0)
+            hi = min(stop + STREAM_FILTER_MARGIN, length)
+            x = signal.filtfilt(bh, ah, reader.read(lo, hi) / scale)
+            x = x[max(start, 0) - lo : min(stop, length) - lo]
+            return np.pad(x, (max(-start, 0), max(stop - length, 0)), mode="reflect")
+
+        def split_points():
+            if length + self.window // 2 * 2 <= self.t_max:
+                return
+            for t in range(self.t_center, length, self.t_center):
+                x = read(
+                    t - self.t_query - self.window // 2,
+                    t + self.t_query + self.window // 2,
+                )
+                audio_sum = np.convolve(x, np.ones(self.window), mode="valid")
+                yield t - self.t_query + np.argmin(np.abs(audio_sum[: 2 * self.t_query]))
+
+        def convert(start, stop, pitch_frames=None):
+            # start/stop are offsets into the input padded with t_pad, as in `pipeline`
+            x = read(start - self.t_pad, stop - self.t_pad)
+            seg_pitch = seg_pitchf = None
+            if pitch_guidance == True:
+                seg_pitch, seg_pitchf = self.get_f0(
+                    input_audio_path,
+                    x,
+                    x.shape[0] // self.window,
+                    pitch,
+                    f0_method,
+                    filter_radius,
+                    hop_length,
+                    f0_autotune,
+                )
+                seg_pitch = seg_pitch[:pitch_frames]
+                seg_pitchf = seg_pitchf[:pitch_frames]
+                if self.device == "mps":
+                    seg_pitchf = seg_pitchf.astype(np.float32)
+                seg_pitch = torch.tensor(seg_pitch, device=self.device).unsqueeze(0).long()
+                seg_pitchf = (
+                    torch.tensor(seg_pitchf, device=self.device).unsqueeze(0).float()
+                )
+            audio_seg = self.voice_conversion(
+                model,
+                net_g,
+                sid,
+                x,
+                seg_pitch,
+                seg_pitchf,
+                index,
+                big_npy,
+                index_rate,
+                version,
+                protect,
+            )[self.t_pad_tgt : -self.t_pad_tgt]
+            if volume_envelope != 1:
+                audio_seg = AudioProcessor.change_rms(
+                    x[self.t_pad : -self.t_pad],
+                    self.sample_rate,
+                    audio_seg,
+                    tgt_sr,
+                    volume_envelope,
+                )
+            if resampler is not None:
+                audio_seg = resampler.process(audio_seg)
+            return (limiter.process(audio_seg) * 32768).astype(np.int16)
+
+        s = 0
+        t = None
+        for t in split_points():
+            t = t // self.window * self.window
+            yield convert(
+                s,
+                t + self.t_pad2 + self.window,
+                (t + self.t_pad2) // self.window - s // self.window,
             )
-        audio_max = np.abs(audio_opt).max() / 0.99
-        max_int16 = 32768
-        if audio_max > 1:
-            max_int16 /= audio_max
-        audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
+            s = t
+        yield convert(t or 0, length + self.t_pad2)
+        tail = np.zeros(0, dtype=np.float32)
+        if resampler is not None:
+            tail = resampler.process(tail, final=True)
+        yield (limiter.process(tail, final=True) * 32768).astype(np.int16)
+        del sid
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        return audio_opt
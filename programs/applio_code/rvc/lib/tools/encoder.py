@@ -0,0 +1,203 @@
+import queue
+import threading
+import subprocess
+import numpy as np
+import soundfile as sf
+
+from programs.applio_code.rvc.infer.pipeline import StreamResampler
+
+# soundfile container and subtype for every export format it can encode directly
+SOUNDFILE_FORMATS = {
+    "WAV": ("WAV", "PCM_16"),
+    "FLAC": ("FLAC", "PCM_16"),
+    "OGG": ("OGG", "VORBIS"),
+    "MP3": ("MP3", "MPEG_LAYER_III"),
+}
+# Sampling rates accepted by the MPEG layer III encoder
+MP3_SAMPLE_RATES = [8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000]
+
+
+def soundfile_supports(export_format):
+    """
+    Checks whether the local libsndfile build can encode the given export format.
+    """
+    if export_format not in SOUNDFILE_FORMATS:
+        return False
+    container, subtype = SOUNDFILE_FORMATS[export_format]
+    return container in sf.available_formats() and subtype in sf.available_subtypes(
+        container
+    )
+
+
+def output_sample_rate(export_format, sample_rate):
+    """
+    Returns the rate a result is encoded at: the input rate unless the codec can't store it.
+    """
+    if export_format == "MP3" and sample_rate not in MP3_SAMPLE_RATES:
+        return min(MP3_SAMPLE_RATES, key=lambda x: abs(x - sample_rate))
+    return sample_rate
+
+
+def to_int16(audio):
+    """
+    Converts float audio in [-1, 1] to int16, leaving int16 input untouched.
+    """
+    if audio.dtype == np.int16:
+        return audio
+    return (np.clip(audio, -1.0, 32767 / 32768) * 32768).astype(np.int16)
+
+
+class AudioStreamWriter:
+    """
+    Encodes audio blocks straight to WAV/FLAC/OGG/MP3/M4A without an intermediate file.
+
+    Formats the local libsndfile can encode are written with soundfile; anything else is
+    piped as raw PCM into ffmpeg. Rates the codec can't store are resampled on the fly.
+    """
+
+    def __init__(self, output_path, sample_rate, export_format, channels=1):
+        """
+        Opens the output for writing.
+
+        Args:
+            output_path: Path of the encoded file.
+            sample_rate: Sampling rate of the blocks that will be written.
+            export_format: One of WAV, FLAC, OGG, MP3, M4A.
+            channels: Number of channels of the blocks.
+        """
+        self.output_path = output_path
+        self.export_format = export_format.upper()
+        self.channels = channels
+        self.sample_rate = output_sample_rate(self.export_format, sample_rate)
+        self.resamplers = None
+        if self.sample_rate != sample_rate:
+            self.resamplers = [
+                StreamResampler(sample_rate, self.sample_rate) for _ in range(channels)
+            ]
+        self.file = self.process = None
+        if soundfile_supports(self.export_format):
+            container, subtype = SOUNDFILE_FORMATS[self.export_format]
+            self.file = sf.SoundFile(
+                output_path,
+                "w",
+                samplerate=self.sample_rate,
+                channels=channels,
+                format=container,
+                subtype=subtype,
+            )
+        else:
+            self.process = subprocess.Popen(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "s16le",
+                    "-ar",
+                    str(self.sample_rate),
+                    "-ac",
+                    str(channels),
+                    "-i",
+                    "pipe:0",
+                    output_path,
+                ],
+                stdin=subprocess.PIPE,
+            )
+
+    def write(self, block, final=False):
+        """
+        Encodes a block of shape (samples,) or (samples, channels).
+        """
+        if self.resamplers is not None:
+            block = block.astype(np.float32) / (32768 if block.dtype == np.int16 else 1)
+            block = block.reshape(block.shape[0], self.channels)
+            block = np.stack(
+                [
+                    resampler.process(block[:, channel], final=final)
+                    for channel, resampler in enumerate(self.resamplers)
+                ],
+                axis=1,
+            )
+        if block.shape[0] == 0:
+            return
+        if self.file is not None:
+            self.file.write(block)
+        else:
+            self.process.stdin.write(to_int16(block).tobytes())
+
+    def close(self):
+        """
+        Flushes pending samples and finalizes the file.
+        """
+        if self.resamplers is not None:
+            self.write(np.zeros((0, self.channels), dtype=np.float32), final=True)
+        if self.file is not None:
+            self.file.close()
+        else:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError(
+                    f"ffmpeg could not encode '{self.output_path}' as {self.export_format}"
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode_audio(audio, sample_rate, output_path, export_format):
+    """
+    Encodes an in-memory int16/float result to `output_path` in one pass.
+
+    Args:
+        audio: Audio of shape (samples,) or (samples, channels).
+        sample_rate: Sampling rate of `audio`.
+        output_path: Path of the encoded file.
+        export_format: One of WAV, FLAC, OGG, MP3, M4A.
+    """
+    channels = 1 if audio.ndim == 1 else audio.shape[1]
+    with AudioStreamWriter(output_path, sample_rate, export_format, channels) as writer:
+        writer.write(audio)
+    return output_path
+
+
+class BackgroundEncoder:
+    """
+    Encodes results on a writer thread so encoding overlaps with the next conversion.
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, audio, sample_rate, output_path, export_format, on_done=None):
+        """
+        Queues a result for encoding. `on_done(output_path, error)` is called once it's written.
+        """
+        self.queue.put((audio, sample_rate, output_path, export_format, on_done))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            audio, sample_rate, output_path, export_format, on_done = item
+            error = None
+            try:
+                encode_audio(audio, sample_rate, output_path, export_format)
+            except Exception as exc:
+                error = exc
+                print(f"An error occurred encoding '{output_path}': {exc}")
+            if on_done is not None:
+                on_done(output_path, error)
+
+    def close(self):
+        """
+        Waits for all queued results to be written and stops the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
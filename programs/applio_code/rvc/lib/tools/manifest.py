@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def hash_file(file_path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_params(params):
+    """
+    Returns a stable SHA-256 hex digest of a JSON-serializable parameter dict.
+    """
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class BatchManifest:
+    """
+    A small JSON manifest that records, per item, the input hash, the parameter hash
+    and the processing status, so interrupted batches can resume where they stopped.
+    """
+
+    def __init__(self, manifest_path):
+        """
+        Loads the manifest from disk, or starts an empty one.
+
+        Args:
+            manifest_path: Path of the JSON manifest file.
+        """
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError) as error:
+                print(f"Ignoring unreadable manifest '{manifest_path}': {error}")
+
+    def is_done(self, key, input_hash, params_hash, output_path=None):
+        """
+        Checks whether an item was already rendered from the same input and parameters.
+
+        Args:
+            key: Identifier of the item within the batch.
+            input_hash: Hash of the current input content.
+            params_hash: Hash of the current processing parameters.
+            output_path: Optional output path that must still exist.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        return (
+            entry is not None
+            and entry.get("status") == "done"
+            and entry.get("input_hash") == input_hash
+            and entry.get("params_hash") == params_hash
+            and (output_path is None or os.path.exists(output_path))
+        )
+
+    def update(self, key, **fields):
+        """
+        Updates an item's fields and persists the manifest atomically.
+
+        Args:
+            key: Identifier of the item within the batch.
+            **fields: Fields to store (e.g. status, input_hash, params_hash, output).
+        """
+        with self.lock:
+            self.entries.setdefault(key, {}).update(fields)
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
@@ -1,5 +1,7 @@
 import os, sys
+import math
 import librosa
+import numpy as np
 import soundfile as sf
 import re
 import unicodedata
@@ -49,7 +51,12 @@ def load_audio_infer(file, sample_rate):
     file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
     if not os.path.isfile(file):
         raise FileNotFoundError(f"File not found: {file}")
-    audio, sr = sf.read(file)
+    try:
+        audio, sr = sf.read(file)
+    except RuntimeError:
+        # Formats libsndfile can't decode (e.g. m4a) go through audioread and ffmpeg
+        audio, sr = librosa.load(file, sr=None, mono=False)
+        audio = audio.T
     if len(audio.shape) > 1:
         audio = librosa.to_mono(audio.T)
     if sr != sample_rate:
@@ -57,6 +64,66 @@ def load_audio_infer(file, sample_rate):
     return audio.flatten()
 
 
+class StreamingAudioReader:
+    """
+    Random-access reader that returns mono windows of an audio file at a fixed sampling rate,
+    decoding and resampling only the requested region.
+    """
+
+    def __init__(self, file, sample_rate, margin=256, block_size=1 << 18):
+        file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+        if not os.path.isfile(file):
+            raise FileNotFoundError(f"File not found: {file}")
+        self.file = sf.SoundFile(file)
+        self.orig_sr = self.file.samplerate
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        divisor = math.gcd(self.orig_sr, sample_rate)
+        self.up = sample_rate // divisor
+        self.down = self.orig_sr // divisor
+        # Resampling context, rounded to whole resampling periods so windows stay aligned
+        self.margin = -(-margin // self.up)
+        self.length = -(-self.file.frames * self.up // self.down)
+
+    def _read_native(self, start, stop):
+        self.file.seek(start)
+        audio = self.file.read(stop - start, always_2d=True)
+        return audio.mean(axis=1)
+
+    def read(self, start, stop):
+        """
+        Returns samples [start, stop) at `sample_rate`, clipped to the file bounds.
+        """
+        start, stop = max(start, 0), min(stop, self.length)
+        if stop <= start:
+            return np.zeros(0)
+        if self.up == self.down:
+            return self._read_native(start, stop)
+        first = max(start // self.up - self.margin, 0)
+        last = min(-(-stop // self.up) + self.margin, -(-self.file.frames // self.down))
+        native = self._read_native(
+            first * self.down, min(last * self.down, self.file.frames)
+        )
+        audio = librosa.resample(
+            native, orig_sr=self.orig_sr, target_sr=self.sample_rate
+        )
+        offset = start - first * self.up
+        return audio[offset : offset + stop - start]
+
+    def peak(self):
+        """
+        Returns the peak absolute amplitude of the mono mix, scanning the file in blocks.
+        """
+        peak = 0.0
+        self.file.seek(0)
+        for block in self.file.blocks(blocksize=self.block_size, always_2d=True):
+            peak = max(peak, float(np.abs(block.mean(axis=1)).max(initial=0.0)))
+        return peak
+
+    def close(self):
+        self.file.close()
+
+
 def format_title(title):
     formatted_title = (
         unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("utf-8")
@@ -217,6 +217,7 @@ class Realtime:
             f0_autotune_strength,
             proposed_pitch,
             proposed_pitch_threshold,
+            block_length=audio_input_16k.shape[0],
         )
 
         audio_out: torch.Tensor = self.resample_out(audio_model * torch.sqrt(vol_t))
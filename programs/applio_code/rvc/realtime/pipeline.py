@@ -13,7 +13,11 @@ sys.path.append(now_dir)
 
 from programs.applio_code.rvc.realtime.utils.torch import circular_write
 from programs.applio_code.rvc.configs.config import Config
-from programs.applio_code.rvc.infer.pipeline import Autotune, AudioProcessor
+from programs.applio_code.rvc.infer.pipeline import (
+    Autotune,
+    AudioProcessor,
+    StreamingRMS,
+)
 from programs.applio_code.rvc.lib.algorithm.synthesizers import Synthesizer
 from programs.applio_code.rvc.lib.predictors.f0 import FCPE, RMVPE, SWIFT
 from programs.applio_code.rvc.lib.utils import load_embedding, HubertModelWithFinalProj
@@ -118,6 +122,7 @@ class Realtime_Pipeline:
         self.autotune = Autotune()
         self.resamplers = {}
         self.f0_model = None
+        self.rms_stream = None
 
     def get_f0(
         self,
@@ -244,9 +249,13 @@ class Realtime_Pipeline:
         f0_autotune_strength: float = 1,
         proposed_pitch: bool = False,
         proposed_pitch_threshold: float = 155.0,
+        block_length: int = None,
     ):
         """
         Performs realtime voice conversion on a given audio segment.
+
+        `block_length` is the number of new samples at the end of `audio`; when given, the
+        source RMS envelope is updated incrementally instead of recomputed over the buffer.
         """
         assert audio.dim() == 1, audio.dim()
         feats = audio.view(1, -1).to(self.device)
@@ -313,10 +322,24 @@ class Realtime_Pipeline:
 
         p_len = torch.tensor([p_len], device=self.device, dtype=torch.int64)
         out_audio = self.vc.inference(feats, p_len, self.sid, pitch, pitchf).float()
+        if block_length is not None:
+            if (
+                self.rms_stream is None
+                or self.rms_stream.buffer_length != audio.shape[0]
+            ):
+                self.rms_stream = StreamingRMS(
+                    self.sample_rate // 2 * 2, audio.shape[0]
+                )
+            self.rms_stream.push(audio[audio.shape[0] - block_length :])
         if volume_envelope != 1:
-            out_audio = AudioProcessor.change_rms(
-                audio, self.sample_rate, out_audio, self.tgt_sr, volume_envelope
-            )
+            if block_length is not None:
+                out_audio = AudioProcessor.change_rms_stream(
+                    self.rms_stream.envelope, out_audio, self.tgt_sr, volume_envelope
+                )
+            else:
+                out_audio = AudioProcessor.change_rms(
+                    audio, self.sample_rate, out_audio, self.tgt_sr, volume_envelope
+                )
 
         scaled_window = int(np.floor(1.0 * self.model_window))
 
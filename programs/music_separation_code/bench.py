@@ -0,0 +1,397 @@
+# coding: utf-8
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from inference import get_device, load_model
+from utils import PeakMemory, demix, device_name, sdr
+
+PRECISIONS = ["fp32", "amp"]
+
+
+def synthetic_stem(instrument, length, rng, sample_rate=44100):
+    """
+    Renders a reproducible stereo test signal whose character depends on the stem name:
+    decaying noise hits for drums, a low tone for bass, a vibrato tone for vocals and a
+    detuned chord with a little noise for anything else.
+    """
+    t = np.arange(length) / sample_rate
+    if instrument == "drums":
+        hits = np.zeros(length)
+        hits[:: int(sample_rate * 0.25)] = 1.0
+        envelope = np.exp(-np.arange(int(sample_rate * 0.2)) / (sample_rate * 0.03))
+        stem = np.convolve(hits, envelope)[:length] * rng.standard_normal(length)
+        stem = np.stack([stem, stem])
+    elif instrument == "bass":
+        frequency = rng.uniform(40, 80)
+        stem = np.sin(2 * np.pi * frequency * t)
+        stem = np.stack([stem, stem])
+    elif instrument == "vocals":
+        frequency = rng.uniform(180, 400)
+        phase = 2 * np.pi * frequency * t + 3 * np.sin(2 * np.pi * 5 * t)
+        stem = sum(np.sin(k * phase) / k for k in range(1, 6))
+        stem = np.stack([stem, stem])
+    else:
+        frequencies = rng.uniform(200, 2000, size=3)
+        stem = np.stack(
+            [
+                sum(np.sin(2 * np.pi * f * (1 + 0.002 * side) * t) for f in frequencies)
+                for side in (-1, 1)
+            ]
+        )
+        stem += 0.05 * rng.standard_normal(stem.shape)
+    stem = stem / (np.max(np.abs(stem)) + 1e-8) * 0.3
+    return stem.astype(np.float32)
+
+
+def synthetic_tracks(instruments, seconds, count=1, seed=0, sample_rate=44100):
+    """
+    Builds `count` reproducible synthetic (name, mixture, stems) tracks for the given stems.
+    """
+    rng = np.random.default_rng(seed)
+    length = int(seconds * sample_rate)
+    tracks = []
+    for index in range(count):
+        stems = {
+            instrument: synthetic_stem(instrument, length, rng, sample_rate)
+            for instrument in instruments
+        }
+        tracks.append(("synthetic_{}".format(index), sum(stems.values()), stems))
+    return tracks
+
+
+def read_stereo(path, sample_rate=44100):
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    audio = audio.T
+    if audio.shape[0] == 1:
+        audio = np.concatenate([audio, audio], axis=0)
+    if sr != sample_rate:
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=sample_rate)
+    return audio
+
+
+def musdb_tracks(musdb_path, instruments, max_tracks=None, max_seconds=None):
+    """
+    Reads a MUSDB18-HQ style folder: one directory per track holding mixture.wav and
+    one <stem>.wav per instrument. Stems the folder doesn't have are left out of the
+    SDR, and a missing mixture is rebuilt as the sum of the stems.
+    """
+    tracks = []
+    for name in sorted(os.listdir(musdb_path)):
+        track_dir = os.path.join(musdb_path, name)
+        if not os.path.isdir(track_dir):
+            continue
+        stems = {
+            instrument: read_stereo(os.path.join(track_dir, instrument + ".wav"))
+            for instrument in instruments
+            if os.path.isfile(os.path.join(track_dir, instrument + ".wav"))
+        }
+        mixture_path = os.path.join(track_dir, "mixture.wav")
+        if os.path.isfile(mixture_path):
+            mixture = read_stereo(mixture_path)
+        elif stems:
+            mixture = sum(stems.values())
+        else:
+            print("Skipping {}: no mixture or stems found".format(track_dir))
+            continue
+        if max_seconds is not None:
+            length = int(max_seconds * 44100)
+            mixture = mixture[:, :length]
+            stems = {k: v[:, :length] for k, v in stems.items()}
+        tracks.append((name, mixture, stems))
+        if max_tracks is not None and len(tracks) >= max_tracks:
+            break
+    return tracks
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=current_dir,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_setting(model, config, device, model_type, tracks, use_tta, repeats=1):
+    """
+    Separates every track with the current config and returns timing, memory and SDR.
+    """
+    duration = processing_time = 0.0
+    peak_rss = peak_device_memory = 0
+    scores = {}
+    for name, mixture, stems in tracks:
+        best_time = None
+        for _ in range(repeats):
+            with PeakMemory("cpu") as rss, PeakMemory(device) as device_memory:
+                start_time = time.time()
+                estimates = demix(
+                    config,
+                    model,
+                    mixture,
+                    device,
+                    model_type=model_type,
+                    use_tta=use_tta,
+                )
+                if device.startswith("cuda"):
+                    torch.cuda.synchronize(device)
+                elapsed = time.time() - start_time
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+            peak_rss = max(peak_rss, rss.peak)
+            if device.startswith("cuda"):
+                peak_device_memory = max(peak_device_memory, device_memory.peak)
+        duration += mixture.shape[-1] / 44100
+        processing_time += best_time
+        for instrument, reference in stems.items():
+            if instrument in estimates:
+                score = sdr(reference[None], estimates[instrument][None])[0]
+                scores.setdefault(instrument, []).append(float(score))
+    result = {
+        "audio_seconds": duration,
+        "processing_seconds": processing_time,
+        "rtf": processing_time / duration,
+        "peak_rss": peak_rss,
+        "sdr": {k: float(np.mean(v)) for k, v in scores.items()},
+    }
+    if device.startswith("cuda"):
+        result["peak_device_memory"] = peak_device_memory
+    return result
+
+
+def benchmark_model(
+    model_type,
+    config_path,
+    start_check_point,
+    device,
+    device_ids=0,
+    tracks=None,
+    seconds=30,
+    num_tracks=1,
+    musdb_path=None,
+    max_seconds=None,
+    num_overlaps=None,
+    batch_sizes=None,
+    precisions=("fp32",),
+    tta=(False,),
+    repeats=1,
+    seed=0,
+):
+    """
+    Benchmarks one model over every combination of the given settings.
+
+    Args:
+        model_type: Separation model type, as in inference.py.
+        config_path: Path to the model config.
+        start_check_point: Path to the model checkpoint, or "" for random weights.
+        device: Torch device to run on.
+        device_ids: GPU ids, as in inference.py.
+        tracks: Optional list of (name, mixture, stems) to use instead of building them.
+        seconds: Length of each synthetic track.
+        num_tracks: Number of synthetic tracks.
+        musdb_path: MUSDB18-HQ style folder to read instead of synthetic tracks.
+        max_seconds: Crop for MUSDB tracks.
+        num_overlaps: Candidate inference.num_overlap values, the config's one by default.
+        batch_sizes: Candidate inference.batch_size values, the config's one by default.
+        precisions: "fp32" and/or "amp" (mixed precision, CUDA only).
+        tta: Test time augmentation settings to run.
+        repeats: Timed runs per track; the fastest one is reported.
+        seed: Seed for random weights and synthetic audio.
+    """
+    torch.manual_seed(seed)
+    model, config = load_model(
+        model_type,
+        config_path,
+        start_check_point,
+        device,
+        device_ids,
+        use_tuning_profile=False,
+    )
+    instruments = list(config.training.instruments)
+    if tracks is None:
+        if musdb_path:
+            tracks = musdb_tracks(musdb_path, instruments, num_tracks, max_seconds)
+        else:
+            tracks = synthetic_tracks(instruments, seconds, num_tracks, seed)
+    num_overlaps = num_overlaps or [config.inference.num_overlap]
+    batch_sizes = batch_sizes or [config.inference.batch_size]
+
+    # Warm-up so lazy initialization and cudnn autotuning don't count against the first run
+    demix(config, model, tracks[0][1][:, : 5 * 44100], device, model_type=model_type)
+
+    if "amp" in precisions and not device.startswith("cuda"):
+        print("Skipping amp: mixed precision inference is CUDA only")
+        precisions = [precision for precision in precisions if precision != "amp"]
+
+    results = []
+    for precision, use_tta, num_overlap, batch_size in itertools.product(
+        precisions, tta, num_overlaps, batch_sizes
+    ):
+        config.training.use_amp = precision == "amp"
+        config.inference.num_overlap = num_overlap
+        config.inference.batch_size = batch_size
+        settings = {
+            "num_overlap": num_overlap,
+            "batch_size": batch_size,
+            "precision": precision,
+            "use_tta": use_tta,
+        }
+        result = dict(
+            settings,
+            **run_setting(
+                model, config, device, model_type, tracks, use_tta, repeats
+            ),
+        )
+        print(
+            "{} {}: rtf {:.3f}, peak rss {:.0f} MB, sdr {}".format(
+                model_type,
+                settings,
+                result["rtf"],
+                result["peak_rss"] / 2**20,
+                ", ".join(
+                    "{} {:.2f}".format(k, v) for k, v in result["sdr"].items()
+                ),
+            )
+        )
+        results.append(result)
+
+    if device.startswith("cuda"):
+        del model
+        torch.cuda.empty_cache()
+    return {
+        "model_type": model_type,
+        "config_path": os.path.abspath(config_path),
+        "checkpoint": (
+            os.path.abspath(start_check_point) if start_check_point else None
+        ),
+        "tracks": [name for name, _, _ in tracks],
+        "results": results,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Measures real-time factor, peak memory and SDR of separation models across overlap, batch, precision and TTA settings, and writes them as JSON."
+    )
+    parser.add_argument(
+        "--model_type",
+        nargs="+",
+        type=str,
+        required=True,
+        help="one model type per config",
+    )
+    parser.add_argument(
+        "--config_path", nargs="+", type=str, required=True, help="model configs"
+    )
+    parser.add_argument(
+        "--start_check_point",
+        nargs="+",
+        type=str,
+        default=None,
+        help="checkpoints matching --config_path; random weights when omitted or ''",
+    )
+    parser.add_argument(
+        "--device_ids", nargs="+", type=int, default=0, help="list of gpu ids"
+    )
+    parser.add_argument("--force_cpu", action="store_true")
+    parser.add_argument(
+        "--musdb_path",
+        type=str,
+        default=None,
+        help="MUSDB18-HQ style folder (track/mixture.wav, track/<stem>.wav); synthetic mixtures when omitted",
+    )
+    parser.add_argument("--num_tracks", type=int, default=None)
+    parser.add_argument(
+        "--seconds", type=float, default=30, help="length of synthetic tracks"
+    )
+    parser.add_argument(
+        "--max_seconds", type=float, default=None, help="crop for MUSDB tracks"
+    )
+    parser.add_argument("--num_overlaps", nargs="+", type=int, default=None)
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=None)
+    parser.add_argument(
+        "--precisions", nargs="+", choices=PRECISIONS, default=["fp32"]
+    )
+    parser.add_argument(
+        "--tta",
+        nargs="+",
+        choices=["off", "on"],
+        default=["off"],
+        help="test time augmentation settings to run",
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=str, default="separation_benchmark.json", help="JSON report"
+    )
+    args = parser.parse_args(args)
+
+    if len(args.model_type) != len(args.config_path):
+        parser.error("--model_type and --config_path need the same number of values")
+    checkpoints = args.start_check_point or [""] * len(args.config_path)
+    if len(checkpoints) != len(args.config_path):
+        parser.error(
+            "--start_check_point and --config_path need the same number of values"
+        )
+
+    device = get_device(args.force_cpu, args.device_ids)
+    print("Using device: ", device)
+    report = {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": device_name(device),
+        "revision": git_revision(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "source": args.musdb_path or "synthetic",
+        "models": [],
+    }
+    for model_type, config_path, start_check_point in zip(
+        args.model_type, args.config_path, checkpoints
+    ):
+        report["models"].append(
+            benchmark_model(
+                model_type,
+                config_path,
+                start_check_point,
+                device,
+                args.device_ids,
+                seconds=args.seconds,
+                num_tracks=args.num_tracks or (None if args.musdb_path else 1),
+                musdb_path=args.musdb_path,
+                max_seconds=args.max_seconds,
+                num_overlaps=args.num_overlaps,
+                batch_sizes=args.batch_sizes,
+                precisions=args.precisions,
+                tta=[setting == "on" for setting in args.tta],
+                repeats=args.repeats,
+                seed=args.seed,
+            )
+        )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("Saved benchmark report to {}".format(args.output))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import os
 import librosa
 import soundfile as sf
 import numpy as np
+import torch
+import torch.nn as nn
 import argparse
 
 
@@ -29,7 +31,7 @@ def istft(spec, hl, length):
 def absmax(a, *, axis):
     dims = list(a.shape)
     dims.pop(axis)
-    indices = np.ogrid[tuple(slice(0, d) for d in dims)]
+    indices = list(np.ogrid[tuple(slice(0, d) for d in dims)])
     argmax = np.abs(a).argmax(axis=axis)
     indices.insert((len(a.shape) + axis) % len(a.shape), argmax)
     return a[tuple(indices)]
@@ -38,7 +40,7 @@ def absmax(a, *, axis):
 def absmin(a, *, axis):
     dims = list(a.shape)
     dims.pop(axis)
-    indices = np.ogrid[tuple(slice(0, d) for d in dims)]
+    indices = list(np.ogrid[tuple(slice(0, d) for d in dims)])
     argmax = np.abs(a).argmin(axis=axis)
     indices.insert((len(a.shape) + axis) % len(a.shape), argmax)
     return a[tuple(indices)]
@@ -68,59 +70,248 @@ def lambda_min(arr, axis=None, key=None, keepdims=False):
         return arr.flatten()[idxs]
 
 
-def average_waveforms(pred_track, weights, algorithm):
+WAVE_ALGORITHMS = ["avg_wave", "median_wave", "min_wave", "max_wave"]
+FFT_ALGORITHMS = ["avg_fft", "median_fft", "min_fft", "max_fft"]
+
+
+def _median(x):
+    """
+    Median over the first axis like np.median: the mean of the two middle values for an
+    even count, and complex values ordered by their real part.
+    """
+    n = x.shape[0]
+    if x.is_complex():
+        x = x.gather(0, torch.argsort(x.real, dim=0))
+    else:
+        x = torch.sort(x, dim=0).values
+    if n % 2:
+        return x[n // 2]
+    return (x[n // 2 - 1] + x[n // 2]) / 2
+
+
+def _combine(x, weights, algorithm):
+    """
+    Reduces a stack of waveforms or spectra of shape (num, ...) over the first axis.
+    """
+    if algorithm.startswith("avg"):
+        weights = weights.view((-1,) + (1,) * (x.dim() - 1))
+        return (x * weights).sum(0) / weights.sum()
+    if algorithm.startswith("median"):
+        return _median(x)
+    # Elementwise passes over the few predictions are much faster than an argmin/argmax
+    # reduction over the outer axis; strict comparisons keep the first one on ties
+    result, magnitude = x[0], x[0].abs()
+    for candidate in x[1:]:
+        candidate_magnitude = candidate.abs()
+        if algorithm.startswith("min"):
+            better = candidate_magnitude < magnitude
+        else:
+            better = candidate_magnitude > magnitude
+        result = torch.where(better, candidate, result)
+        magnitude = torch.where(better, candidate_magnitude, magnitude)
+    return result
+
+
+def ensemble_blocks(blocks, weights, algorithm, nfft=2048, hl=1024, device="cpu"):
+    """
+    Ensembles aligned blocks of several predictions and yields the result block by
+    block, so memory use is bounded by the block size instead of the track length.
+
+    FFT algorithms are computed on a batched torch STFT of all predictions and channels.
+    The input keeps the last `nfft - hl` samples between blocks, and output samples are
+    only yielded once no later frame overlaps them. The result matches a single
+    librosa STFT / ISTFT over the whole track (centered, zero padded, Hann window).
+
+    :param blocks: iterable of arrays of shape (num, channels, samples)
+    :param weights: shape = (num, ), used by the avg algorithms
+    :param algorithm: One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft
+    :param nfft: FFT size of the FFT algorithms
+    :param hl: hop length of the FFT algorithms
+    :param device: torch device the ensemble is computed on
+    :return: generator of arrays of shape (channels, samples)
+    """
+    if algorithm not in WAVE_ALGORITHMS + FFT_ALGORITHMS:
+        raise ValueError("Unknown ensemble type: {}".format(algorithm))
+    weights = torch.as_tensor(np.asarray(weights), dtype=torch.float32, device=device)
+
+    with torch.inference_mode():
+        if algorithm in WAVE_ALGORITHMS:
+            for block in blocks:
+                block = torch.as_tensor(block, dtype=torch.float32, device=device)
+                yield _combine(block, weights, algorithm).cpu().numpy()
+            return
+
+        window = torch.hann_window(nfft, device=device)
+        pad = nfft // 2
+        buffer = None  # Input samples from padded position buffer_start
+        buffer_start = 0
+        output = None  # Overlap-added frames and window weights from output_start
+        output_weights = None
+        output_start = 0
+        next_frame = 0
+        emitted = pad
+        length = 0
+
+        def process(final):
+            nonlocal buffer, buffer_start, output, output_weights
+            nonlocal output_start, next_frame, emitted
+            available = buffer_start + buffer.shape[-1] - next_frame * hl
+            frames = (available - nfft) // hl + 1 if available >= nfft else 0
+            if frames > 0:
+                num, channels = buffer.shape[:2]
+                begin = next_frame * hl - buffer_start
+                segment = buffer[..., begin : begin + (frames - 1) * hl + nfft]
+                spec = torch.stft(
+                    segment.reshape(num * channels, -1),
+                    n_fft=nfft,
+                    hop_length=hl,
+                    window=window,
+                    center=False,
+                    return_complex=True,
+                )
+                spec = _combine(
+                    spec.view((num, channels) + spec.shape[1:]), weights, algorithm
+                )
+                # Overlap-add the windowed inverse frames, as torch.istft does
+                wave = torch.fft.irfft(spec, n=nfft, dim=1) * window[:, None]
+                span = (frames - 1) * hl + nfft
+                wave = nn.functional.fold(
+                    wave, output_size=(1, span), kernel_size=(1, nfft), stride=(1, hl)
+                ).view(channels, span)
+                wave_weights = nn.functional.fold(
+                    (window**2)[None, :, None].expand(1, nfft, frames),
+                    output_size=(1, span),
+                    kernel_size=(1, nfft),
+                    stride=(1, hl),
+                ).view(span)
+                offset = next_frame * hl - output_start
+                grow = offset + span - output.shape[-1]
+                if grow > 0:
+                    output = torch.cat([output, wave.new_zeros(channels, grow)], dim=-1)
+                    output_weights = torch.cat(
+                        [output_weights, wave_weights.new_zeros(grow)]
+                    )
+                output[:, offset : offset + span] += wave
+                output_weights[offset : offset + span] += wave_weights
+                next_frame += frames
+                drop = next_frame * hl - buffer_start
+                buffer = buffer[..., drop:]
+                buffer_start += drop
+
+            # Samples before the next frame are complete
+            ready = pad + length if final else min(next_frame * hl, pad + length)
+            if ready <= emitted:
+                return None
+            begin, end = emitted - output_start, ready - output_start
+            total = output_weights[begin:end]
+            block = output[:, begin:end] / torch.where(
+                total > 1e-11, total, torch.ones_like(total)
+            )
+            output = output[:, end:]
+            output_weights = output_weights[end:]
+            output_start = emitted = ready
+            return block.cpu().numpy()
+
+        for block in blocks:
+            block = torch.as_tensor(block, dtype=torch.float32, device=device)
+            if buffer is None:
+                buffer = nn.functional.pad(block, (pad, 0))
+                output = block.new_zeros(block.shape[1], 0)
+                output_weights = block.new_zeros(0)
+            else:
+                buffer = torch.cat([buffer, block], dim=-1)
+            length += block.shape[-1]
+            result = process(final=False)
+            if result is not None:
+                yield result
+
+        if buffer is None:
+            return
+        buffer = nn.functional.pad(buffer, (0, pad))
+        result = process(final=True)
+        if result is not None:
+            yield result
+
+
+def average_waveforms(pred_track, weights, algorithm, block_size=2**20):
     """
     :param pred_track: shape = (num, channels, length)
     :param weights: shape = (num, )
     :param algorithm: One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft
+    :param block_size: number of samples ensembled at a time
     :return: averaged waveform in shape (channels, length)
     """
 
-    pred_track = np.array(pred_track)
-    final_length = pred_track.shape[-1]
-
-    mod_track = []
-    for i in range(pred_track.shape[0]):
-        if algorithm == "avg_wave":
-            mod_track.append(pred_track[i] * weights[i])
-        elif algorithm in ["median_wave", "min_wave", "max_wave"]:
-            mod_track.append(pred_track[i])
-        elif algorithm in ["avg_fft", "min_fft", "max_fft", "median_fft"]:
-            spec = stft(pred_track[i], nfft=2048, hl=1024)
-            if algorithm in ["avg_fft"]:
-                mod_track.append(spec * weights[i])
-            else:
-                mod_track.append(spec)
-    pred_track = np.array(mod_track)
-
-    if algorithm in ["avg_wave"]:
-        pred_track = pred_track.sum(axis=0)
-        pred_track /= np.array(weights).sum().T
-    elif algorithm in ["median_wave"]:
-        pred_track = np.median(pred_track, axis=0)
-    elif algorithm in ["min_wave"]:
-        pred_track = np.array(pred_track)
-        pred_track = lambda_min(pred_track, axis=0, key=np.abs)
-    elif algorithm in ["max_wave"]:
-        pred_track = np.array(pred_track)
-        pred_track = lambda_max(pred_track, axis=0, key=np.abs)
-    elif algorithm in ["avg_fft"]:
-        pred_track = pred_track.sum(axis=0)
-        pred_track /= np.array(weights).sum()
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ["min_fft"]:
-        pred_track = np.array(pred_track)
-        pred_track = lambda_min(pred_track, axis=0, key=np.abs)
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ["max_fft"]:
-        pred_track = np.array(pred_track)
-        pred_track = absmax(pred_track, axis=0)
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ["median_fft"]:
-        pred_track = np.array(pred_track)
-        pred_track = np.median(pred_track, axis=0)
-        pred_track = istft(pred_track, 1024, final_length)
-    return pred_track
+    pred_track = np.asarray(pred_track, dtype=np.float32)
+    blocks = (
+        pred_track[..., i : i + block_size]
+        for i in range(0, pred_track.shape[-1], block_size)
+    )
+    return np.concatenate(
+        list(ensemble_blocks(blocks, weights, algorithm)), axis=-1
+    )
+
+
+class DecodedAudio:
+    """
+    Read-only stand-in for sf.SoundFile over a file libsndfile can't open (m4a, mp4,
+    some mp3s), decoded into memory by librosa through audioread/ffmpeg.
+    """
+
+    def __init__(self, path):
+        wave, self.samplerate = librosa.load(path, sr=None, mono=False)
+        self.wave = np.atleast_2d(wave).T
+        self.frames, self.channels = self.wave.shape
+        self.position = 0
+
+    def read(self, frames, dtype="float32", always_2d=True):
+        block = self.wave[self.position : self.position + frames]
+        self.position += len(block)
+        return block.astype(dtype)
+
+    def close(self):
+        self.wave = None
+
+
+def open_audio(path):
+    """
+    Opens a file for block reads with soundfile, or decodes it with librosa when
+    soundfile can't read its format.
+    """
+    try:
+        return sf.SoundFile(path)
+    except RuntimeError:
+        pass
+    try:
+        return DecodedAudio(path)
+    except Exception as error:
+        raise RuntimeError("Can't decode {}: {}".format(path, error))
+
+
+def read_aligned_blocks(handles, block_size):
+    """
+    Reads open files (see open_audio) in lockstep as (num, channels, samples) blocks
+    until the shortest one ends, then closes them. Mono files are duplicated to match
+    multichannel ones.
+    """
+    try:
+        channels = max(h.channels for h in handles)
+        while True:
+            waves = []
+            for h in handles:
+                wave = h.read(block_size, dtype="float32", always_2d=True).T
+                if wave.shape[0] != channels:
+                    wave = np.repeat(wave, channels, axis=0)
+                waves.append(wave)
+            length = min(wave.shape[-1] for wave in waves)
+            if length == 0:
+                break
+            yield np.stack([wave[:, :length] for wave in waves])
+            if length < block_size:
+                break
+    finally:
+        for h in handles:
+            h.close()
 
 
 def ensemble_files(args):
@@ -150,6 +341,17 @@ def ensemble_files(args):
         type=str,
         help="Path to wav file where ensemble result will be stored",
     )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=2**20,
+        help="Number of samples read and ensembled at a time",
+    )
+    parser.add_argument(
+        "--use_gpu",
+        action="store_true",
+        help="Compute the ensemble on the GPU if one is available",
+    )
     if args is None:
         args = parser.parse_args()
     else:
@@ -163,20 +365,42 @@ def ensemble_files(args):
         weights = np.ones(len(args.files))
     print("Weights: {}".format(weights))
     print("Output file: {}".format(args.output))
-    data = []
+    sr = None
+    handles = []
     for f in args.files:
         if not os.path.isfile(f):
             print("Error. Can't find file: {}. Check paths.".format(f))
             exit()
-        print("Reading file: {}".format(f))
-        wav, sr = librosa.load(f, sr=None, mono=False)
-        # wav, sr = sf.read(f)
-        print("Waveform shape: {} sample rate: {}".format(wav.shape, sr))
-        data.append(wav)
-    data = np.array(data)
-    res = average_waveforms(data, weights, args.type)
-    print("Result shape: {}".format(res.shape))
-    sf.write(args.output, res.T, sr, "FLOAT")
+        try:
+            info = open_audio(f)
+        except RuntimeError as error:
+            print("Error. {}".format(error))
+            exit()
+        handles.append(info)
+        print(
+            "Reading file: {} channels: {} length: {} sample rate: {}".format(
+                f, info.channels, info.frames, info.samplerate
+            )
+        )
+        if sr is not None and info.samplerate != sr:
+            print("Error. All files must have the same sample rate.")
+            exit()
+        sr = info.samplerate
+    device = "cuda" if args.use_gpu and torch.cuda.is_available() else "cpu"
+    channels = max(h.channels for h in handles)
+    blocks = read_aligned_blocks(handles, args.block_size)
+    length = 0
+    with sf.SoundFile(
+        args.output,
+        "w",
+        samplerate=sr,
+        channels=channels,
+        subtype="FLOAT",
+    ) as out:
+        for res in ensemble_blocks(blocks, weights, args.type, device=device):
+            out.write(res.T)
+            length += res.shape[-1]
+    print("Result length: {}".format(length))
 
 
 if __name__ == "__main__":
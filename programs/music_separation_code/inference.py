@@ -2,7 +2,13 @@
 __author__ = "Roman Solovyev (ZFTurbo): https://github.com/ZFTurbo/"
 
 import argparse
+import shutil
+import subprocess
+import hashlib
+import queue
+import threading
 import time
+from collections import OrderedDict
 import librosa
 from tqdm import tqdm
 import sys
@@ -14,13 +20,33 @@ import torch.nn as nn
 
 # Using the embedded version of Python can also correctly import the utils module.
 current_dir = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(current_dir)
-from utils import demix, get_model_from_config
+if __package__:
+    # Imported in-process (e.g. by core.py): nothing is added to sys.path, so this
+    # folder's utils.py doesn't shadow other top-level modules
+    from programs.music_separation_code.utils import (
+        apply_tuning_profile,
+        demix,
+        demix_track_stream,
+        demix_tracks,
+        get_model_from_config,
+    )
+else:
+    sys.path.append(current_dir)
+    from utils import (
+        apply_tuning_profile,
+        demix,
+        demix_track_stream,
+        demix_tracks,
+        get_model_from_config,
+    )
 
 import warnings
 
 warnings.filterwarnings("ignore")
 
+# Files picked up from --input_folder
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a", ".aac", ".aiff", ".opus")
+
 
 class Args:
     def __init__(
@@ -33,6 +59,10 @@ class Args:
         flac_file,
         pcm_type,
         use_tta,
+        streaming=False,
+        tf_chunking=False,
+        input_folder=None,
+        prefetch=2,
     ):
         self.input_file = input_file
         self.model_type = model_type
@@ -42,95 +72,650 @@ class Args:
         self.flac_file = flac_file
         self.pcm_type = pcm_type
         self.use_tta = use_tta
+        self.streaming = streaming
+        self.tf_chunking = tf_chunking
+        self.input_folder = input_folder
+        self.prefetch = prefetch
 
 
-def run_file(model, args, config, device, verbose=False):
-    start_time = time.time()
-    model.eval()
-
-    if not os.path.isfile(args.input_file):
-        print("File not found: {}".format(args.input_file))
-        return
-
+def get_instruments(config):
     instruments = config.training.instruments.copy()
     if config.training.target_instrument is not None:
         instruments = [config.training.target_instrument]
+    return instruments
 
-    if not os.path.isdir(args.store_dir):
-        os.mkdir(args.store_dir)
-
-    print("Starting processing track: ", args.input_file)
-    try:
-        mix, sr = librosa.load(args.input_file, sr=44100, mono=False)
-    except Exception as e:
-        print("Cannot read track: {}".format(args.input_file))
-        print("Error message: {}".format(str(e)))
-        return
 
+def prepare_track(mix, sr, config):
+    """
+    Builds the track dict of an already decoded (channels, samples) mix, converting mono
+    to stereo and normalizing it when the config asks for it.
+    """
     # Convert mono to stereo if needed
     if len(mix.shape) == 1:
         mix = np.stack([mix, mix], axis=0)
 
     mix_orig = mix.copy()
+    mean = std = None
     if "normalize" in config.inference:
         if config.inference["normalize"] is True:
             mono = mix.mean(0)
             mean = mono.mean()
             std = mono.std()
             mix = (mix - mean) / std
+    return {"mix": mix, "mix_orig": mix_orig, "sr": sr, "mean": mean, "std": std}
 
-    if args.use_tta:
-        # orig, channel inverse, polarity inverse
-        track_proc_list = [mix.copy(), mix[::-1].copy(), -1.0 * mix.copy()]
-    else:
-        track_proc_list = [mix.copy()]
 
-    full_result = []
-    for mix in track_proc_list:
-        waveforms = demix(
-            config, model, mix, device, pbar=verbose, model_type=args.model_type
-        )
-        full_result.append(waveforms)
-
-    # Average all values in single dict
-    waveforms = full_result[0]
-    for i in range(1, len(full_result)):
-        d = full_result[i]
-        for el in d:
-            if i == 2:
-                waveforms[el] += -1.0 * d[el]
-            elif i == 1:
-                waveforms[el] += d[el][::-1].copy()
-            else:
-                waveforms[el] += d[el]
-    for el in waveforms:
-        waveforms[el] = waveforms[el] / len(full_result)
+def load_track(input_file, config):
+    """
+    Decodes a track to stereo 44.1 kHz and normalizes it when the config asks for it.
+    Returns a dict with the model input `mix`, the original `mix_orig`, `sr` and the
+    normalization `mean` and `std`, or None if the file can't be read.
+    """
+    try:
+        mix, sr = librosa.load(input_file, sr=44100, mono=False)
+    except Exception as e:
+        print("Cannot read track: {}".format(input_file))
+        print("Error message: {}".format(str(e)))
+        return None
+    return prepare_track(mix, sr, config)
+
+
+def track_stems(waveforms, track, config, extract_instrumental=False):
+    """
+    Returns the separated stems of a track as {instrument: (samples, channels) array},
+    denormalized, with the instrumental if requested.
+    """
+    instruments = get_instruments(config)
 
     # Create a new `instr` in instruments list, 'instrumental'
-    if args.extract_instrumental:
+    if extract_instrumental:
         instr = "vocals" if "vocals" in instruments else instruments[0]
         instruments.append("instrumental")
         # Output "instrumental", which is an inverse of 'vocals' or the first stem in list if 'vocals' absent
-        waveforms["instrumental"] = mix_orig - waveforms[instr]
+        waveforms["instrumental"] = track["mix_orig"] - waveforms[instr]
 
+    stems = {}
     for instr in instruments:
         estimates = waveforms[instr].T
-        if "normalize" in config.inference:
-            if config.inference["normalize"] is True:
-                estimates = estimates * std + mean
-        file_name, _ = os.path.splitext(os.path.basename(args.input_file))
+        if track["std"] is not None:
+            estimates = estimates * track["std"] + track["mean"]
+        stems[instr] = estimates
+    return stems
+
+
+def save_track(waveforms, track, input_file, args, config):
+    """
+    Writes the separated stems of `input_file` (and the instrumental if requested) to
+    args.store_dir.
+    """
+    stems = track_stems(waveforms, track, config, args.extract_instrumental)
+    for instr, estimates in stems.items():
+        file_name, _ = os.path.splitext(os.path.basename(input_file))
         if args.flac_file:
             output_file = os.path.join(args.store_dir, f"{file_name}_{instr}.flac")
             subtype = "PCM_16" if args.pcm_type == "PCM_16" else "PCM_24"
-            sf.write(output_file, estimates, sr, subtype=subtype)
+            sf.write(output_file, estimates, track["sr"], subtype=subtype)
         else:
             output_file = os.path.join(args.store_dir, f"{file_name}_{instr}.wav")
-            sf.write(output_file, estimates, sr, subtype="FLOAT")
+            sf.write(output_file, estimates, track["sr"], subtype="FLOAT")
+
+
+def run_file(model, args, config, device, verbose=False):
+    if getattr(args, "streaming", False):
+        return run_file_stream(model, args, config, device, verbose)
+
+    start_time = time.time()
+    model.eval()
+
+    if not os.path.isfile(args.input_file):
+        print("File not found: {}".format(args.input_file))
+        return
+
+    if not os.path.isdir(args.store_dir):
+        os.mkdir(args.store_dir)
+
+    print("Starting processing track: ", args.input_file)
+    track = load_track(args.input_file, config)
+    if track is None:
+        return
+
+    # With use_tta, the channel-swapped and polarity-inverted copies are separated in the
+    # same batches as the original and averaged during the overlap-add
+    waveforms = demix(
+        config,
+        model,
+        track["mix"],
+        device,
+        pbar=verbose,
+        model_type=args.model_type,
+        use_tta=args.use_tta,
+        tf_chunking=getattr(args, "tf_chunking", False),
+    )
+    save_track(waveforms, track, args.input_file, args, config)
+
+    print("Elapsed time: {:.2f} sec".format(time.time() - start_time))
+
+
+def prefetch_tracks(input_files, config, prefetch=2):
+    """
+    Yields (input_file, track) pairs while a background thread decodes up to `prefetch`
+    upcoming files. Files that can't be read are skipped.
+    """
+    pending = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def decode():
+        for input_file in input_files:
+            if stop.is_set():
+                break
+            track = load_track(input_file, config)
+            if track is None or track["mix"].shape[-1] == 0:
+                continue
+            pending.put((input_file, track))
+        pending.put(None)
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock the decoder if it's waiting on a full queue
+        while thread.is_alive():
+            try:
+                pending.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def run_folder(model, args, config, device, verbose=False):
+    """
+    Separates every audio file in args.input_folder. Chunks of consecutive tracks share
+    model batches (see demix_tracks) while the next files are decoded in the background.
+    """
+    start_time = time.time()
+    model.eval()
+
+    if not os.path.isdir(args.input_folder):
+        print("Folder not found: {}".format(args.input_folder))
+        return
+
+    if not os.path.isdir(args.store_dir):
+        os.mkdir(args.store_dir)
+
+    input_files = [
+        os.path.join(args.input_folder, name)
+        for name in sorted(os.listdir(args.input_folder))
+        if os.path.isfile(os.path.join(args.input_folder, name))
+        and os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS
+    ]
+    print("Total files found: {}".format(len(input_files)))
+    tracks = {}
+
+    def mixes():
+        for input_file, track in prefetch_tracks(
+            input_files, config, getattr(args, "prefetch", 2)
+        ):
+            print("Starting processing track: ", input_file)
+            tracks[input_file] = track
+            yield input_file, track["mix"]
+
+    if args.model_type == "htdemucs" or getattr(args, "tf_chunking", False):
+        # These models chunk the audio their own way, so tracks are separated one by one
+        results = (
+            (
+                input_file,
+                demix(
+                    config,
+                    model,
+                    mix,
+                    device,
+                    pbar=verbose,
+                    model_type=args.model_type,
+                    use_tta=args.use_tta,
+                    tf_chunking=getattr(args, "tf_chunking", False),
+                ),
+            )
+            for input_file, mix in mixes()
+        )
+    else:
+        results = demix_tracks(
+            config, model, mixes(), device, pbar=verbose, use_tta=args.use_tta
+        )
+
+    for input_file, waveforms in results:
+        save_track(waveforms, tracks.pop(input_file), input_file, args, config)
+
+    print("Elapsed time: {:.2f} sec".format(time.time() - start_time))
+
+
+def read_blocks(input_file, block_size, sample_rate=44100):
+    """
+    Yields the track as consecutive (channels, samples) float32 blocks at `sample_rate`,
+    with mono converted to stereo. Files soundfile can read at that rate are read directly,
+    anything else is decoded and resampled by ffmpeg (or by librosa, in memory, without it).
+    """
+    try:
+        info = sf.info(input_file)
+    except RuntimeError:
+        info = None
+
+    if info is not None and info.samplerate == sample_rate:
+        for block in sf.blocks(
+            input_file, blocksize=block_size, dtype="float32", always_2d=True
+        ):
+            block = block.T
+            if block.shape[0] == 1:
+                block = np.concatenate([block, block])
+            yield block
+        return
+
+    if shutil.which("ffmpeg") is None:
+        # No streaming decoder available, resample the whole track in memory instead
+        mix, _ = librosa.load(input_file, sr=sample_rate, mono=False)
+        if len(mix.shape) == 1:
+            mix = np.stack([mix, mix], axis=0)
+        for start in range(0, mix.shape[1], block_size):
+            yield mix[:, start : start + block_size]
+        return
+
+    channels = max(info.channels, 2) if info is not None else 2
+    process = subprocess.Popen(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-i",
+            input_file,
+            "-f",
+            "f32le",
+            "-ac",
+            str(channels),
+            "-ar",
+            str(sample_rate),
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+    )
+    frame_size = 4 * channels
+    try:
+        while True:
+            data = process.stdout.read(block_size * frame_size)
+            if len(data) < frame_size:
+                break
+            data = data[: len(data) // frame_size * frame_size]
+            yield np.frombuffer(data, dtype=np.float32).reshape(-1, channels).T
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError("ffmpeg could not decode {}".format(input_file))
+
+
+def run_file_stream(model, args, config, device, verbose=False):
+    """
+    Same outputs as run_file, but the track is read, separated and written block by block,
+    so memory stays bounded by the chunk and batch size instead of the track length.
+    """
+    start_time = time.time()
+    model.eval()
+
+    if not os.path.isfile(args.input_file):
+        print("File not found: {}".format(args.input_file))
+        return
+
+    instruments = get_instruments(config)
+    instr = "vocals" if "vocals" in instruments else instruments[0]
+    if args.extract_instrumental:
+        instruments.append("instrumental")
+
+    if not os.path.isdir(args.store_dir):
+        os.mkdir(args.store_dir)
+
+    print("Starting processing track: ", args.input_file)
+    sr = 44100
+    block_size = 1 << 18
+    normalize = (
+        "normalize" in config.inference and config.inference["normalize"] is True
+    )
+    mean, std = 0.0, 1.0
+    if normalize:
+        # First pass for the statistics demix normalizes with
+        total, total_sq, count = 0.0, 0.0, 0
+        for block in read_blocks(args.input_file, block_size, sr):
+            mono = block.mean(0, dtype=np.float64)
+            total += mono.sum()
+            total_sq += np.square(mono).sum()
+            count += mono.shape[0]
+        mean = total / count
+        std = float(np.sqrt(max(total_sq / count - mean**2, 0.0)))
+        mean = float(mean)
+
+    blocks = read_blocks(args.input_file, block_size, sr)
+    if normalize:
+        blocks = ((block - mean) / std for block in blocks)
+
+    file_name, _ = os.path.splitext(os.path.basename(args.input_file))
+    writers = {}
+    try:
+        for mix, waveforms in demix_track_stream(
+            config,
+            model,
+            blocks,
+            device,
+            pbar=verbose,
+            model_type=args.model_type,
+            use_tta=args.use_tta,
+        ):
+            if args.extract_instrumental:
+                # Inverse of 'vocals' or the first stem, from the original mix
+                waveforms["instrumental"] = mix * std + mean - waveforms[instr]
+            for el in instruments:
+                if el not in writers:
+                    if args.flac_file:
+                        output_file = os.path.join(
+                            args.store_dir, f"{file_name}_{el}.flac"
+                        )
+                        subtype = "PCM_16" if args.pcm_type == "PCM_16" else "PCM_24"
+                    else:
+                        output_file = os.path.join(
+                            args.store_dir, f"{file_name}_{el}.wav"
+                        )
+                        subtype = "FLOAT"
+                    writers[el] = sf.SoundFile(
+                        output_file,
+                        "w",
+                        samplerate=sr,
+                        channels=mix.shape[0],
+                        subtype=subtype,
+                    )
+                writers[el].write((waveforms[el] * std + mean).T)
+    finally:
+        for writer in writers.values():
+            writer.close()
 
-    time.sleep(1)
     print("Elapsed time: {:.2f} sec".format(time.time() - start_time))
 
 
+def get_device(force_cpu=False, device_ids=0):
+    """
+    Picks the device separation runs on: the first requested CUDA device, MPS or the CPU.
+    """
+    if force_cpu:
+        return "cpu"
+    if torch.cuda.is_available():
+        return (
+            f"cuda:{device_ids[0]}"
+            if type(device_ids) == list
+            else f"cuda:{device_ids}"
+        )
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def load_model(
+    model_type,
+    config_path,
+    start_check_point,
+    device,
+    device_ids=0,
+    use_tuning_profile=True,
+):
+    """
+    Builds a separation model from its config, loads its checkpoint and moves it to `device`.
+    Chunking settings from this host's tuning profile (see tune.py) override the config.
+    """
+    model, config = get_model_from_config(model_type, config_path)
+    if use_tuning_profile:
+        apply_tuning_profile(config, model_type, config_path, device)
+    if start_check_point != "":
+        print("Start from checkpoint: {}".format(start_check_point))
+        if model_type == "htdemucs":
+            state_dict = torch.load(
+                start_check_point, map_location=device, weights_only=False
+            )
+            # Fix for htdemucs pretrained models
+            if "state" in state_dict:
+                state_dict = state_dict["state"]
+        else:
+            state_dict = torch.load(
+                start_check_point, map_location=device, weights_only=True
+            )
+        model.load_state_dict(state_dict)
+    print("Instruments: {}".format(config.training.instruments))
+
+    # in case multiple CUDA GPUs are used and --device_ids arg is passed
+    if type(device_ids) == list and len(device_ids) > 1 and device != "cpu":
+        model = nn.DataParallel(model, device_ids=device_ids)
+
+    model = model.to(device)
+    model.eval()
+    return model, config
+
+
+class SeparationEngine:
+    """
+    Runs separation in the calling process and keeps recently used models loaded.
+
+    Models are cached by model type, config content, checkpoint and device, and the least
+    recently used ones are released once `max_models` or `memory_budget` is exceeded.
+    """
+
+    def __init__(self, max_models=4, memory_budget=None):
+        """
+        Args:
+            max_models: Maximum number of models kept loaded.
+            memory_budget: Maximum size in bytes of the weights kept loaded, or None.
+        """
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(model_type, config_path, start_check_point, device):
+        with open(config_path, "rb") as f:
+            config_hash = hashlib.sha256(f.read()).hexdigest()
+        checkpoint = None
+        if start_check_point != "":
+            stat = os.stat(start_check_point)
+            checkpoint = (
+                os.path.abspath(start_check_point),
+                stat.st_mtime_ns,
+                stat.st_size,
+            )
+        return model_type, config_hash, checkpoint, str(device)
+
+    @staticmethod
+    def model_size(model):
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in list(model.parameters()) + list(model.buffers())
+        )
+
+    def get_model(
+        self, model_type, config_path, start_check_point, device, device_ids=0
+    ):
+        """
+        Returns a cached (model, config) pair, loading it on a cache miss.
+        """
+        key = self.cache_key(model_type, config_path, start_check_point, device)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                model, config, _ = self.models[key]
+                return model, config
+
+            model_load_start_time = time.time()
+            model, config = load_model(
+                model_type, config_path, start_check_point, device, device_ids
+            )
+            self.models[key] = (model, config, self.model_size(model))
+            self._evict()
+            print(
+                "Model load time: {:.2f} sec".format(
+                    time.time() - model_load_start_time
+                )
+            )
+            return model, config
+
+    def _evict(self):
+        evicted = False
+        while len(self.models) > 1 and (
+            len(self.models) > self.max_models
+            or (
+                self.memory_budget is not None
+                and sum(entry[2] for entry in self.models.values())
+                > self.memory_budget
+            )
+        ):
+            self.models.popitem(last=False)
+            evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def clear(self):
+        """
+        Releases every cached model.
+        """
+        with self.lock:
+            self.models.clear()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def separate(
+        self,
+        input_file,
+        store_dir,
+        model_type,
+        config_path,
+        start_check_point="",
+        force_cpu=False,
+        device_ids=0,
+        extract_instrumental=False,
+        flac_file=False,
+        pcm_type="PCM_24",
+        use_tta=False,
+        streaming=False,
+        tf_chunking=False,
+        verbose=False,
+    ):
+        """
+        Separates `input_file` into `store_dir` with the same outputs as the command line.
+        """
+        device = get_device(force_cpu, device_ids)
+        torch.backends.cudnn.benchmark = True
+        model, config = self.get_model(
+            model_type, config_path, start_check_point, device, device_ids
+        )
+        args = Args(
+            input_file,
+            store_dir,
+            model_type,
+            extract_instrumental,
+            not verbose,
+            flac_file,
+            pcm_type,
+            use_tta,
+            streaming,
+            tf_chunking,
+        )
+        run_file(model, args, config, device, verbose=verbose)
+
+    def separate_array(
+        self,
+        mix,
+        sample_rate,
+        model_type,
+        config_path,
+        start_check_point="",
+        force_cpu=False,
+        device_ids=0,
+        extract_instrumental=False,
+        use_tta=False,
+        tf_chunking=False,
+        verbose=False,
+    ):
+        """
+        Separates an in-memory (channels, samples) mix without touching the disk and
+        returns ({instrument: (samples, channels) float32 array}, 44100).
+        """
+        device = get_device(force_cpu, device_ids)
+        torch.backends.cudnn.benchmark = True
+        model, config = self.get_model(
+            model_type, config_path, start_check_point, device, device_ids
+        )
+        model.eval()
+        mix = np.asarray(mix, dtype=np.float32)
+        if mix.ndim == 2 and mix.shape[0] == 1:
+            mix = mix[0]
+        if sample_rate != 44100:
+            mix = librosa.resample(mix, orig_sr=sample_rate, target_sr=44100)
+        track = prepare_track(mix, 44100, config)
+        waveforms = demix(
+            config,
+            model,
+            track["mix"],
+            device,
+            pbar=verbose,
+            model_type=model_type,
+            use_tta=use_tta,
+            tf_chunking=tf_chunking,
+        )
+        stems = track_stems(waveforms, track, config, extract_instrumental)
+        return {
+            instr: np.ascontiguousarray(estimates, dtype=np.float32)
+            for instr, estimates in stems.items()
+        }, 44100
+
+    def separate_folder(
+        self,
+        input_folder,
+        store_dir,
+        model_type,
+        config_path,
+        start_check_point="",
+        force_cpu=False,
+        device_ids=0,
+        extract_instrumental=False,
+        flac_file=False,
+        pcm_type="PCM_24",
+        use_tta=False,
+        tf_chunking=False,
+        prefetch=2,
+        verbose=False,
+    ):
+        """
+        Separates every audio file in `input_folder` with cross-track batching.
+        """
+        device = get_device(force_cpu, device_ids)
+        torch.backends.cudnn.benchmark = True
+        model, config = self.get_model(
+            model_type, config_path, start_check_point, device, device_ids
+        )
+        args = Args(
+            None,
+            store_dir,
+            model_type,
+            extract_instrumental,
+            not verbose,
+            flac_file,
+            pcm_type,
+            use_tta,
+            tf_chunking=tf_chunking,
+            input_folder=input_folder,
+            prefetch=prefetch,
+        )
+        run_folder(model, args, config, device, verbose=verbose)
+
+
 def proc_file(args):
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -149,6 +734,18 @@ def proc_file(args):
     parser.add_argument(
         "--input_file", type=str, help="folder with mixtures to process"
     )
+    parser.add_argument(
+        "--input_folder",
+        type=str,
+        default=None,
+        help="Separate every audio file in this folder instead of --input_file. Chunks of consecutive tracks share model batches.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of upcoming tracks decoded in the background with --input_folder",
+    )
     parser.add_argument(
         "--store_dir", default="", type=str, help="path to store results as wav file"
     )
@@ -183,62 +780,45 @@ def proc_file(args):
     parser.add_argument(
         "--use_tta",
         action="store_true",
-        help="Flag adds test time augmentation during inference (polarity and channel inverse). While this triples the runtime, it reduces noise and slightly improves prediction quality.",
+        help="Flag adds test time augmentation during inference (polarity and channel inverse). The augmented copies are run in the same batches, tripling the model batch size; it reduces noise and slightly improves prediction quality.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read, separate and write the track block by block, so memory use doesn't grow with the track length.",
+    )
+    parser.add_argument(
+        "--tf_chunking",
+        action="store_true",
+        help="For bs_roformer and mel_band_roformer: compute one STFT of the track and overlap-add the masked spectra instead of transforming every chunk. Ignored with --streaming.",
     )
     if args is None:
         args = parser.parse_args()
     else:
         args = parser.parse_args(args)
 
-    device = "cpu"
-    if args.force_cpu:
-        device = "cpu"
-    elif torch.cuda.is_available():
+    device = get_device(args.force_cpu, args.device_ids)
+    if device.startswith("cuda"):
         print("CUDA is available, use --force_cpu to disable it.")
-        device = "cuda"
-        device = (
-            f"cuda:{args.device_ids[0]}"
-            if type(args.device_ids) == list
-            else f"cuda:{args.device_ids}"
-        )
-    elif torch.backends.mps.is_available():
-        device = "mps"
-
     print("Using device: ", device)
 
     model_load_start_time = time.time()
     torch.backends.cudnn.benchmark = True
 
-    model, config = get_model_from_config(args.model_type, args.config_path)
-    if args.start_check_point != "":
-        print("Start from checkpoint: {}".format(args.start_check_point))
-        if args.model_type == "htdemucs":
-            state_dict = torch.load(
-                args.start_check_point, map_location=device, weights_only=False
-            )
-            # Fix for htdemucs pretrained models
-            if "state" in state_dict:
-                state_dict = state_dict["state"]
-        else:
-            state_dict = torch.load(
-                args.start_check_point, map_location=device, weights_only=True
-            )
-        model.load_state_dict(state_dict)
-    print("Instruments: {}".format(config.training.instruments))
-
-    # in case multiple CUDA GPUs are used and --device_ids arg is passed
-    if (
-        type(args.device_ids) == list
-        and len(args.device_ids) > 1
-        and not args.force_cpu
-    ):
-        model = nn.DataParallel(model, device_ids=args.device_ids)
-
-    model = model.to(device)
+    model, config = load_model(
+        args.model_type,
+        args.config_path,
+        args.start_check_point,
+        device,
+        args.device_ids,
+    )
 
     print("Model load time: {:.2f} sec".format(time.time() - model_load_start_time))
 
-    run_file(model, args, config, device, verbose=True)
+    if args.input_folder:
+        run_folder(model, args, config, device, verbose=True)
+    else:
+        run_file(model, args, config, device, verbose=True)
 
 
 if __name__ == "__main__":
@@ -487,17 +487,10 @@ class BSRoformer(Module):
             hop_length=multi_stft_hop_size, normalized=multi_stft_normalized
         )
 
-    def forward(self, raw_audio, target=None, return_loss_breakdown=False):
+    def stft(self, raw_audio):
         """
-        einops
-
-        b - batch
-        f - freq
-        t - time
-        s - audio channel (1 for mono, 2 for stereo)
-        n - number of 'stems'
-        c - complex (2)
-        d - feature dimension
+        Returns the STFT of (b, t) or (b, s, t) audio as a real tensor of shape
+        (b, (f s), frames, 2), with the channels merged into the frequency axis.
         """
 
         device = raw_audio.device
@@ -539,6 +532,13 @@ class BSRoformer(Module):
         stft_repr = rearrange(
             stft_repr, "b s f t c -> b (f s) t c"
         )  # merge stereo / mono into the frequency, with frequency leading dimension, for band splitting
+        return stft_repr
+
+    def forward_spec(self, stft_repr):
+        """
+        Estimates the masks for a (b, (f s), frames, 2) STFT from `stft` and returns the
+        masked complex spectra of every stem, of shape (b, n, (f s), frames).
+        """
 
         x = rearrange(stft_repr, "b f t c -> b t (f c)")
 
@@ -574,8 +574,6 @@ class BSRoformer(Module):
 
         x = self.final_norm(x)
 
-        num_stems = len(self.mask_estimators)
-
         mask = torch.stack([fn(x) for fn in self.mask_estimators], dim=1)
         mask = rearrange(mask, "b n t (f c) -> b n f t c", c=2)
 
@@ -588,9 +586,18 @@ class BSRoformer(Module):
         stft_repr = torch.view_as_complex(stft_repr)
         mask = torch.view_as_complex(mask)
 
-        stft_repr = stft_repr * mask
+        return stft_repr * mask
+
+    def istft(self, stft_repr, length=None):
+        """
+        Turns the (b, n, (f s), frames) spectra from `forward_spec` back into audio of
+        shape (b, n, s, t), or (b, s, t) for a single stem.
+        """
 
-        # istft
+        device = stft_repr.device
+        x_is_mps = True if device.type == "mps" else False
+        num_stems = stft_repr.shape[1]
+        stft_window = self.stft_window_fn(device=device)
 
         stft_repr = rearrange(
             stft_repr, "b n (f s) t -> (b n s) f t", s=self.audio_channels
@@ -599,7 +606,11 @@ class BSRoformer(Module):
         # same as torch.stft() fix for MacOS MPS above
         try:
             recon_audio = torch.istft(
-                stft_repr, **self.stft_kwargs, window=stft_window, return_complex=False
+                stft_repr,
+                **self.stft_kwargs,
+                window=stft_window,
+                return_complex=False,
+                length=length,
             )
         except:
             recon_audio = torch.istft(
@@ -607,6 +618,7 @@ class BSRoformer(Module):
                 **self.stft_kwargs,
                 window=stft_window.cpu() if x_is_mps else stft_window,
                 return_complex=False,
+                length=length,
             ).to(device)
 
         recon_audio = rearrange(
@@ -616,6 +628,27 @@ class BSRoformer(Module):
         if num_stems == 1:
             recon_audio = rearrange(recon_audio, "b 1 s t -> b s t")
 
+        return recon_audio
+
+    def forward(self, raw_audio, target=None, return_loss_breakdown=False):
+        """
+        einops
+
+        b - batch
+        f - freq
+        t - time
+        s - audio channel (1 for mono, 2 for stereo)
+        n - number of 'stems'
+        c - complex (2)
+        d - feature dimension
+        """
+
+        device = raw_audio.device
+
+        stft_repr = self.forward_spec(self.stft(raw_audio))
+
+        recon_audio = self.istft(stft_repr)
+
         # if a target is passed in, calculate loss for learning
 
         if not exists(target):
@@ -470,17 +470,10 @@ class MelBandRoformer(Module):
 
         self.match_input_audio_length = match_input_audio_length
 
-    def forward(self, raw_audio, target=None, return_loss_breakdown=False):
+    def stft(self, raw_audio):
         """
-        einops
-
-        b - batch
-        f - freq
-        t - time
-        s - audio channel (1 for mono, 2 for stereo)
-        n - number of 'stems'
-        c - complex (2)
-        d - feature dimension
+        Returns the STFT of (b, t) or (b, s, t) audio as a real tensor of shape
+        (b, (f s), frames, 2), with the channels merged into the frequency axis.
         """
 
         device = raw_audio.device
@@ -490,8 +483,6 @@ class MelBandRoformer(Module):
 
         batch, channels, raw_audio_length = raw_audio.shape
 
-        istft_length = raw_audio_length if self.match_input_audio_length else None
-
         assert (not self.stereo and channels == 1) or (
             self.stereo and channels == 2
         ), "stereo needs to be set to True if passing in audio signal that is stereo (channel dimension of 2). also need to be False if mono (channel dimension of 1)"
@@ -511,6 +502,17 @@ class MelBandRoformer(Module):
         stft_repr = rearrange(
             stft_repr, "b s f t c -> b (f s) t c"
         )  # merge stereo / mono into the frequency, with frequency leading dimension, for band splitting
+        return stft_repr
+
+    def forward_spec(self, stft_repr):
+        """
+        Estimates the masks for a (b, (f s), frames, 2) STFT from `stft` and returns the
+        masked complex spectra of every stem, of shape (b, n, (f s), frames).
+        """
+
+        device = stft_repr.device
+        batch = stft_repr.shape[0]
+        channels = self.audio_channels
 
         # index out all frequencies for all frequency ranges across bands ascending in one go
 
@@ -591,9 +593,16 @@ class MelBandRoformer(Module):
 
         # modulate stft repr with estimated mask
 
-        stft_repr = stft_repr * masks_averaged
+        return stft_repr * masks_averaged
 
-        # istft
+    def istft(self, stft_repr, length=None):
+        """
+        Turns the (b, n, (f s), frames) spectra from `forward_spec` back into audio of
+        shape (b, n, s, t), or (b, s, t) for a single stem.
+        """
+
+        batch, num_stems = stft_repr.shape[:2]
+        stft_window = self.stft_window_fn(device=stft_repr.device)
 
         stft_repr = rearrange(
             stft_repr, "b n (f s) t -> (b n s) f t", s=self.audio_channels
@@ -604,7 +613,7 @@ class MelBandRoformer(Module):
             **self.stft_kwargs,
             window=stft_window,
             return_complex=False,
-            length=istft_length,
+            length=length,
         )
 
         recon_audio = rearrange(
@@ -618,6 +627,31 @@ class MelBandRoformer(Module):
         if num_stems == 1:
             recon_audio = rearrange(recon_audio, "b 1 s t -> b s t")
 
+        return recon_audio
+
+    def forward(self, raw_audio, target=None, return_loss_breakdown=False):
+        """
+        einops
+
+        b - batch
+        f - freq
+        t - time
+        s - audio channel (1 for mono, 2 for stereo)
+        n - number of 'stems'
+        c - complex (2)
+        d - feature dimension
+        """
+
+        device = raw_audio.device
+
+        istft_length = (
+            raw_audio.shape[-1] if self.match_input_audio_length else None
+        )
+
+        stft_repr = self.forward_spec(self.stft(raw_audio))
+
+        recon_audio = self.istft(stft_repr, length=istft_length)
+
         # if a target is passed in, calculate loss for learning
 
         if not exists(target):
@@ -0,0 +1,292 @@
+# coding: utf-8
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from inference import get_device, load_model
+from utils import (
+    PeakMemory,
+    demix,
+    device_name,
+    load_tuning_profile,
+    tuning_profile_key,
+    tuning_profile_path,
+)
+
+
+def measure(model, config, device, model_type, mix, use_tta=False):
+    """
+    Separates `mix` once and returns (realtime factor, peak memory in bytes, increase of
+    memory over the level before the run in bytes).
+    """
+    if device.startswith("cuda"):
+        torch.cuda.empty_cache()
+    with PeakMemory(device) as memory:
+        start_time = time.time()
+        demix(config, model, mix, device, model_type=model_type, use_tta=use_tta)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize(device)
+        elapsed = time.time() - start_time
+    return mix.shape[-1] / 44100 / elapsed, memory.peak, memory.increase
+
+
+def projected_peak(
+    model, config, device, model_type, mix, result, track_seconds, use_tta=False
+):
+    """
+    Peak memory of a separation of a `track_seconds` long track, extrapolated from the
+    measured `result` of `mix` and a run on its first half: the overlap-add accumulators
+    and the track itself grow linearly with the track length.
+    """
+    _, peak, increase = result
+    half = mix[:, : mix.shape[-1] // 2]
+    _, _, half_increase = measure(model, config, device, model_type, half, use_tta)
+    added_seconds = (mix.shape[-1] - half.shape[-1]) / 44100
+    per_second = max(increase - half_increase, 0) / added_seconds
+    return peak + per_second * max(track_seconds - mix.shape[-1] / 44100, 0)
+
+
+def is_out_of_memory(error):
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def tune(
+    model_type,
+    config_path,
+    start_check_point,
+    device,
+    device_ids=0,
+    seconds=30,
+    batch_sizes=(1, 2, 4, 8),
+    chunk_sizes=None,
+    num_overlaps=None,
+    memory_limit=None,
+    use_tta=False,
+    track_seconds=600,
+):
+    """
+    Profiles every combination of the candidate settings on synthetic audio and returns
+    the fastest one whose peak memory stays under `memory_limit`, or None. The peak is
+    extrapolated to a `track_seconds` long track, since the memory of a separation grows
+    with the track length.
+
+    Args:
+        model_type: Separation model type, as in inference.py.
+        config_path: Path to the model config.
+        start_check_point: Path to the model checkpoint.
+        device: Torch device to profile on.
+        device_ids: GPU ids, as in inference.py.
+        seconds: Length of the synthetic stereo track.
+        batch_sizes: Candidate inference.batch_size values.
+        chunk_sizes: Candidate audio.chunk_size values, the config's one by default.
+        num_overlaps: Candidate inference.num_overlap values, the config's one by default.
+        memory_limit: Memory ceiling in bytes, or None. Raises ValueError on CPU when
+            the process memory can't be measured.
+        use_tta: Whether to profile with test time augmentation.
+        track_seconds: Length of the longest track the settings must fit in memory.
+    """
+    if memory_limit is not None and not PeakMemory.measurable(device):
+        raise ValueError(
+            "Can't measure the memory of this process to enforce a memory ceiling, "
+            "install psutil"
+        )
+    model, config = load_model(
+        model_type,
+        config_path,
+        start_check_point,
+        device,
+        device_ids,
+        use_tuning_profile=False,
+    )
+    if model_type == "htdemucs":
+        chunk_sizes = [None]
+    elif not chunk_sizes:
+        chunk_sizes = [config.audio.chunk_size]
+    num_overlaps = num_overlaps or [config.inference.num_overlap]
+
+    rng = np.random.default_rng(0)
+    mix = (rng.standard_normal((2, int(seconds * 44100))) * 0.1).astype(np.float32)
+    # Warm-up so lazy initialization and cudnn autotuning don't count against the first run
+    warmup_length = min(mix.shape[-1], 5 * 44100)
+    demix(config, model, mix[:, :warmup_length], device, model_type=model_type)
+
+    results = []
+    for chunk_size, batch_size, num_overlap in itertools.product(
+        chunk_sizes, batch_sizes, num_overlaps
+    ):
+        if chunk_size is not None:
+            config.audio.chunk_size = chunk_size
+        config.inference.batch_size = batch_size
+        config.inference.num_overlap = num_overlap
+        settings = {"batch_size": batch_size, "num_overlap": num_overlap}
+        if chunk_size is not None:
+            settings["chunk_size"] = chunk_size
+        try:
+            result = measure(model, config, device, model_type, mix, use_tta)
+            throughput, peak_memory, _ = result
+            if memory_limit is not None:
+                peak_memory = projected_peak(
+                    model,
+                    config,
+                    device,
+                    model_type,
+                    mix,
+                    result,
+                    track_seconds,
+                    use_tta,
+                )
+        except (RuntimeError, MemoryError) as e:
+            if not is_out_of_memory(e):
+                raise
+            print("{}: out of memory".format(settings))
+            if device.startswith("cuda"):
+                torch.cuda.empty_cache()
+            continue
+        fits = memory_limit is None or peak_memory <= memory_limit
+        print(
+            "{}: {:.2f}x realtime, peak memory {:.0f} MB{}{}".format(
+                settings,
+                throughput,
+                peak_memory / 2**20,
+                "" if memory_limit is None else f" for {track_seconds:.0f}s tracks",
+                "" if fits else " (over the memory limit)",
+            )
+        )
+        if fits:
+            results.append(
+                dict(settings, throughput=throughput, peak_memory=peak_memory)
+            )
+
+    if not results:
+        return None
+    return max(results, key=lambda result: result["throughput"])
+
+
+def save_profile(
+    entry, model_type, config_path, device, memory_limit, path=None, track_seconds=None
+):
+    """
+    Stores the tuned settings for a model and device in this host's profile.
+    """
+    path = path or tuning_profile_path()
+    profile = load_tuning_profile(path)
+    profile["models"][tuning_profile_key(model_type, config_path, device)] = dict(
+        entry,
+        model_type=model_type,
+        config_path=os.path.abspath(config_path),
+        device=device_name(device),
+        memory_limit=memory_limit,
+        track_seconds=track_seconds,
+        tuned_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Finds the fastest chunk_size / batch_size / num_overlap for a separation model on this machine and saves them as a per-host profile used by inference.py and SeparationEngine."
+    )
+    parser.add_argument("--model_type", type=str, default="mdx23c")
+    parser.add_argument("--config_path", type=str, help="path to config file")
+    parser.add_argument("--start_check_point", type=str, default="")
+    parser.add_argument(
+        "--device_ids", nargs="+", type=int, default=0, help="list of gpu ids"
+    )
+    parser.add_argument("--force_cpu", action="store_true")
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=30,
+        help="length of the synthetic track used for profiling",
+    )
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--chunk_sizes",
+        nargs="+",
+        type=int,
+        default=None,
+        help="candidate chunk sizes (default: the config's); only models that accept any chunk length, such as the roformers, should be given others",
+    )
+    parser.add_argument(
+        "--num_overlaps",
+        nargs="+",
+        type=int,
+        default=None,
+        help="candidate overlaps (default: the config's); lower values are faster but may reduce quality",
+    )
+    parser.add_argument(
+        "--max_memory_gb",
+        type=float,
+        default=None,
+        help="memory ceiling: GPU memory on CUDA, process memory otherwise",
+    )
+    parser.add_argument(
+        "--max_track_seconds",
+        type=float,
+        default=600,
+        help="length of the longest track the settings must fit under --max_memory_gb",
+    )
+    parser.add_argument("--use_tta", action="store_true")
+    parser.add_argument(
+        "--profile_path",
+        type=str,
+        default=None,
+        help="profile to update (default: tuning/<hostname>.json next to this file)",
+    )
+    parser.add_argument(
+        "--dry_run", action="store_true", help="print the result without saving it"
+    )
+    args = parser.parse_args(args)
+
+    device = get_device(args.force_cpu, args.device_ids)
+    print("Using device: ", device)
+    memory_limit = (
+        int(args.max_memory_gb * 2**30) if args.max_memory_gb is not None else None
+    )
+    best = tune(
+        args.model_type,
+        args.config_path,
+        args.start_check_point,
+        device,
+        args.device_ids,
+        seconds=args.seconds,
+        batch_sizes=args.batch_sizes,
+        chunk_sizes=args.chunk_sizes,
+        num_overlaps=args.num_overlaps,
+        memory_limit=memory_limit,
+        use_tta=args.use_tta,
+        track_seconds=args.max_track_seconds,
+    )
+    if best is None:
+        print("No candidate settings fit in the memory limit.")
+        return None
+    print("Best settings: {}".format(best))
+    if not args.dry_run:
+        path = save_profile(
+            best,
+            args.model_type,
+            args.config_path,
+            device,
+            memory_limit,
+            args.profile_path,
+            args.max_track_seconds,
+        )
+        print("Saved tuning profile to {}".format(path))
+    return best
+
+
+if __name__ == "__main__":
+    main()
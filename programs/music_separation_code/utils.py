@@ -1,6 +1,12 @@
 # coding: utf-8
 __author__ = "Roman Solovyev (ZFTurbo): https://github.com/ZFTurbo/"
 
+import json
+import os
+import socket
+import sys
+import threading
+import types
 import numpy as np
 import torch
 import torch.nn as nn
@@ -8,9 +14,46 @@ import yaml
 from ml_collections import ConfigDict
 from omegaconf import OmegaConf
 from tqdm import tqdm
+from contextlib import contextmanager
 from numpy.typing import NDArray
 from typing import Dict
 
+# Per-host overrides of chunk_size / batch_size / num_overlap written by tune.py
+TUNING_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tuning")
+
+
+# The separation models import each other as the top-level `models` package
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+_models_package = None
+_models_lock = threading.Lock()
+
+
+@contextmanager
+def separation_models():
+    """
+    Makes `models` the package of the separation models while the block runs, as their
+    modules import each other as `models.<name>`. Whatever `models` was before, e.g. the
+    repository's models.py when running from its root, is put back afterwards, and the
+    loaded model modules stay cached under their `models.<name>` names.
+    """
+    global _models_package
+    with _models_lock:
+        previous = sys.modules.get("models")
+        if MODELS_DIR in list(getattr(previous, "__path__", [])):
+            yield
+            return
+        if _models_package is None:
+            _models_package = types.ModuleType("models")
+            _models_package.__path__ = [MODELS_DIR]
+        sys.modules["models"] = _models_package
+        try:
+            yield
+        finally:
+            if previous is None:
+                del sys.modules["models"]
+            else:
+                sys.modules["models"] = previous
+
 
 def get_model_from_config(model_type, config_path):
     with open(config_path) as f:
@@ -19,53 +62,54 @@ def get_model_from_config(model_type, config_path):
         else:
             config = ConfigDict(yaml.load(f, Loader=yaml.FullLoader))
 
-    if model_type == "mdx23c":
-        from models.mdx23c_tfc_tdf_v3 import TFC_TDF_net
+    with separation_models():
+        if model_type == "mdx23c":
+            from models.mdx23c_tfc_tdf_v3 import TFC_TDF_net
 
-        model = TFC_TDF_net(config)
-    elif model_type == "htdemucs":
-        from models.demucs4ht import get_model
+            model = TFC_TDF_net(config)
+        elif model_type == "htdemucs":
+            from models.demucs4ht import get_model
 
-        model = get_model(config)
-    elif model_type == "segm_models":
-        from models.segm_models import Segm_Models_Net
+            model = get_model(config)
+        elif model_type == "segm_models":
+            from models.segm_models import Segm_Models_Net
 
-        model = Segm_Models_Net(config)
-    elif model_type == "torchseg":
-        from models.torchseg_models import Torchseg_Net
+            model = Segm_Models_Net(config)
+        elif model_type == "torchseg":
+            from models.torchseg_models import Torchseg_Net
 
-        model = Torchseg_Net(config)
-    elif model_type == "mel_band_roformer":
-        from models.bs_roformer import MelBandRoformer
+            model = Torchseg_Net(config)
+        elif model_type == "mel_band_roformer":
+            from models.bs_roformer import MelBandRoformer
 
-        model = MelBandRoformer(**dict(config.model))
-    elif model_type == "bs_roformer":
-        from models.bs_roformer import BSRoformer
+            model = MelBandRoformer(**dict(config.model))
+        elif model_type == "bs_roformer":
+            from models.bs_roformer import BSRoformer
 
-        model = BSRoformer(**dict(config.model))
-    elif model_type == "swin_upernet":
-        from models.upernet_swin_transformers import Swin_UperNet_Model
+            model = BSRoformer(**dict(config.model))
+        elif model_type == "swin_upernet":
+            from models.upernet_swin_transformers import Swin_UperNet_Model
 
-        model = Swin_UperNet_Model(config)
-    elif model_type == "bandit":
-        from models.bandit.core.model import MultiMaskMultiSourceBandSplitRNNSimple
+            model = Swin_UperNet_Model(config)
+        elif model_type == "bandit":
+            from models.bandit.core.model import MultiMaskMultiSourceBandSplitRNNSimple
 
-        model = MultiMaskMultiSourceBandSplitRNNSimple(**config.model)
-    elif model_type == "bandit_v2":
-        from models.bandit_v2.bandit import Bandit
+            model = MultiMaskMultiSourceBandSplitRNNSimple(**config.model)
+        elif model_type == "bandit_v2":
+            from models.bandit_v2.bandit import Bandit
 
-        model = Bandit(**config.kwargs)
-    elif model_type == "scnet_unofficial":
-        from models.scnet_unofficial import SCNet
+            model = Bandit(**config.kwargs)
+        elif model_type == "scnet_unofficial":
+            from models.scnet_unofficial import SCNet
 
-        model = SCNet(**config.model)
-    elif model_type == "scnet":
-        from models.scnet import SCNet
+            model = SCNet(**config.model)
+        elif model_type == "scnet":
+            from models.scnet import SCNet
 
-        model = SCNet(**config.model)
-    else:
-        print("Unknown model: {}".format(model_type))
-        model = None
+            model = SCNet(**config.model)
+        else:
+            print("Unknown model: {}".format(model_type))
+            model = None
 
     return model, config
 
@@ -79,7 +123,70 @@ def _getWindowingArray(window_size, fade_size):
     return window
 
 
-def demix_track(config, model, mix, device, pbar=False):
+def _getWindowVariants(window_size, fade_size, device):
+    """
+    Crossfade windows for a chunk in the middle of the track, the first chunk (no fade-in),
+    the last chunk (no fade-out) and a chunk that is both, stacked in that order.
+    """
+    middle = _getWindowingArray(window_size, fade_size)
+    first = middle.clone()
+    first[:fade_size] = 1
+    last = middle.clone()
+    last[-fade_size:] = 1
+    single = torch.ones(window_size)
+    return torch.stack([middle, first, last, single]).to(device)
+
+
+def _overlap_add(result, counter, chunks, windows, start, step):
+    """
+    Adds a batch of consecutive chunks, `step` samples apart starting at `start`, into the
+    accumulators on the compute device.
+
+    Like a fold, each chunk is cut into `step`-long segments; segment k of every chunk
+    lands on the same frame grid shifted by k, so the batch is added with one slice
+    addition per segment index instead of one per chunk.
+
+    Args:
+        result: Accumulator of shape (rows, length).
+        counter: Window weight accumulator of shape (length,).
+        chunks: Model outputs of shape (batch, rows, chunk_size), overwritten.
+        windows: Window applied to each chunk, of shape (batch, chunk_size).
+        start: Position of the first chunk.
+        step: Distance between consecutive chunks.
+    """
+    batch, rows, chunk_size = chunks.shape
+    segments = -(-chunk_size // step)
+    pad = segments * step - chunk_size
+    frames = batch + segments - 1
+    # chunks is weighted in place; it's only padded when step doesn't divide chunk_size
+    weighted = chunks.mul_(windows[:, None, :])
+    weights = windows
+    if pad:
+        weighted = nn.functional.pad(weighted, (0, pad))
+        weights = nn.functional.pad(windows, (0, pad))
+    weighted = weighted.view(batch, rows, segments, step).transpose(0, 1)
+    weights = weights.view(batch, segments, step)
+    result_frames = result[:, start : start + frames * step].view(rows, frames, step)
+    counter_frames = counter[start : start + frames * step].view(frames, step)
+    for k in range(segments):
+        result_frames[:, k : k + batch] += weighted[:, :, k]
+        counter_frames[k : k + batch] += weights[:, k]
+
+
+def _apply_model(model, arr, use_tta=False):
+    """
+    Runs the model on a batch of chunks. With `use_tta`, the channel-swapped and
+    polarity-inverted copies are stacked into the same model call, then de-augmented and
+    averaged on the device.
+    """
+    if not use_tta:
+        return model(arr)
+    batch = arr.shape[0]
+    x = model(torch.cat([arr, arr.flip(1), -arr], dim=0))
+    return (x[:batch] + x[batch : 2 * batch].flip(-2) - x[2 * batch :]) / 3
+
+
+def demix_track(config, model, mix, device, pbar=False, use_tta=False):
     C = config.audio.chunk_size
     N = config.inference.num_overlap
     fade_size = C // 10
@@ -93,8 +200,9 @@ def demix_track(config, model, mix, device, pbar=False):
     if length_init > 2 * border and (border > 0):
         mix = nn.functional.pad(mix, (border, border), mode="reflect")
 
-    # windowingArray crossfades at segment boundaries to mitigate clicking artifacts
-    windowingArray = _getWindowingArray(C, fade_size)
+    # windowingArray crossfades at segment boundaries to mitigate clicking artifacts.
+    # The first chunk has no fade-in and chunks reaching the end have no fade-out.
+    windows = _getWindowVariants(C, fade_size, device)
 
     with torch.cuda.amp.autocast(enabled=config.training.use_amp):
         use_amp = getattr(config.training, "use_amp", False)
@@ -104,11 +212,16 @@ def demix_track(config, model, mix, device, pbar=False):
             else:
                 req_shape = (len(config.training.instruments),) + tuple(mix.shape)
 
-            result = torch.zeros(req_shape, dtype=torch.float32)
-            counter = torch.zeros(req_shape, dtype=torch.float32)
+            # Accumulate on the compute device, with room for the padded last chunk
+            length = mix.shape[1]
+            rows = req_shape[0] * mix.shape[0]
+            result = torch.zeros(
+                (rows, length + C + step), dtype=torch.float32, device=device
+            )
+            counter = torch.zeros(length + C + step, dtype=torch.float32, device=device)
             i = 0
             batch_data = []
-            batch_locations = []
+            batch_start = 0
             progress_bar = (
                 tqdm(total=mix.shape[1], desc="Processing audio chunks", leave=False)
                 if pbar
@@ -118,42 +231,42 @@ def demix_track(config, model, mix, device, pbar=False):
             while i < mix.shape[1]:
                 # print(i, i + C, mix.shape[1])
                 part = mix[:, i : i + C].to(device)
-                length = part.shape[-1]
-                if length < C:
-                    if length > C // 2 + 1:
+                chunk_length = part.shape[-1]
+                if chunk_length < C:
+                    if chunk_length > C // 2 + 1:
                         part = nn.functional.pad(
-                            input=part, pad=(0, C - length), mode="reflect"
+                            input=part, pad=(0, C - chunk_length), mode="reflect"
                         )
                     else:
                         part = nn.functional.pad(
                             input=part,
-                            pad=(0, C - length, 0, 0),
+                            pad=(0, C - chunk_length, 0, 0),
                             mode="constant",
                             value=0,
                         )
+                if not batch_data:
+                    batch_start = i
                 batch_data.append(part)
-                batch_locations.append((i, length))
                 i += step
 
                 if len(batch_data) >= batch_size or (i >= mix.shape[1]):
                     arr = torch.stack(batch_data, dim=0)
-                    x = model(arr)
+                    x = _apply_model(model, arr, use_tta)
 
-                    window = windowingArray
-                    if i - step == 0:  # First audio chunk, no fadein
-                        window[:fade_size] = 1
-                    elif i >= mix.shape[1]:  # Last audio chunk, no fadeout
-                        window[-fade_size:] = 1
-
-                    for j in range(len(batch_locations)):
-                        start, l = batch_locations[j]
-                        result[..., start : start + l] += (
-                            x[j][..., :l].cpu() * window[..., :l]
-                        )
-                        counter[..., start : start + l] += window[..., :l]
+                    starts = batch_start + step * torch.arange(
+                        len(batch_data), device=device
+                    )
+                    variant = (starts == 0).long() + 2 * (starts + C >= length).long()
+                    _overlap_add(
+                        result,
+                        counter,
+                        x.float().reshape(len(batch_data), rows, C),
+                        windows[variant],
+                        batch_start,
+                        step,
+                    )
 
                     batch_data = []
-                    batch_locations = []
 
                 if progress_bar:
                     progress_bar.update(step)
@@ -161,8 +274,8 @@ def demix_track(config, model, mix, device, pbar=False):
             if progress_bar:
                 progress_bar.close()
 
-            estimated_sources = result / counter
-            estimated_sources = estimated_sources.cpu().numpy()
+            estimated_sources = result[:, :length] / counter[:length]
+            estimated_sources = estimated_sources.view(req_shape).cpu().numpy()
             np.nan_to_num(estimated_sources, copy=False, nan=0.0)
 
             if length_init > 2 * border and (border > 0):
@@ -177,7 +290,120 @@ def demix_track(config, model, mix, device, pbar=False):
         }
 
 
-def demix_track_demucs(config, model, mix, device, pbar=False):
+def _apply_model_spec(model, spec, use_tta=False):
+    """
+    Spectral counterpart of _apply_model for models with stft/forward_spec/istft: the
+    channel swap acts on the channels interleaved in the frequency axis.
+    """
+    if not use_tta:
+        return model.forward_spec(spec)
+    batch = spec.shape[0]
+    swap = lambda x, dim: (
+        x.unflatten(dim, (-1, model.audio_channels)).flip(dim + 1).flatten(dim, dim + 1)
+    )
+    x = model.forward_spec(torch.cat([spec, swap(spec, 1), -spec], dim=0))
+    return (x[:batch] + swap(x[batch : 2 * batch], 2) - x[2 * batch :]) / 3
+
+
+def demix_track_tf(config, model, mix, device, pbar=False, use_tta=False):
+    """
+    demix_track for the band-split roformers, chunked in the time-frequency domain.
+
+    The padded track goes through one STFT, overlapping frame windows of it are masked by
+    the model and overlap-added as spectra, and a single ISTFT gives the stems back. Each
+    sample is transformed once instead of once per overlapping chunk, and chunks no longer
+    see STFT edge effects, at the cost of keeping the track's spectrum on the device.
+    """
+    net = model.module if isinstance(model, nn.DataParallel) else model
+    C = config.audio.chunk_size
+    N = config.inference.num_overlap
+    step = int(C // N)
+    border = C - step
+    batch_size = config.inference.batch_size
+    hop_length = net.stft_kwargs["hop_length"]
+    chunk_frames = C // hop_length + 1
+    step_frames = max(step // hop_length, 1)
+
+    length_init = mix.shape[-1]
+
+    # Do pad from the beginning and end to account floating window results better
+    if length_init > 2 * border and (border > 0):
+        mix = nn.functional.pad(mix, (border, border), mode="reflect")
+
+    windows = _getWindowVariants(chunk_frames, chunk_frames // 10, device)
+
+    if config.training.target_instrument is not None:
+        instruments = [config.training.target_instrument]
+    else:
+        instruments = config.training.instruments
+
+    with torch.cuda.amp.autocast(enabled=config.training.use_amp):
+        with torch.inference_mode():
+            spec = net.stft(mix[None].to(device))
+            _, bins, frames, _ = spec.shape
+            # Zero frames past the end for the last, partial chunks
+            spec = nn.functional.pad(spec, (0, 0, 0, chunk_frames))
+
+            rows = len(instruments) * bins * 2
+            result = torch.zeros(
+                (rows, frames + chunk_frames + step_frames),
+                dtype=torch.float32,
+                device=device,
+            )
+            counter = torch.zeros(
+                frames + chunk_frames + step_frames, dtype=torch.float32, device=device
+            )
+            progress_bar = (
+                tqdm(total=frames, desc="Processing spectrogram chunks", leave=False)
+                if pbar
+                else None
+            )
+
+            for batch_start in range(0, frames, step_frames * batch_size):
+                starts = torch.arange(
+                    batch_start,
+                    min(batch_start + step_frames * batch_size, frames),
+                    step_frames,
+                    device=device,
+                )
+                parts = spec[0].unfold(1, chunk_frames, step_frames)
+                parts = parts[:, batch_start // step_frames :][:, : len(starts)]
+                x = _apply_model_spec(net, parts.permute(1, 0, 3, 2), use_tta)
+                x = torch.view_as_real(x).float().transpose(-1, -2)
+                variant = (starts == 0).long() + 2 * (
+                    starts + chunk_frames >= frames
+                ).long()
+                _overlap_add(
+                    result,
+                    counter,
+                    x.reshape(len(starts), rows, chunk_frames),
+                    windows[variant],
+                    batch_start,
+                    step_frames,
+                )
+                if progress_bar:
+                    progress_bar.update(step_frames * len(starts))
+
+            if progress_bar:
+                progress_bar.close()
+
+            estimated = torch.nan_to_num(result[:, :frames] / counter[:frames], nan=0.0)
+            estimated = estimated.view(len(instruments), bins, 2, frames)
+            estimated = torch.view_as_complex(estimated.transpose(-1, -2).contiguous())
+            estimated_sources = net.istft(estimated[None], length=mix.shape[-1])
+            estimated_sources = estimated_sources.reshape(
+                len(instruments), mix.shape[0], -1
+            )
+            estimated_sources = estimated_sources.cpu().numpy()
+
+            if length_init > 2 * border and (border > 0):
+                # Remove pad
+                estimated_sources = estimated_sources[..., border:-border]
+
+    return {k: v for k, v in zip(instruments, estimated_sources)}
+
+
+def demix_track_demucs(config, model, mix, device, pbar=False, use_tta=False):
     S = len(config.training.instruments)
     C = config.training.samplerate * config.training.segment
     N = config.inference.num_overlap
@@ -213,7 +439,7 @@ def demix_track_demucs(config, model, mix, device, pbar=False):
 
                 if len(batch_data) >= batch_size or (i >= mix.shape[1]):
                     arr = torch.stack(batch_data, dim=0)
-                    x = model(arr)
+                    x = _apply_model(model, arr, use_tta)
                     for j in range(len(batch_locations)):
                         start, l = batch_locations[j]
                         result[..., start : start + l] += x[j][..., :l].cpu()
@@ -237,6 +463,331 @@ def demix_track_demucs(config, model, mix, device, pbar=False):
         return estimated_sources
 
 
+class _BatchedTrack:
+    """
+    Overlap-add state of one track in `demix_tracks`.
+    """
+
+    def __init__(self, key, mix, rows, chunk_size, step, border, device):
+        self.key = key
+        self.length_init = mix.shape[-1]
+        # Same reflect padding as demix_track, so results match a per-track run
+        self.padded = self.length_init > 2 * border and border > 0
+        if self.padded:
+            mix = nn.functional.pad(mix, (border, border), mode="reflect")
+        self.mix = mix
+        self.length = mix.shape[1]
+        self.result = torch.zeros(
+            (rows, self.length + chunk_size + step), dtype=torch.float32, device=device
+        )
+        self.counter = torch.zeros(
+            self.length + chunk_size + step, dtype=torch.float32, device=device
+        )
+        self.next_start = 0
+
+
+def demix_tracks(config, model, mixes, device, pbar=False, use_tta=False):
+    """
+    Separates several tracks with shared model batches and yields (key, estimates) pairs
+    in input order as each track completes.
+
+    Chunks are taken from the tracks in turn, so a batch that would end a track early is
+    filled with the first chunks of the next one. Every chunk is overlap-added into the
+    accumulators of the track it came from. Only the tracks with chunks in the current
+    batch are kept in memory, and `mixes` is read lazily, so it can be a generator that
+    decodes upcoming files in the background.
+
+    Args:
+        config: Model config.
+        model: Separation model.
+        mixes: Iterable of (key, mix) pairs, mix of shape (channels, samples).
+        device: Torch device the model runs on.
+        pbar: Whether to show a progress bar over the tracks.
+        use_tta: Whether to use test time augmentation.
+    """
+    C = config.audio.chunk_size
+    N = config.inference.num_overlap
+    fade_size = C // 10
+    step = int(C // N)
+    border = C - step
+    batch_size = config.inference.batch_size
+    if config.training.target_instrument is not None:
+        instruments = [config.training.target_instrument]
+    else:
+        instruments = config.training.instruments
+    windows = _getWindowVariants(C, fade_size, device)
+    mixes = iter(mixes)
+    progress_bar = tqdm(desc="Processing tracks", leave=False) if pbar else None
+
+    def finish(track):
+        estimated_sources = (
+            track.result[:, : track.length] / track.counter[: track.length]
+        )
+        estimated_sources = (
+            estimated_sources.view((len(instruments),) + tuple(track.mix.shape))
+            .cpu()
+            .numpy()
+        )
+        np.nan_to_num(estimated_sources, copy=False, nan=0.0)
+        if track.padded:
+            estimated_sources = estimated_sources[..., border:-border]
+        if progress_bar:
+            progress_bar.update(1)
+        return track.key, {k: v for k, v in zip(instruments, estimated_sources)}
+
+    with torch.cuda.amp.autocast(enabled=config.training.use_amp):
+        with torch.inference_mode():
+            current = None
+            exhausted = False
+            while True:
+                # Fill the batch with (track, chunk start, chunk) from consecutive tracks
+                batch_data = []
+                while len(batch_data) < batch_size:
+                    if current is None or current.next_start >= current.length:
+                        try:
+                            key, mix = next(mixes)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        mix = torch.as_tensor(mix, dtype=torch.float32)
+                        current = _BatchedTrack(
+                            key,
+                            mix,
+                            len(instruments) * mix.shape[0],
+                            C,
+                            step,
+                            border,
+                            device,
+                        )
+                    i = current.next_start
+                    part = current.mix[:, i : i + C].to(device)
+                    chunk_length = part.shape[-1]
+                    if chunk_length < C:
+                        if chunk_length > C // 2 + 1:
+                            part = nn.functional.pad(
+                                input=part, pad=(0, C - chunk_length), mode="reflect"
+                            )
+                        else:
+                            part = nn.functional.pad(
+                                input=part,
+                                pad=(0, C - chunk_length, 0, 0),
+                                mode="constant",
+                                value=0,
+                            )
+                    batch_data.append((current, i, part))
+                    current.next_start += step
+
+                if batch_data:
+                    x = _apply_model(
+                        model, torch.stack([part for _, _, part in batch_data]), use_tta
+                    )
+                    x = x.float().reshape(len(batch_data), -1, C)
+                    # Route each run of chunks back to its track
+                    first = 0
+                    while first < len(batch_data):
+                        track = batch_data[first][0]
+                        last = first
+                        while last < len(batch_data) and batch_data[last][0] is track:
+                            last += 1
+                        starts = torch.tensor(
+                            [start for _, start, _ in batch_data[first:last]],
+                            device=device,
+                        )
+                        variant = (starts == 0).long() + 2 * (
+                            starts + C >= track.length
+                        ).long()
+                        _overlap_add(
+                            track.result,
+                            track.counter,
+                            x[first:last],
+                            windows[variant],
+                            batch_data[first][1],
+                            step,
+                        )
+                        if track.next_start >= track.length:
+                            yield finish(track)
+                        first = last
+
+                if exhausted:
+                    break
+
+    if progress_bar:
+        progress_bar.close()
+
+
+def demix_track_stream(
+    config, model, blocks, device, pbar=False, model_type=None, use_tta=False
+):
+    """
+    Streaming counterpart of demix for long tracks.
+
+    `blocks` yields consecutive (channels, samples) float32 arrays of the mix. Only the
+    input and overlap-add state still covered by an unfinished chunk are kept, so memory
+    is O(chunk_size * batch_size) whatever the track length. For every finished region a
+    (mix, estimates) pair is yielded, where `mix` is that region of the input and
+    `estimates` maps each instrument to a (channels, samples) array.
+    """
+    N = config.inference.num_overlap
+    batch_size = config.inference.batch_size
+    if model_type == "htdemucs":
+        C = config.training.samplerate * config.training.segment
+        step = C // N
+        border = 0
+        windows = torch.ones((4, C), device=device)
+        instruments = list(config.training.instruments)
+    else:
+        C = config.audio.chunk_size
+        step = int(C // N)
+        border = C - step
+        windows = _getWindowVariants(C, C // 10, device)
+        instruments = (
+            [config.training.target_instrument]
+            if config.training.target_instrument is not None
+            else list(config.training.instruments)
+        )
+
+    blocks = iter(blocks)
+    buffer = []
+    buffer_length = 0
+    exhausted = False
+    # Read enough to know whether the track gets the reflect padding of demix_track
+    while buffer_length <= 2 * border:
+        block = next(blocks, None)
+        if block is None:
+            exhausted = True
+            break
+        buffer.append(torch.as_tensor(block, dtype=torch.float32))
+        buffer_length += block.shape[-1]
+    if not buffer:
+        return
+    buffer = torch.cat(buffer, 1)
+    padded = border > 0 and buffer.shape[1] > 2 * border
+    if padded:
+        buffer = torch.cat([buffer[:, 1 : border + 1].flip(-1), buffer], 1)
+    channels = buffer.shape[0]
+    rows = len(instruments) * channels
+    # Position of buffer[:, 0] and total length, in padded coordinates
+    buffer_start = 0
+    length = None
+
+    # Overlap-add state for the region between the last emitted sample and the last chunk
+    capacity = C + (batch_size + 1) * step
+    result = torch.zeros((rows, capacity), dtype=torch.float32, device=device)
+    counter = torch.zeros(capacity, dtype=torch.float32, device=device)
+    emitted = 0
+
+    progress_bar = (
+        tqdm(desc="Processing audio chunks", unit="samples", leave=False)
+        if pbar
+        else None
+    )
+
+    with torch.cuda.amp.autocast(enabled=config.training.use_amp):
+        with torch.inference_mode():
+            i = 0
+            batch_data = []
+            batch_start = 0
+            while length is None or i < length:
+                # Make sure the chunk is complete or the end of the track is known
+                parts = [buffer]
+                end = buffer_start + buffer.shape[1]
+                while not exhausted and end <= i + C:
+                    block = next(blocks, None)
+                    if block is None:
+                        exhausted = True
+                    else:
+                        parts.append(torch.as_tensor(block, dtype=torch.float32))
+                        end += block.shape[-1]
+                buffer = torch.cat(parts, 1)
+                if exhausted and length is None:
+                    if padded:
+                        buffer = torch.cat(
+                            [buffer, buffer[:, -border - 1 : -1].flip(-1)], 1
+                        )
+                    length = buffer_start + buffer.shape[1]
+                    if progress_bar:
+                        progress_bar.total = length
+                    if i >= length:
+                        break
+
+                part = buffer[:, i - buffer_start : i - buffer_start + C].to(device)
+                chunk_length = part.shape[-1]
+                if chunk_length < C:
+                    if model_type != "htdemucs" and chunk_length > C // 2 + 1:
+                        part = nn.functional.pad(
+                            input=part, pad=(0, C - chunk_length), mode="reflect"
+                        )
+                    else:
+                        part = nn.functional.pad(
+                            input=part,
+                            pad=(0, C - chunk_length, 0, 0),
+                            mode="constant",
+                            value=0,
+                        )
+                if not batch_data:
+                    batch_start = i
+                batch_data.append(part)
+                i += step
+                if progress_bar:
+                    progress_bar.update(step)
+
+                last_batch = length is not None and i >= length
+                if len(batch_data) < batch_size and not last_batch:
+                    continue
+
+                x = _apply_model(model, torch.stack(batch_data, dim=0), use_tta)
+                starts = batch_start + step * torch.arange(
+                    len(batch_data), device=device
+                )
+                variant = (starts == 0).long()
+                if length is not None:
+                    variant += 2 * (starts + C >= length).long()
+                _overlap_add(
+                    result,
+                    counter,
+                    x.float().reshape(len(batch_data), rows, C),
+                    windows[variant],
+                    batch_start - emitted,
+                    step,
+                )
+                batch_data = []
+
+                # No later chunk starts before i, so everything up to it is final
+                done = i if length is None else min(i, length)
+                count = done - emitted
+                estimates = result[:, :count] / counter[:count]
+                estimates = estimates.view(len(instruments), channels, count)
+                estimates = estimates.cpu().numpy()
+                np.nan_to_num(estimates, copy=False, nan=0.0)
+                mix = buffer[:, emitted - buffer_start : done - buffer_start].numpy()
+
+                # Drop the reflect padding
+                start = border - emitted if padded else 0
+                stop = count
+                if padded and length is not None:
+                    stop = min(count, length - border - emitted)
+                if stop > max(start, 0):
+                    start = max(start, 0)
+                    yield mix[:, start:stop], {
+                        instr: estimates[k][:, start:stop]
+                        for k, instr in enumerate(instruments)
+                    }
+
+                result = result.roll(-count, 1)
+                result[:, -count:] = 0
+                counter = counter.roll(-count)
+                counter[-count:] = 0
+                emitted = done
+                # Keep the samples the reflect padding at the end may still need
+                keep = min(emitted, buffer_start + buffer.shape[1] - border - 1)
+                if keep > buffer_start:
+                    buffer = buffer[:, keep - buffer_start :]
+                    buffer_start = keep
+
+    if progress_bar:
+        progress_bar.close()
+
+
 def sdr(references, estimates):
     # compute SDR for one song
     delta = 1e-7  # avoid numerical errors
@@ -248,10 +799,149 @@ def sdr(references, estimates):
 
 
 def demix(
-    config, model, mix: NDArray, device, pbar=False, model_type: str = None
+    config,
+    model,
+    mix: NDArray,
+    device,
+    pbar=False,
+    model_type: str = None,
+    use_tta=False,
+    tf_chunking=False,
 ) -> Dict[str, NDArray]:
     mix = torch.tensor(mix, dtype=torch.float32)
+    if tf_chunking and hasattr(getattr(model, "module", model), "forward_spec"):
+        return demix_track_tf(config, model, mix, device, pbar=pbar, use_tta=use_tta)
     if model_type == "htdemucs":
-        return demix_track_demucs(config, model, mix, device, pbar=pbar)
+        return demix_track_demucs(
+            config, model, mix, device, pbar=pbar, use_tta=use_tta
+        )
     else:
-        return demix_track(config, model, mix, device, pbar=pbar)
+        return demix_track(config, model, mix, device, pbar=pbar, use_tta=use_tta)
+
+
+def device_name(device):
+    """
+    Describes the hardware behind a torch device, e.g. "cuda:NVIDIA GeForce RTX 3060".
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        return "cuda:" + torch.cuda.get_device_name(device)
+    return device.type
+
+
+def tuning_profile_path(profile_dir=None):
+    """
+    Path of this host's tuning profile.
+    """
+    return os.path.join(
+        profile_dir or TUNING_PROFILE_DIR, "{}.json".format(socket.gethostname())
+    )
+
+
+def tuning_profile_key(model_type, config_path, device):
+    return "{}|{}|{}".format(
+        model_type, os.path.abspath(config_path), device_name(device)
+    )
+
+
+def load_tuning_profile(path=None):
+    """
+    Reads a tuning profile, returning an empty one if it doesn't exist or can't be read.
+    """
+    path = path or tuning_profile_path()
+    if not os.path.isfile(path):
+        return {"host": socket.gethostname(), "models": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print("Ignoring unreadable tuning profile {}: {}".format(path, e))
+        return {"host": socket.gethostname(), "models": {}}
+
+
+def apply_tuning_profile(config, model_type, config_path, device, path=None):
+    """
+    Overrides the chunking settings of `config` with the tuned ones for this model and
+    device, if this host's profile has them. Returns True when settings were applied.
+    """
+    entry = load_tuning_profile(path)["models"].get(
+        tuning_profile_key(model_type, config_path, device)
+    )
+    if entry is None:
+        return False
+    if "chunk_size" in entry and model_type != "htdemucs":
+        config.audio.chunk_size = entry["chunk_size"]
+    config.inference.batch_size = entry["batch_size"]
+    config.inference.num_overlap = entry["num_overlap"]
+    print(
+        "Using tuned settings: chunk_size={}, batch_size={}, num_overlap={}".format(
+            entry.get("chunk_size"), entry["batch_size"], entry["num_overlap"]
+        )
+    )
+    return True
+
+
+def _current_rss():
+    """Resident set size of the process in bytes, or None if it can't be read."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemory:
+    """
+    Measures the peak memory used while the block runs: allocated CUDA memory on CUDA
+    devices, the sampled resident set size of the process otherwise. `peak` is the
+    absolute peak in bytes, `increase` the peak above the level at entry. Both stay 0
+    when the resident set size can't be read, see `measurable`.
+    """
+
+    def __init__(self, device, interval=0.01):
+        self.device = torch.device(device)
+        self.interval = interval
+        self.peak = self.increase = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def measurable(device):
+        """Whether the memory of `device` can be measured."""
+        return torch.device(device).type == "cuda" or _current_rss() is not None
+
+    def __enter__(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._base = torch.cuda.memory_allocated(self.device)
+        elif _current_rss() is None:
+            self._base = None
+        else:
+            self._base = self.peak = _current_rss()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __exit__(self, *exc):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            self.peak = torch.cuda.max_memory_allocated(self.device)
+        elif self._base is None:
+            return
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss())
+        self.increase = self.peak - self._base
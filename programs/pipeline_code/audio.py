@@ -0,0 +1,101 @@
+import librosa
+import numpy as np
+import soundfile as sf
+
+
+class AudioBuffer:
+    """
+    Decoded audio passed between stages: float32 samples of shape (frames, channels)
+    and their sampling rate.
+    """
+
+    def __init__(self, samples, sample_rate):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+
+    @property
+    def frames(self):
+        return self.samples.shape[0]
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    @classmethod
+    def read(cls, path):
+        """
+        Decodes a file with soundfile, falling back to librosa for other formats.
+        """
+        try:
+            samples, sample_rate = sf.read(path, dtype="float32", always_2d=True)
+        except RuntimeError:
+            samples, sample_rate = librosa.load(path, sr=None, mono=False)
+            samples = samples.T if samples.ndim > 1 else samples
+        return cls(samples, sample_rate)
+
+    def write(self, path, subtype="FLOAT"):
+        """
+        Writes the samples in the soundfile format given by the extension, float WAV
+        by default.
+        """
+        sf.write(path, self.samples, self.sample_rate, subtype=subtype)
+        return path
+
+    def mono(self):
+        return self.samples.mean(axis=1)
+
+    def resample(self, sample_rate):
+        if sample_rate == self.sample_rate:
+            return self
+        samples = librosa.resample(
+            self.samples.T, orig_sr=self.sample_rate, target_sr=sample_rate
+        )
+        return AudioBuffer(samples.T, sample_rate)
+
+    def with_channels(self, channels):
+        """
+        Up-mixes mono to `channels` channels, or down-mixes to mono.
+        """
+        if channels == self.channels:
+            return self
+        return AudioBuffer(map_channels(self.samples, channels), self.sample_rate)
+
+
+def map_channels(samples, channels):
+    """
+    Maps (frames, channels) samples to another channel count: mono is copied to every
+    channel and anything is down-mixed to mono by averaging.
+    """
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    raise ValueError(f"Cannot map {samples.shape[1]} channels to {channels}")
+
+
+def as_buffer(value):
+    """
+    Returns a stage input as an AudioBuffer, decoding it if it's a file path.
+    """
+    if isinstance(value, AudioBuffer):
+        return value
+    return AudioBuffer.read(value)
+
+
+def as_file(value, path):
+    """
+    Returns a stage input as a file path, writing it to `path` (without extension) as a
+    float WAV if it's in memory. For tools that only read files.
+    """
+    if isinstance(value, AudioBuffer):
+        return value.write(path + ".wav")
+    return value
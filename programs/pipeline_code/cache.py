@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import numpy as np
+
+from programs.pipeline_code.audio import AudioBuffer
+
+
+class StageCache:
+    """
+    A content-addressed store of stage outputs on disk.
+
+    Every entry is a directory named after its key holding the output files and a
+    meta.json. In-memory AudioBuffer outputs are spilled as raw float32 .npy arrays,
+    which cost no encoding and are memory-mapped back on a hit. The meta file's
+    modification time records the last use, and the least recently used entries are
+    deleted once the total size exceeds `max_bytes`. Entries pinned by a running
+    pipeline are never evicted, and removing one deletes it once it's unpinned.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        """
+        Args:
+            cache_dir: Directory holding the cache entries.
+            max_bytes: Maximum total size of the entries in bytes, or None for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.pins = {}
+        # Pinned entries to delete once they are unpinned
+        self.removed = set()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _read_meta(self, key):
+        try:
+            with open(
+                os.path.join(self.entry_dir(key), "meta.json"), "r", encoding="utf-8"
+            ) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """
+        Returns the {output name: path or AudioBuffer} of a cached entry and marks it as
+        used, or None if the entry is missing or incomplete.
+        """
+        with self.lock:
+            meta = self._read_meta(key)
+            if meta is None:
+                return None
+            outputs = {
+                name: os.path.join(self.entry_dir(key), file_name)
+                for name, file_name in meta["outputs"].items()
+            }
+            if not all(os.path.isfile(path) for path in outputs.values()):
+                self.remove(key)
+                return None
+            os.utime(os.path.join(self.entry_dir(key), "meta.json"))
+            for name, sample_rate in meta.get("sample_rates", {}).items():
+                outputs[name] = AudioBuffer(
+                    np.load(outputs[name], mmap_mode="r"), sample_rate
+                )
+            return outputs
+
+    def scratch_dir(self):
+        """
+        Creates an empty working directory on the cache's filesystem, so files written
+        there can be moved into an entry without copying.
+        """
+        path = os.path.join(self.cache_dir, "tmp", uuid.uuid4().hex)
+        os.makedirs(path)
+        return path
+
+    def put(self, key, outputs, metadata=None):
+        """
+        Stores the outputs in a new entry and returns them as get() would.
+
+        Args:
+            key: Entry key.
+            outputs: {output name: path or AudioBuffer}; files are moved into the entry.
+            metadata: Extra JSON-serializable fields for meta.json.
+        """
+        staging = self.scratch_dir()
+        files = {}
+        sample_rates = {}
+        size = 0
+        for name, output in outputs.items():
+            if isinstance(output, AudioBuffer):
+                file_name = name + ".npy"
+                np.save(os.path.join(staging, file_name), output.samples)
+                sample_rates[name] = output.sample_rate
+            else:
+                file_name = name + os.path.splitext(output)[1]
+                shutil.move(output, os.path.join(staging, file_name))
+            files[name] = file_name
+            size += os.path.getsize(os.path.join(staging, file_name))
+        meta = dict(
+            metadata or {},
+            key=key,
+            outputs=files,
+            sample_rates=sample_rates,
+            size=size,
+            created=time.time(),
+        )
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+
+        with self.lock:
+            entry_dir = self.entry_dir(key)
+            existing = self.get(key) if key in self.pins else None
+            if existing is not None:
+                # Stored meanwhile by another run, which may be reading its files
+                shutil.rmtree(staging, ignore_errors=True)
+                return existing
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            self.removed.discard(key)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            os.replace(staging, entry_dir)
+            self.pin(key)
+            try:
+                self.evict()
+                return self.get(key)
+            finally:
+                self.unpin(key)
+
+    def remove(self, key):
+        """
+        Deletes an entry, or marks it for deletion if a running pipeline pinned it.
+        """
+        with self.lock:
+            if key in self.pins:
+                self.removed.add(key)
+            else:
+                shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def pin(self, key):
+        with self.lock:
+            self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        with self.lock:
+            self.pins[key] -= 1
+            if not self.pins[key]:
+                del self.pins[key]
+                if key in self.removed:
+                    self.removed.discard(key)
+                    self.remove(key)
+
+    def entries(self):
+        """
+        Returns (key, size, last use) for every complete entry.
+        """
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if prefix == "tmp" or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                meta_path = os.path.join(prefix_dir, key, "meta.json")
+                meta = self._read_meta(key)
+                if meta is not None:
+                    entries.append((key, meta["size"], os.path.getmtime(meta_path)))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Deletes the least recently used unpinned entries until the cache fits in
+        `max_bytes`.
+        """
+        if self.max_bytes is None:
+            return
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for key, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if key in self.pins:
+                    continue
+                self.remove(key)
+                total -= size
+
+    def clear_scratch(self, max_age=24 * 3600):
+        """
+        Deletes working directories left behind by interrupted runs.
+        """
+        tmp_dir = os.path.join(self.cache_dir, "tmp")
+        if not os.path.isdir(tmp_dir):
+            return
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if time.time() - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
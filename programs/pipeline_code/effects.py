@@ -0,0 +1,62 @@
+import numpy as np
+
+from pedalboard import (
+    Compressor,
+    Gain,
+    HighpassFilter,
+    HighShelfFilter,
+    Limiter,
+    LowpassFilter,
+    LowShelfFilter,
+    PeakFilter,
+    Pedalboard,
+    Reverb,
+)
+
+# Effect types of a chain and the pedalboard plugin implementing them
+EFFECTS = {
+    "reverb": Reverb,
+    "highpass": HighpassFilter,
+    "lowpass": LowpassFilter,
+    "low_shelf": LowShelfFilter,
+    "high_shelf": HighShelfFilter,
+    "peak": PeakFilter,
+    "compressor": Compressor,
+    "limiter": Limiter,
+    "gain": Gain,
+}
+
+
+class EffectsChain:
+    """
+    Applies a chain of effects to a stream of (frames, channels) blocks, keeping the
+    effects' state (reverb tails, compressor envelopes, ...) across blocks.
+
+    A chain is a list of effects such as `{"type": "reverb", "room_size": 0.5}`: the
+    type is a key of EFFECTS and the other entries are parameters of its pedalboard
+    plugin.
+    """
+
+    def __init__(self, effects, sample_rate):
+        """
+        Args:
+            effects: List of effect dicts, applied in order.
+            sample_rate: Sampling rate of the blocks.
+        """
+        plugins = []
+        for effect in effects:
+            params = dict(effect)
+            kind = params.pop("type")
+            if kind not in EFFECTS:
+                raise ValueError(f"Unknown effect '{kind}'")
+            plugins.append(EFFECTS[kind](**params))
+        self.board = Pedalboard(plugins)
+        self.sample_rate = sample_rate
+
+    def process(self, block):
+        if len(block) == 0 or len(self.board) == 0:
+            return block
+        effected = self.board(
+            np.ascontiguousarray(block.T), self.sample_rate, reset=False
+        )
+        return effected.T
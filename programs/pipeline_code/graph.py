@@ -0,0 +1,449 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+
+import soundfile as sf
+
+from contextlib import nullcontext
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from programs.applio_code.rvc.lib.tools.manifest import hash_file, hash_params
+from programs.music_separation_code.utils import PeakMemory
+from programs.pipeline_code.audio import AudioBuffer
+from programs.pipeline_code.resources import ResourcePool
+
+# Bump to invalidate every cached stage output after a change to how stages are keyed
+GRAPH_VERSION = 4
+
+
+def file_identity(path):
+    """
+    Cheap identity of a model or index file: its path, size and modification time.
+    Returns None for missing or empty paths.
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+class Cancelled(Exception):
+    """Raised by StageGraph.run once its cancel event is set."""
+
+
+def input_duration(inputs):
+    """
+    Returns the duration in seconds of the longest audio input of a stage, or None.
+    """
+    durations = []
+    for value in inputs.values():
+        if isinstance(value, AudioBuffer):
+            durations.append(value.duration)
+        elif isinstance(value, str) and os.path.isfile(value):
+            try:
+                durations.append(sf.info(value).duration)
+            except RuntimeError:
+                pass
+    return max(durations) if durations else None
+
+
+class Source:
+    """
+    An input file of the graph, keyed by its content. `content_hash` saves hashing the
+    file again when the caller already did.
+    """
+
+    def __init__(self, path, content_hash=None):
+        self.path = path
+        self._key = "file:" + content_hash if content_hash else None
+
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = "file:" + hash_file(self.path)
+        return self._key
+
+
+class Stage:
+    """
+    A node of the graph.
+
+    `func(inputs, output_dir, **params, **options)` receives {input name: path or
+    AudioBuffer} and returns {output name: path or AudioBuffer}. Audio is best returned
+    in memory; files, e.g. an encoded export, are written in the empty `output_dir`.
+    `params` are part of the cache key; `options` (devices, ...) are not. `fingerprint`
+    is only hashed, e.g. the identity of the model files a stage loads. `resources`
+    name the limited resources the stage holds while it runs, e.g. a loaded model.
+    `kind` replaces the name in the cache key, so the same stage of several songs
+    sharing a graph can have distinct names but reuse single-song results.
+    """
+
+    def __init__(
+        self,
+        name,
+        func,
+        inputs=None,
+        params=None,
+        options=None,
+        fingerprint=None,
+        resources=None,
+        kind=None,
+    ):
+        self.name = name
+        self.kind = kind or name
+        self.func = func
+        self.inputs = inputs or {}
+        self.params = params or {}
+        self.options = options or {}
+        self.fingerprint = fingerprint
+        self.resources = tuple(resources or ())
+
+    def dependencies(self):
+        return [ref[0] for ref in self.inputs.values() if not isinstance(ref, Source)]
+
+
+class StageGraph:
+    """
+    Runs a DAG of stages against a StageCache.
+
+    A stage's key is the hash of its name, params and the keys of its inputs: the
+    content hash for source files, the producing stage's key and output name otherwise.
+    Keys are computed without running anything, so only stages whose key isn't cached
+    run, and their cached upstream outputs are reused.
+
+    Outputs are handed to the downstream stages as they were returned, in memory; the
+    cache only receives a copy so later runs can reuse them. Without a cache nothing is
+    written to disk but the files stages produce themselves.
+
+    Stages whose inputs are ready run concurrently on up to `workers` threads, and at
+    most `limits[resource]` of the stages holding a resource run at once, counting the
+    stages of every graph sharing the same ResourcePool. Every stage is recorded in
+    `timeline`, and reported to `telemetry` if given: a `run_start` and `run_end` event
+    per run, and a `stage_start` and `stage_end` event per stage. Stage ends carry the
+    timeline entry, the cache status, the model (the `model_name` or `model_path`
+    param), the input duration, the real-time factor and the peak RSS.
+
+    Setting the `cancel` event stops a run between stages: the running stages finish,
+    their outputs are cached, and run() raises Cancelled.
+    """
+
+    def __init__(
+        self,
+        cache=None,
+        workers=1,
+        limits=None,
+        pool=None,
+        telemetry=None,
+        cancel=None,
+    ):
+        """
+        Args:
+            cache: StageCache to reuse and store outputs in, or None.
+            workers: Maximum number of stages running at once.
+            limits: {resource: maximum number of stages holding it at once}.
+            pool: ResourcePool shared with other graphs, instead of `limits`.
+            telemetry: Telemetry receiving the stage events, or None.
+            cancel: threading.Event cancelling the runs once set, or None.
+        """
+        self.cache = cache
+        self.workers = max(1, int(workers))
+        self.pool = pool or ResourcePool(limits)
+        self.stages = {}
+        self.keys = {}
+        self.results = {}
+        self.status = {}
+        self.timeline = []
+        self.started = None
+        self.telemetry = telemetry
+        self.cancel = cancel
+        self.run_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self._pinned = []
+        self._scratch = []
+
+    def add(
+        self,
+        name,
+        func,
+        inputs=None,
+        params=None,
+        options=None,
+        fingerprint=None,
+        resources=None,
+        kind=None,
+    ):
+        """
+        Adds a stage. Inputs map input names to a Source or a (stage name, output name)
+        pair. Returns the stage name.
+        """
+        self.stages[name] = Stage(
+            name, func, inputs, params, options, fingerprint, resources, kind
+        )
+        return name
+
+    def key(self, name):
+        if name not in self.keys:
+            stage = self.stages[name]
+            inputs = {}
+            for input_name, ref in stage.inputs.items():
+                if isinstance(ref, Source):
+                    inputs[input_name] = ref.key
+                else:
+                    inputs[input_name] = "{}/{}".format(self.key(ref[0]), ref[1])
+            self.keys[name] = hash_params(
+                {
+                    "version": GRAPH_VERSION,
+                    "stage": stage.kind,
+                    "params": stage.params,
+                    "fingerprint": stage.fingerprint,
+                    "inputs": inputs,
+                }
+            )
+        return self.keys[name]
+
+    def run(self, *targets):
+        """
+        Computes the targets and returns {stage name: {output name: output}} for them.
+        Cached outputs used by this run stay pinned until close().
+        """
+        if self.started is None:
+            self.started = time.perf_counter()
+        run_start = time.perf_counter()
+        before = len(self.timeline)
+        pending = {}
+        for name in targets:
+            self._plan(name, pending)
+        hits = len(self.timeline) - before
+        self._emit("run_start", targets=list(targets), stages=hits + len(pending))
+        status = "error"
+        try:
+            self._execute(pending)
+            status = "ok"
+        except Cancelled:
+            status = "cancelled"
+            raise
+        finally:
+            statuses = [entry["status"] for entry in self.timeline[before:]]
+            self._emit(
+                "run_end",
+                targets=list(targets),
+                status=status,
+                wall_time=time.perf_counter() - run_start,
+                hits=statuses.count("hit"),
+                misses=statuses.count("miss"),
+                errors=statuses.count("error"),
+            )
+        return {name: self.results[name] for name in targets}
+
+    def _emit(self, event, **fields):
+        if self.telemetry is not None:
+            self.telemetry.emit(event, run=self.run_id, **fields)
+
+    def _stage_fields(self, stage):
+        model = stage.params.get("model_name") or stage.params.get("model_path")
+        return {
+            "kind": stage.kind,
+            "model": os.path.basename(model) if model else None,
+        }
+
+    def _hold(self, key):
+        self.cache.pin(key)
+        self._pinned.append(key)
+
+    def _plan(self, name, pending):
+        """
+        Looks the stage up in the cache and, on a miss, plans its missing dependencies,
+        so upstream stages of a cached result are never run.
+        """
+        if name in self.results or name in pending:
+            return
+        key = self.key(name)
+        outputs = None
+        if self.cache is not None:
+            # Pinned before the lookup so a concurrent put can't evict it in between
+            self._hold(key)
+            outputs = self.cache.get(key)
+        if outputs is not None:
+            self.results[name] = outputs
+            self.status[name] = "hit"
+            now = time.perf_counter() - self.started
+            entry = {"stage": name, "status": "hit", "start": now, "end": now}
+            self.timeline.append(entry)
+            fields = self._stage_fields(self.stages[name])
+            self._emit("stage_end", **entry, **fields, wall_time=0.0)
+            print(f"{name}: using cached result")
+            return
+        dependencies = self.stages[name].dependencies()
+        for dependency in dependencies:
+            self._plan(dependency, pending)
+        pending[name] = {
+            dependency for dependency in dependencies if dependency not in self.results
+        }
+
+    def _execute(self, pending):
+        """
+        Runs the planned stages as soon as their inputs are computed. Workers wait for
+        the stage's resources before running it.
+        """
+        running = {}
+        cancelled = False
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="stage")
+        try:
+            while pending or running:
+                if self.cancel is not None and self.cancel.is_set() and pending:
+                    # The running stages finish, nothing new starts
+                    cancelled = True
+                    pending.clear()
+                    if not running:
+                        break
+                ready = [name for name, waiting in pending.items() if not waiting]
+                for name in ready[: self.workers - len(running)]:
+                    stage = self.stages[name]
+                    inputs = {
+                        input_name: (
+                            ref.path
+                            if isinstance(ref, Source)
+                            else self.results[ref[0]][ref[1]]
+                        )
+                        for input_name, ref in stage.inputs.items()
+                    }
+                    running[executor.submit(self._run_stage, stage, inputs)] = name
+                    del pending[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        self.status[name] = "error"
+                    self.results[name] = future.result()
+                    self.status[name] = "miss"
+                    for waiting in pending.values():
+                        waiting.discard(name)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if cancelled:
+            raise Cancelled("The run was cancelled")
+
+    def _run_stage(self, stage, inputs):
+        queued = time.perf_counter() - self.started
+        self.pool.acquire(stage.resources)
+        if self.cancel is not None and self.cancel.is_set():
+            # Cancelled while waiting for its resources
+            self.pool.release(stage.resources)
+            raise Cancelled("The run was cancelled")
+        entry = {
+            "stage": stage.name,
+            "status": "miss",
+            "queued": queued,
+            "start": time.perf_counter() - self.started,
+            "end": None,
+            "worker": threading.current_thread().name,
+            "resources": list(stage.resources),
+        }
+        memory = nullcontext()
+        if self.telemetry is not None:
+            fields = self._stage_fields(stage)
+            self._emit("stage_start", stage=stage.name, **fields, queued=queued)
+            memory = PeakMemory("cpu")
+        error = None
+        try:
+            with memory:
+                return self._compute(stage, inputs)
+        except BaseException as exception:
+            entry["status"] = "error"
+            error = exception
+            raise
+        finally:
+            self.pool.release(stage.resources)
+            entry["end"] = time.perf_counter() - self.started
+            with self.lock:
+                self.timeline.append(entry)
+            if self.telemetry is not None:
+                self._emit_stage_end(stage, entry, inputs, memory.peak, error)
+
+    def _emit_stage_end(self, stage, entry, inputs, peak_rss, error):
+        wall_time = entry["end"] - entry["start"]
+        duration = input_duration(inputs)
+        self._emit(
+            "stage_end",
+            **entry,
+            **self._stage_fields(stage),
+            wall_time=wall_time,
+            input_duration=duration,
+            rtf=wall_time / duration if duration else None,
+            peak_rss=peak_rss,
+            error=repr(error) if error is not None else None,
+        )
+
+    def _compute(self, stage, inputs):
+        if self.cache is None:
+            output_dir = tempfile.mkdtemp(prefix=f"{stage.name}_")
+            with self.lock:
+                self._scratch.append(output_dir)
+            return stage.func(inputs, output_dir, **stage.params, **stage.options)
+
+        output_dir = self.cache.scratch_dir()
+        try:
+            produced = stage.func(inputs, output_dir, **stage.params, **stage.options)
+            stored = self.cache.put(
+                self.key(stage.name), produced, {"stage": stage.kind}
+            )
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        # The in-memory results are used as is rather than read back
+        return {
+            output_name: (
+                output if isinstance(output, AudioBuffer) else stored[output_name]
+            )
+            for output_name, output in produced.items()
+        }
+
+    def format_timeline(self, width=40):
+        """
+        Renders the timeline as one line per stage with a bar over the run's duration.
+        """
+        entries = sorted(self.timeline, key=lambda entry: entry["start"])
+        if not entries:
+            return ""
+        total = max(entry["end"] for entry in entries) or 1
+        name_width = max(len(entry["stage"]) for entry in entries)
+        lines = []
+        for entry in entries:
+            first = int(entry["start"] / total * width)
+            last = max(first + 1, int(round(entry["end"] / total * width)))
+            bar = " " * first + "#" * (last - first) if entry["status"] != "hit" else ""
+            lines.append(
+                "{}  {:>7.2f}s {:>7.2f}s  {:<5}  |{:<{width}}|".format(
+                    entry["stage"].ljust(name_width),
+                    entry["start"],
+                    entry["end"] - entry["start"],
+                    entry["status"],
+                    bar,
+                    width=width,
+                )
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Releases the cache entries pinned by this run and the files of uncached stages.
+        """
+        for key in self._pinned:
+            self.cache.unpin(key)
+        self._pinned = []
+        for output_dir in self._scratch:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        self._scratch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
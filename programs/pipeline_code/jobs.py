@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import traceback
+
+from collections import OrderedDict, deque
+
+from programs.pipeline_code.graph import Cancelled
+from programs.pipeline_code.telemetry import ProgressSink
+
+# Statuses of the jobs that haven't finished
+ACTIVE = ("queued", "running", "cancelling")
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the lane of a job holds `max_queued` jobs."""
+
+
+class Job:
+    """
+    A request run by a JobQueue. The handler of its kind receives the job, reads
+    `params`, writes its files in `output_dir` and returns their paths. Long handlers
+    call `check_cancelled()` between steps, and pass `cancel_event` and `progress` to
+    the stage graphs they run.
+    """
+
+    def __init__(self, kind, params, output_root, lane="default", priority=0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.lane = lane
+        self.priority = priority
+        self.output_dir = os.path.join(output_root, self.id)
+        self.status = "queued"
+        self.created = time.time()
+        self.started = self.finished = None
+        # Times a worker started the job, including runs a restart interrupted
+        self.attempts = 0
+        self.outputs = []
+        self.result = None
+        self.error = None
+        self.fraction = 0.0
+        self.stage = None
+        self.cancel_event = threading.Event()
+        # Telemetry sink following the stages of the job's graphs
+        self.progress = ProgressSink(self._report)
+
+    def _report(self, fraction, desc=None):
+        self.fraction = fraction
+        self.stage = desc
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise Cancelled("The job was cancelled")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "lane": self.lane,
+            "priority": self.priority,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.fraction,
+            "stage": self.stage,
+            "attempts": self.attempts,
+            "outputs": [os.path.basename(path) for path in self.outputs],
+            "error": self.error,
+        }
+
+    def state(self):
+        """What a JobQueue persists of the job, see `restore`."""
+        return {
+            **self.to_dict(),
+            "output_dir": self.output_dir,
+            "outputs": self.outputs,
+            "result": self.result,
+        }
+
+    @classmethod
+    def restore(cls, state):
+        job = cls(state["kind"], state["params"], "", state["lane"], state["priority"])
+        for name in ("id", "output_dir", "status", "created", "started", "finished"):
+            setattr(job, name, state[name])
+        job.attempts = state.get("attempts", 0)
+        job.outputs = state["outputs"]
+        job.result = state["result"]
+        job.error = state["error"]
+        job.fraction = state["progress"]
+        return job
+
+
+class JobQueue:
+    """
+    Bounded priority queue of jobs run by lanes of worker threads. Each lane has its
+    own workers and queue, so long jobs of one lane (e.g. batches) never hold the
+    workers of another (e.g. previews). In a lane, jobs run by ascending priority, then
+    in submission order.
+
+    A job is started once every resource its kind uses is held by fewer than
+    `limits[resource]` running jobs, so a busy resource doesn't hold the workers while
+    jobs using others could run. Queued jobs are cancelled at once; running ones when
+    their handler next checks.
+
+    With a `state_path`, the jobs are saved to a JSON file whenever one is submitted,
+    started or finished, and a new queue on the same file runs the jobs that were queued
+    or running again, so they survive a restart. A job already started `max_attempts`
+    times is failed instead, so a job that kills the process isn't started on every
+    launch. The outputs of the oldest finished jobs are deleted once more than `keep`
+    are kept.
+    """
+
+    def __init__(
+        self,
+        handlers,
+        output_root,
+        workers=2,
+        max_queued=16,
+        limits=None,
+        keep=100,
+        lanes=None,
+        resources=None,
+        state_path=None,
+        max_attempts=2,
+    ):
+        """
+        Args:
+            handlers: {kind: function(job) returning the paths of the output files}.
+                A handler may also set `job.result`, saved with the job.
+            output_root: Directory holding a folder of outputs per job.
+            workers: Number of workers of the "default" lane, without `lanes`.
+            max_queued: Maximum number of jobs waiting to run, per lane.
+            limits: {resource: maximum number of jobs using it running at once}.
+            keep: Number of finished jobs kept with their outputs.
+            lanes: {lane: number of workers}, the first lane being the default one.
+            resources: {kind: resources its jobs use}. By default a kind uses the
+                resource named after it.
+            state_path: JSON file the jobs are saved to and restored from.
+            max_attempts: Number of times a job is started. A job interrupted by a
+                restart after that is failed.
+        """
+        self.handlers = handlers
+        self.output_root = output_root
+        self.max_queued = max_queued
+        self.limits = dict(limits or {})
+        self.keep = keep
+        self.lanes = dict(lanes or {"default": workers})
+        self.resources = dict(resources or {})
+        self.state_path = state_path
+        self.max_attempts = max_attempts
+        self.jobs = OrderedDict()
+        self.pending = {lane: [] for lane in self.lanes}
+        self.running = {}
+        self.finished = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+        if state_path and os.path.exists(state_path):
+            self._load()
+        self.threads = [
+            threading.Thread(
+                target=self._work, args=(lane,), name=f"job_{lane}_{index}", daemon=True
+            )
+            for lane, count in self.lanes.items()
+            for index in range(max(1, int(count)))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, kind, params, lane=None, priority=0):
+        """Queues a job and returns it. Raises QueueFull or ValueError."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job type '{kind}'")
+        lane = lane or next(iter(self.lanes))
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane '{lane}'")
+        with self.condition:
+            if len(self.pending[lane]) >= self.max_queued:
+                raise QueueFull(
+                    f"{len(self.pending[lane])} {lane} jobs are already queued"
+                )
+            job = Job(kind, params, self.output_root, lane, priority)
+            self.jobs[job.id] = job
+            self.pending[lane].append(job)
+            self._save()
+            self.condition.notify_all()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        with self.condition:
+            return list(self.jobs.values())
+
+    def position(self, job):
+        """Number of queued jobs of its lane that run before a queued job."""
+        with self.condition:
+            pending = self.pending.get(job.lane, [])
+            if job not in pending:
+                return 0
+            index = pending.index(job)
+            return sum(
+                other.priority < job.priority
+                or (other.priority == job.priority and at < index)
+                for at, other in enumerate(pending)
+            )
+
+    def cancel(self, job_id):
+        """Cancels a job. Returns it, or None if there is no such job."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancel_event.set()
+            if job.status == "queued":
+                self.pending[job.lane].remove(job)
+                self._finish(job, "cancelled")
+            elif job.status == "running":
+                job.status = "cancelling"
+            self._save()
+            return job
+
+    def wait(self, job, timeout=None):
+        """Blocks until a job is finished or `timeout` seconds have passed."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: job.status not in ACTIVE, timeout=timeout
+            )
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": {lane: len(jobs) for lane, jobs in self.pending.items()},
+                "running": dict(self.running),
+                "max_queued": self.max_queued,
+                "workers": dict(self.lanes),
+                "limits": self.limits,
+            }
+
+    def _uses(self, job):
+        return self.resources.get(job.kind, [job.kind])
+
+    def _runnable(self, lane):
+        runnable = [
+            job
+            for job in self.pending[lane]
+            if all(
+                self.running.get(resource, 0) < self.limits.get(resource, float("inf"))
+                for resource in self._uses(job)
+            )
+        ]
+        # min keeps the first of equal priorities, the earliest submitted
+        return min(runnable, key=lambda job: job.priority, default=None)
+
+    def _work(self, lane):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.closed or self._runnable(lane) is not None
+                )
+                if self.closed:
+                    return
+                job = self._runnable(lane)
+                self.pending[lane].remove(job)
+                for resource in self._uses(job):
+                    self.running[resource] = self.running.get(resource, 0) + 1
+                job.status = "running"
+                job.started = time.time()
+                job.attempts += 1
+                self._save()
+            status = "done"
+            try:
+                os.makedirs(job.output_dir, exist_ok=True)
+                job.outputs = list(self.handlers[job.kind](job))
+            except Cancelled:
+                status = "cancelled"
+            except Exception as error:
+                status = "failed"
+                job.error = str(error)
+                logging.error(f"Job {job.id} ({job.kind}) failed: {error}")
+                logging.debug(traceback.format_exc())
+            with self.condition:
+                for resource in self._uses(job):
+                    self.running[resource] -= 1
+                self._finish(job, status)
+                self._save()
+                self.condition.notify_all()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        if status == "done":
+            job.fraction = 1.0
+        self.finished.append(job)
+        while len(self.finished) > self.keep:
+            old = self.finished.popleft()
+            self.jobs.pop(old.id, None)
+            if old.output_dir:
+                shutil.rmtree(old.output_dir, ignore_errors=True)
+
+    def _save(self):
+        if not self.state_path:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.state_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                states = [job.state() for job in self.jobs.values()]
+                json.dump(states, file, default=str)
+            os.replace(temp_path, self.state_path)
+        except OSError as error:
+            logging.error(f"Could not save the job queue: {error}")
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                states = json.load(file)
+        except (OSError, ValueError) as error:
+            logging.error(f"Could not load the job queue: {error}")
+            return
+        resumed = 0
+        for state in states:
+            job = Job.restore(state)
+            self.jobs[job.id] = job
+            if job.status == "cancelling":
+                job.status = "cancelled"
+            if job.status not in ACTIVE:
+                self.finished.append(job)
+            elif job.kind not in self.handlers or job.lane not in self.lanes:
+                job.status = "failed"
+                job.error = "The job can't run in this queue"
+                self.finished.append(job)
+            elif job.status == "running" and job.attempts >= self.max_attempts:
+                job.status = "failed"
+                job.error = f"Interrupted {job.attempts} times, not started again"
+                job.finished = time.time()
+                self.finished.append(job)
+            else:
+                # Interrupted jobs start over, their finished stages come from caches
+                job.status = "queued"
+                job.started = None
+                self.pending[job.lane].append(job)
+                resumed += 1
+        if resumed:
+            print(f"Resuming {resumed} jobs from {self.state_path}")
+        self._save()
+
+    def close(self):
+        """
+        Stops the workers once their current job is done. Queued jobs are dropped, or
+        kept for the next queue on the state file.
+        """
+        with self.condition:
+            self.closed = True
+            for jobs in self.pending.values():
+                for job in jobs:
+                    job.cancel_event.set()
+            self.condition.notify_all()
@@ -0,0 +1,253 @@
+import numpy as np
+import soundfile as sf
+
+from scipy.ndimage import minimum_filter1d, uniform_filter1d
+from scipy.signal import resample_poly
+
+from programs.applio_code.rvc.infer.pipeline import StreamResampler
+from programs.applio_code.rvc.lib.tools.encoder import AudioStreamWriter
+from programs.pipeline_code.audio import AudioBuffer, map_channels
+from programs.pipeline_code.effects import EffectsChain
+
+
+class StemReader:
+    """
+    Reads a stem block by block at a given sampling rate and channel count, resampling
+    on the fly and running it through an effects chain. The stem is a file, streamed
+    with soundfile, or an AudioBuffer. Reads past the end return silence.
+    """
+
+    def __init__(
+        self,
+        stem,
+        sample_rate,
+        channels,
+        gain_db=0.0,
+        block_size=65536,
+        effects=None,
+    ):
+        """
+        Args:
+            stem: Path of an audio file, or an AudioBuffer.
+            sample_rate: Output sampling rate.
+            channels: Output channel count.
+            gain_db: Gain applied to the stem, after the effects.
+            block_size: Input frames decoded at a time.
+            effects: Effects chain applied at the output rate, see EffectsChain.
+        """
+        self.buffer = self.file = None
+        if isinstance(stem, AudioBuffer):
+            self.buffer = stem
+        else:
+            try:
+                self.file = sf.SoundFile(stem)
+            except RuntimeError:
+                # Formats libsndfile can't read are decoded at once
+                self.buffer = AudioBuffer.read(stem)
+        self.source_rate = (
+            self.buffer.sample_rate if self.buffer is not None else self.file.samplerate
+        )
+        self.channels = channels
+        self.gain = np.float32(10 ** (gain_db / 20))
+        self.block_size = block_size
+        self.position = 0
+        self.resamplers = None
+        if self.source_rate != sample_rate:
+            self.resamplers = [
+                StreamResampler(self.source_rate, sample_rate) for _ in range(channels)
+            ]
+        self.chain = EffectsChain(effects, sample_rate) if effects else None
+        self.pending = np.zeros((0, channels), dtype=np.float32)
+        self.exhausted = False
+
+    @staticmethod
+    def info(stem):
+        """
+        Returns (sample rate, channels, frames) of a file or AudioBuffer.
+        """
+        if isinstance(stem, AudioBuffer):
+            return stem.sample_rate, stem.channels, stem.frames
+        try:
+            info = sf.info(stem)
+            return info.samplerate, info.channels, info.frames
+        except RuntimeError:
+            audio = AudioBuffer.read(stem)
+            return audio.sample_rate, audio.channels, audio.frames
+
+    def _decode(self):
+        if self.buffer is not None:
+            block = self.buffer.samples[self.position : self.position + self.block_size]
+            self.position += len(block)
+            return np.asarray(block, dtype=np.float32)
+        return self.file.read(self.block_size, dtype="float32", always_2d=True)
+
+    def _fill(self, frames):
+        blocks = [self.pending]
+        available = len(self.pending)
+        while available < frames and not self.exhausted:
+            block = self._decode()
+            final = len(block) == 0
+            block = map_channels(block, self.channels)
+            if self.resamplers is not None:
+                block = np.stack(
+                    [
+                        resampler.process(block[:, channel], final=final)
+                        for channel, resampler in enumerate(self.resamplers)
+                    ],
+                    axis=1,
+                )
+            if self.chain is not None:
+                block = self.chain.process(block)
+            if final:
+                self.exhausted = True
+                self.close()
+            blocks.append(block)
+            available += len(block)
+        self.pending = np.concatenate(blocks)
+
+    def read(self, frames):
+        """
+        Returns the next `frames` frames with the gain applied.
+        """
+        self._fill(frames)
+        block = self.pending[:frames]
+        self.pending = self.pending[frames:]
+        if len(block) < frames:
+            block = np.concatenate(
+                [block, np.zeros((frames - len(block), self.channels), np.float32)]
+            )
+        return block * self.gain
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TruePeakLimiter:
+    """
+    A look-ahead limiter for multichannel audio that keeps the true peak, measured on a
+    4x oversampled signal as in ITU-R BS.1770, below a threshold. All channels get the
+    same gain so the stereo image doesn't shift, and the gain curve is built like
+    LookaheadLimiter's.
+    """
+
+    def __init__(self, sample_rate, threshold_db=-1.0, lookahead_ms=5.0, oversample=4):
+        """
+        Args:
+            sample_rate: Sampling rate of the audio to limit.
+            threshold_db: Maximum true peak of the output, in dBTP.
+            lookahead_ms: How far ahead of a peak the gain starts to drop.
+            oversample: Oversampling factor of the peak detection.
+        """
+        self.threshold = 10 ** (threshold_db / 20)
+        self.lookahead = max(1, int(sample_rate * lookahead_ms / 1000))
+        self.reach = self.lookahead + self.lookahead // 2
+        self.oversample = oversample
+        # Input samples kept before the pending ones, for the oversampling filter
+        self.context = 32
+        self.history = None
+        self.pending = None
+        self.gain_history = np.ones(self.reach, dtype=np.float32)
+
+    def true_peak(self, audio, history):
+        """
+        Returns the largest oversampled magnitude across channels around every sample.
+        """
+        padded = np.concatenate([history, audio])
+        upsampled = resample_poly(padded, self.oversample, 1, axis=0)
+        peaks = np.abs(upsampled).reshape(len(padded), -1).max(axis=1)
+        return np.maximum(peaks, np.abs(padded).max(axis=1))[len(history) :]
+
+    def process(self, block, final=False):
+        """
+        Limits a (frames, channels) block. Output lags input by the look-ahead until
+        `final` flushes it.
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if self.pending is None:
+            self.pending = block[:0]
+            self.history = np.zeros((self.context, block.shape[1]), np.float32)
+        audio = np.concatenate([self.pending, block])
+        n_out = len(audio) if final else max(len(audio) - self.reach, 0)
+        if n_out == 0:
+            self.pending = audio
+            return audio[:0]
+        # Recomputed for the pending samples too, now that they have more context
+        peaks = self.true_peak(audio, self.history)
+        required = (self.threshold / np.maximum(peaks, self.threshold)).astype(
+            np.float32
+        )
+        future = np.ones(self.reach if final else 0, dtype=np.float32)
+        gain = np.concatenate([self.gain_history, required, future])
+        gain = minimum_filter1d(gain, size=2 * self.lookahead + 1)
+        gain = uniform_filter1d(gain, size=2 * (self.lookahead // 2) + 1)
+        output = audio[:n_out] * gain[self.reach : self.reach + n_out, None]
+        self.gain_history = np.concatenate([self.gain_history, required])[
+            n_out : n_out + self.reach
+        ]
+        self.history = np.concatenate([self.history, audio[:n_out]])[-self.context :]
+        self.pending = audio[n_out:]
+        return output
+
+
+def mix_to_file(
+    stems,
+    gains_db,
+    output_path,
+    export_format,
+    sample_rate=None,
+    channels=None,
+    frames=None,
+    limiter=True,
+    threshold_db=-1.0,
+    block_size=65536,
+    effects=None,
+):
+    """
+    Mixes stems block by block and encodes the mix in the same pass, so no stem is
+    decoded whole and no intermediate mix or effected stem is written.
+
+    Args:
+        stems: Files or AudioBuffers; the first one sets the length of the mix.
+        gains_db: Gain of every stem in dB.
+        output_path: Path of the encoded mix.
+        export_format: One of WAV, FLAC, OGG, MP3, M4A.
+        sample_rate: Rate of the mix, the highest stem rate by default.
+        channels: Channels of the mix, the most any stem has by default.
+        frames: Length of the mix, the first stem's duration by default.
+        limiter: Whether to apply a true-peak limiter instead of letting the mix clip.
+        threshold_db: Limiter ceiling in dBTP.
+        block_size: Frames mixed at a time.
+        effects: Effects chain of every stem, or None, see EffectsChain.
+    """
+    infos = [StemReader.info(stem) for stem in stems]
+    sample_rate = sample_rate or max(info[0] for info in infos)
+    channels = channels or max(info[1] for info in infos)
+    if frames is None:
+        source_rate, _, source_frames = infos[0]
+        frames = int(round(source_frames * sample_rate / source_rate))
+
+    effects = effects or [None] * len(stems)
+    readers = [
+        StemReader(stem, sample_rate, channels, gain_db, block_size, chain)
+        for stem, gain_db, chain in zip(stems, gains_db, effects)
+    ]
+    peak_limiter = TruePeakLimiter(sample_rate, threshold_db) if limiter else None
+    try:
+        with AudioStreamWriter(
+            output_path, sample_rate, export_format.upper(), channels
+        ) as writer:
+            for start in range(0, frames, block_size):
+                count = min(block_size, frames - start)
+                mix = readers[0].read(count)
+                for reader in readers[1:]:
+                    mix += reader.read(count)
+                final = start + count >= frames
+                if peak_limiter is not None:
+                    mix = peak_limiter.process(mix, final=final)
+                writer.write(np.clip(mix, -1.0, 1.0))
+    finally:
+        for reader in readers:
+            reader.close()
+    return output_path
@@ -0,0 +1,232 @@
+import numpy as np
+import scipy.fft
+
+from scipy.signal import get_window
+
+from programs.applio_code.rvc.infer.pipeline import StreamResampler
+from programs.applio_code.rvc.lib.tools.encoder import AudioStreamWriter
+from programs.pipeline_code.audio import AudioBuffer
+from programs.pipeline_code.mixer import StemReader
+
+
+class PhaseVocoder:
+    """
+    Streaming phase vocoder time stretch of (frames, channels) audio, like librosa's
+    phase_vocoder. Analysis frames are taken every `hop * den / num` samples and
+    overlap-added every `hop` samples, so the output is `num / den` times as long.
+    Frames of a block are transformed at once, on every core.
+    """
+
+    def __init__(self, channels, num, den, n_fft=2048, hop=512):
+        """
+        Args:
+            channels: Channel count of the audio.
+            num, den: Integers whose ratio is the stretch factor.
+            n_fft: Frame length, a multiple of `hop`.
+            hop: Synthesis hop. The analysis hop must stay positive.
+        """
+        if n_fft % hop:
+            raise ValueError("n_fft must be a multiple of hop")
+        self.num = num
+        self.den = den
+        self.n_fft = n_fft
+        self.hop = hop
+        self.window = get_window("hann", n_fft).astype(np.float32)
+        # Constant since hop divides n_fft
+        self.norm = np.float32((self.window**2).reshape(-1, hop).sum(axis=0).mean())
+        self.omega = 2 * np.pi * np.arange(n_fft // 2 + 1)[None, :, None] / n_fft
+        # Frames are centered, as with librosa's stft
+        self.buffer = np.zeros((n_fft // 2, channels), dtype=np.float32)
+        self.base = 0
+        self.received = 0
+        self.frame = 0
+        self.phase = self.prev_phase = self.prev_position = None
+        self.ola = np.zeros((0, channels), dtype=np.float32)
+        self.ola_base = 0
+
+    def position(self, frames):
+        """
+        Returns the start, in padded input samples, of the analysis frames.
+        """
+        return (frames * self.hop * self.den * 2 + self.num) // (2 * self.num)
+
+    def process(self, block, final=False):
+        """
+        Stretches the next block. Output lags input by about a frame until `final`
+        flushes it.
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, block])
+        self.received += len(block)
+        skip = self.n_fft // 2
+        length = None
+        last = None
+        if final:
+            length = (self.received * self.num * 2 + self.den) // (2 * self.den)
+            # Last frame overlapping the output, and zeros for it to read
+            last = (skip + length - 1) // self.hop if length else -1
+            missing = self.position(last) + self.n_fft - self.base - len(self.buffer)
+            if missing > 0:
+                padding = np.zeros((missing, self.buffer.shape[1]), np.float32)
+                self.buffer = np.concatenate([self.buffer, padding])
+
+        limit = self.base + len(self.buffer) - self.n_fft
+        upper = max(limit, 0) * self.num // (self.hop * self.den) + 2
+        if last is not None:
+            upper = min(upper, last + 1)
+        frames = np.arange(self.frame, max(upper, self.frame))
+        positions = self.position(frames)
+        frames = frames[positions <= limit]
+        positions = positions[: len(frames)]
+        if len(frames):
+            self._synthesize(frames, positions)
+            self.frame = frames[-1] + 1
+            start = self.position(self.frame)
+            self.buffer = self.buffer[start - self.base :]
+            self.base = start
+
+        done = self.frame * self.hop if length is None else skip + length
+        output = self.ola[: done - self.ola_base]
+        if len(output) < done - self.ola_base:
+            padding = np.zeros((done - self.ola_base - len(output), output.shape[1]))
+            output = np.concatenate([output, padding.astype(np.float32)])
+        first = self.ola_base
+        self.ola = self.ola[done - self.ola_base :]
+        self.ola_base = done
+        return output[max(skip - first, 0) :]
+
+    def _synthesize(self, frames, positions):
+        index = (positions - self.base)[:, None] + np.arange(self.n_fft)
+        spectrum = scipy.fft.rfft(
+            self.buffer[index] * self.window[None, :, None], axis=1, workers=-1
+        )
+        magnitude = np.abs(spectrum)
+        phase = np.angle(spectrum)
+
+        first = self.phase is None
+        if first:
+            self.phase = self.prev_phase = phase[0]
+            self.prev_position = positions[0] - 1
+        hops = np.diff(positions, prepend=self.prev_position)[:, None, None]
+        previous = np.concatenate([self.prev_phase[None], phase[:-1]])
+        delta = phase - previous - self.omega * hops
+        delta -= 2 * np.pi * np.round(delta / (2 * np.pi))
+        advance = self.hop * (self.omega + delta / hops)
+        if first:
+            advance[0] = 0
+        synthesis = self.phase + np.cumsum(advance, axis=0)
+        self.phase = np.mod(synthesis[-1], 2 * np.pi)
+        self.prev_phase = phase[-1]
+        self.prev_position = positions[-1]
+
+        output = scipy.fft.irfft(
+            magnitude * np.exp(1j * synthesis), n=self.n_fft, axis=1, workers=-1
+        ).astype(np.float32)
+        output *= self.window[None, :, None] / self.norm
+
+        # Overlap-add one hop-sized slice of every frame at a time
+        start = frames[0] * self.hop - self.ola_base
+        end = frames[-1] * self.hop + self.n_fft - self.ola_base
+        if end > len(self.ola):
+            padding = np.zeros((end - len(self.ola), self.ola.shape[1]), np.float32)
+            self.ola = np.concatenate([self.ola, padding])
+        count = len(frames)
+        for offset in range(0, self.n_fft, self.hop):
+            at = start + offset
+            view = self.ola[at : at + count * self.hop].reshape(count, self.hop, -1)
+            view += output[:, offset : offset + self.hop]
+
+
+class PitchShifter:
+    """
+    Streaming pitch shift that keeps the duration: the audio is stretched by the pitch
+    ratio with a PhaseVocoder and resampled back to its original length.
+    """
+
+    def __init__(self, sample_rate, semitones, channels, n_fft=2048, hop=512):
+        """
+        Args:
+            sample_rate: Sampling rate of the audio.
+            semitones: Pitch shift in semitones.
+            channels: Channel count of the audio.
+            n_fft: Frame length of the phase vocoder.
+            hop: Synthesis hop of the phase vocoder.
+        """
+        self.semitones = semitones
+        self.received = 0
+        self.emitted = 0
+        if semitones == 0:
+            return
+        # The stretched audio is read as if it were sampled at this rate
+        shifted_rate = int(round(sample_rate * 2 ** (semitones / 12)))
+        self.vocoder = PhaseVocoder(channels, shifted_rate, sample_rate, n_fft, hop)
+        self.resamplers = [
+            StreamResampler(shifted_rate, sample_rate) for _ in range(channels)
+        ]
+
+    def process(self, block, final=False):
+        """
+        Shifts the next (frames, channels) block. The output is exactly as long as the
+        input once `final` flushes it.
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self.received += len(block)
+        if self.semitones == 0:
+            self.emitted += len(block)
+            return block
+        stretched = self.vocoder.process(block, final=final)
+        output = np.stack(
+            [
+                resampler.process(stretched[:, channel], final=final)
+                for channel, resampler in enumerate(self.resamplers)
+            ],
+            axis=1,
+        )
+        if final:
+            remaining = self.received - self.emitted
+            output = output[:remaining]
+            if len(output) < remaining:
+                padding = np.zeros((remaining - len(output), output.shape[1]))
+                output = np.concatenate([output, padding.astype(np.float32)])
+        self.emitted += len(output)
+        return output
+
+
+def pitch_shift(audio, semitones, block_size=65536):
+    """
+    Returns an AudioBuffer shifted by `semitones`, with the same duration.
+    """
+    if semitones == 0:
+        return audio
+    shifter = PitchShifter(audio.sample_rate, semitones, audio.channels)
+    blocks = [
+        shifter.process(
+            audio.samples[start : start + block_size],
+            final=start + block_size >= audio.frames,
+        )
+        for start in range(0, max(audio.frames, 1), block_size)
+    ]
+    return AudioBuffer(np.concatenate(blocks), audio.sample_rate)
+
+
+def pitch_shift_file(
+    input_path, output_path, semitones, export_format, block_size=65536
+):
+    """
+    Shifts the pitch of a file by `semitones`, decoding, shifting and encoding it block
+    by block.
+    """
+    sample_rate, channels, frames = StemReader.info(input_path)
+    reader = StemReader(input_path, sample_rate, channels, block_size=block_size)
+    shifter = PitchShifter(sample_rate, semitones, channels)
+    try:
+        with AudioStreamWriter(
+            output_path, sample_rate, export_format.upper(), channels
+        ) as writer:
+            for start in range(0, max(frames, 1), block_size):
+                count = min(block_size, frames - start)
+                final = start + block_size >= frames
+                writer.write(shifter.process(reader.read(count), final=final))
+    finally:
+        reader.close()
+    return output_path
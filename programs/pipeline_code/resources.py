@@ -0,0 +1,161 @@
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ResourcePool:
+    """
+    Counted resources shared by the stages of one or more graphs, e.g. how many models
+    may run at once. Resources without a limit are free.
+    """
+
+    def __init__(self, limits=None):
+        """
+        Args:
+            limits: {resource: maximum number of holders at once}.
+        """
+        self.limits = dict(limits or {})
+        self.in_use = {}
+        self.condition = threading.Condition()
+
+    def _available(self, resources):
+        return all(
+            self.in_use.get(resource, 0) < self.limits.get(resource, float("inf"))
+            for resource in resources
+        )
+
+    def acquire(self, resources):
+        """
+        Blocks until every resource is available and takes them all at once, so two
+        holders can't deadlock each other.
+        """
+        for resource in resources:
+            if self.limits.get(resource, 1) < 1:
+                raise ValueError(f"Resource '{resource}' has a limit of 0")
+        with self.condition:
+            self.condition.wait_for(lambda: self._available(resources))
+            for resource in resources:
+                self.in_use[resource] = self.in_use.get(resource, 0) + 1
+
+    def release(self, resources):
+        with self.condition:
+            for resource in resources:
+                self.in_use[resource] -= 1
+            self.condition.notify_all()
+
+
+class MemoryBudget:
+    """
+    Admits work while the estimated memory of everything admitted stays under a
+    budget. A single item larger than the budget is still admitted on its own.
+    """
+
+    def __init__(self, budget):
+        """
+        Args:
+            budget: Budget in bytes, or None for no limit.
+        """
+        self.budget = budget
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.budget is None
+                or self.in_use == 0
+                or self.in_use + amount <= self.budget
+            )
+            self.in_use += amount
+
+    def release(self, amount):
+        with self.condition:
+            self.in_use -= amount
+            self.condition.notify_all()
+
+
+class WarmPool:
+    """
+    Keeps instances holding a loaded model, e.g. voice converters, per key so callers
+    reuse them instead of loading the model again. At most `per_key` instances of a key
+    are in use at once, so concurrent callers of a model share its loaded weights in
+    turn. Idle instances beyond `max_idle` are disposed of, least recently used first.
+    """
+
+    def __init__(self, factory, per_key=1, max_idle=4, dispose=None):
+        """
+        Args:
+            factory: Called with a key to create an instance for it.
+            per_key: Maximum number of instances of a key in use at once.
+            max_idle: Maximum number of idle instances kept across keys.
+            dispose: Called with an instance when it's dropped, to free its memory.
+        """
+        self.factory = factory
+        self.per_key = per_key
+        self.max_idle = max_idle
+        self.dispose = dispose
+        self.idle = OrderedDict()
+        self.busy = {}
+        self.condition = threading.Condition()
+
+    def acquire(self, key):
+        """
+        Blocks until an instance of `key` is free, and returns it, creating one if none
+        is idle.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.busy.get(key, 0) < self.per_key)
+            self.busy[key] = self.busy.get(key, 0) + 1
+            instances = self.idle.get(key)
+            if instances:
+                instance = instances.pop()
+                if not instances:
+                    del self.idle[key]
+                return instance
+        try:
+            return self.factory(key)
+        except BaseException:
+            with self.condition:
+                self.busy[key] -= 1
+                self.condition.notify_all()
+            raise
+
+    def release(self, key, instance):
+        dropped = []
+        with self.condition:
+            self.busy[key] -= 1
+            self.idle.setdefault(key, []).append(instance)
+            self.idle.move_to_end(key)
+            while sum(len(instances) for instances in self.idle.values()) > max(
+                self.max_idle, 0
+            ):
+                oldest = next(iter(self.idle))
+                dropped.append(self.idle[oldest].pop(0))
+                if not self.idle[oldest]:
+                    del self.idle[oldest]
+            self.condition.notify_all()
+        if self.dispose is not None:
+            for instance in dropped:
+                self.dispose(instance)
+
+    @contextmanager
+    def use(self, key):
+        """Holds an instance of `key` for the duration of the block."""
+        instance = self.acquire(key)
+        try:
+            yield instance
+        finally:
+            self.release(key, instance)
+
+    def stats(self):
+        """Returns {key: {"busy": in use, "idle": kept loaded}}."""
+        with self.condition:
+            keys = set(self.busy) | set(self.idle)
+            return {
+                str(key): {
+                    "busy": self.busy.get(key, 0),
+                    "idle": len(self.idle.get(key, [])),
+                }
+                for key in keys
+            }
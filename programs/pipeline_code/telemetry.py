@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Telemetry:
+    """
+    Sends structured events to sinks, callables receiving the event dict. Every event
+    has an `event` type, a `time` (epoch seconds), the `host` and `pid`, plus the
+    `labels` given here (e.g. the song). A failing sink is logged and skipped.
+    """
+
+    def __init__(self, sinks, labels=None):
+        self.sinks = list(sinks)
+        self.labels = dict(labels or {})
+
+    def with_labels(self, **labels):
+        """Returns a Telemetry sending to the same sinks with more labels."""
+        return Telemetry(self.sinks, {**self.labels, **labels})
+
+    def emit(self, event, **fields):
+        record = {
+            "event": event,
+            "time": time.time(),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            **self.labels,
+            **fields,
+        }
+        for sink in self.sinks:
+            try:
+                sink(record)
+            except Exception as error:
+                logging.warning(f"Telemetry sink {sink!r} failed: {error}")
+
+
+class JsonLinesSink:
+    """
+    Appends every event to a JSON lines file. Once the file exceeds `max_bytes` it is
+    renamed to <path>.1, replacing the previous one, and a new file is started, so the
+    events take at most twice `max_bytes` on disk.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            if (
+                self.max_bytes is not None
+                and os.path.exists(self.path)
+                and os.path.getsize(self.path) >= self.max_bytes
+            ):
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+
+
+class ProgressSink:
+    """
+    Reports the fraction of finished stages to a progress callback such as
+    gradio.Progress, called as `progress(fraction, desc=...)`. Stages of several runs
+    sharing the sink add up.
+    """
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.total = 0
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            if event["event"] == "run_start":
+                self.total += event["stages"]
+            elif event["event"] == "stage_end":
+                self.done += 1
+            else:
+                return
+            fraction = self.done / self.total if self.total else 0.0
+            desc = (
+                "{}: {}".format(event["stage"], event["status"])
+                if event["event"] == "stage_end"
+                else "Starting..."
+            )
+        self.progress(min(fraction, 1.0), desc=desc)
+
+
+class MetricsSink:
+    """
+    Aggregates stage events per stage kind and serves them in the Prometheus text
+    format on http://host:port/metrics.
+    """
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.seconds = {}
+        self.audio_seconds = {}
+        self.peak_rss = {}
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=self.server.serve_forever, name="metrics", daemon=True
+        ).start()
+        address = f"http://{host}:{self.server.server_port}/metrics"
+        print(f"Serving stage metrics on {address}")
+
+    def __call__(self, event):
+        if event["event"] != "stage_end":
+            return
+        kind = event.get("kind", event["stage"])
+        with self.lock:
+            key = (kind, event["status"])
+            self.runs[key] = self.runs.get(key, 0) + 1
+            if event["status"] == "hit":
+                return
+            self.seconds[kind] = self.seconds.get(kind, 0.0) + event["wall_time"]
+            if event.get("input_duration"):
+                self.audio_seconds[kind] = (
+                    self.audio_seconds.get(kind, 0.0) + event["input_duration"]
+                )
+            if event.get("peak_rss"):
+                self.peak_rss[kind] = max(
+                    self.peak_rss.get(kind, 0), event["peak_rss"]
+                )
+
+    def render(self):
+        host = socket.gethostname()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                text = ",".join(
+                    '{}="{}"'.format(label, label_value)
+                    for label, label_value in {"host": host, **labels}.items()
+                )
+                lines.append(f"{name}{{{text}}} {value}")
+
+        with self.lock:
+            metric(
+                "full_inference_stage_runs_total",
+                "counter",
+                "Stages by kind and cache status.",
+                [
+                    ({"kind": kind, "status": status}, count)
+                    for (kind, status), count in sorted(self.runs.items())
+                ],
+            )
+            metric(
+                "full_inference_stage_seconds_total",
+                "counter",
+                "Wall time of the computed stages.",
+                [
+                    ({"kind": kind}, value)
+                    for kind, value in sorted(self.seconds.items())
+                ],
+            )
+            metric(
+                "full_inference_stage_audio_seconds_total",
+                "counter",
+                "Duration of the audio the computed stages processed.",
+                [
+                    ({"kind": kind}, value)
+                    for kind, value in sorted(self.audio_seconds.items())
+                ],
+            )
+            metric(
+                "full_inference_stage_peak_rss_bytes",
+                "gauge",
+                "Highest resident set size of the process while a stage ran.",
+                [
+                    ({"kind": kind}, value)
+                    for kind, value in sorted(self.peak_rss.items())
+                ],
+            )
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import uuid
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+from core import (
+    MODELS_CONFIG,
+    full_inference_program,
+    get_converter_pool,
+    get_model_info_by_name,
+    get_resource_pool,
+    prepare_separation_model,
+    separate_array,
+    setup_devices,
+    uvr_separator,
+    uvr_settings,
+)
+from programs.applio_code.rvc.lib.tools.encoder import encode_audio
+from programs.pipeline_code.audio import AudioBuffer
+from programs.pipeline_code.jobs import JobQueue, QueueFull
+
+SERVICE_DIR = os.path.join(now_dir, "audio_files", "service")
+UPLOAD_DIR = os.path.join(SERVICE_DIR, "uploads")
+CHUNK_SIZE = 64 * 1024
+
+# Defaults of the conversion parameters, as in the UI
+CONVERT_DEFAULTS = {
+    "index_path": "",
+    "embedder_model": "contentvec",
+    "pitch": 0,
+    "f0_method": "rmvpe",
+    "index_rate": 0.75,
+    "volume_envelope": 0.25,
+    "protect": 0.33,
+    "hop_length": 64,
+    "split_audio": False,
+    "f0_autotune": False,
+    "filter_radius": 3,
+    "export_format": "WAV",
+    "stream": False,
+}
+SEPARATE_DEFAULTS = {
+    "devices": "0",
+    "extract_instrumental": True,
+    "batch_size": 1,
+    "use_tta": False,
+    "export_format": "WAV",
+}
+
+
+def clear_uploads(max_age):
+    """Deletes the uploads older than `max_age` seconds."""
+    if not os.path.isdir(UPLOAD_DIR):
+        return
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        if time.time() - os.path.getmtime(path) > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def require(params, *names):
+    missing = [name for name in names if name not in params]
+    if missing:
+        raise ValueError("Missing parameters: " + ", ".join(missing))
+
+
+def input_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def run_conversion(job):
+    """
+    Convert a vocal track with an RVC model kept loaded between requests. With
+    "stream", the file is converted block by block so long inputs use bounded memory.
+    """
+    require(job.params, "input_path", "model_path")
+    params = dict(CONVERT_DEFAULTS, **job.params)
+    input_path = params.pop("input_path")
+    export_format = params.pop("export_format").upper()
+    stream = params.pop("stream")
+    output_path = os.path.join(
+        job.output_dir, f"{input_name(input_path)}_rvc.{export_format.lower()}"
+    )
+    audio = None if stream else AudioBuffer.read(input_path)
+    resources = ["model", "rvc"]
+    get_resource_pool().acquire(resources)
+    try:
+        job.check_cancelled()
+        model_key = os.path.abspath(params["model_path"])
+        with get_converter_pool().use(model_key) as converter:
+            if stream:
+                converter.convert_audio(
+                    input_path,
+                    output_path,
+                    f0_file=None,
+                    embedder_model_custom=None,
+                    export_format=export_format,
+                    stream=True,
+                    **params,
+                )
+            else:
+                converted, sample_rate = converter.convert_array(
+                    audio.samples, audio.sample_rate, name=input_path, **params
+                )
+    finally:
+        get_resource_pool().release(resources)
+    if stream:
+        # convert_audio logs its errors instead of raising them
+        if not os.path.exists(output_path):
+            raise RuntimeError("The conversion failed, see the log")
+    else:
+        encode_audio(converted, sample_rate, output_path, export_format)
+    return [output_path]
+
+
+def run_separation(job):
+    """Split a track into stems with one of the separation models."""
+    require(job.params, "input_path", "model_name")
+    params = dict(SEPARATE_DEFAULTS, **job.params)
+    model_info = get_model_info_by_name(params["model_name"])
+    if model_info is None:
+        raise ValueError(f"Unknown separation model '{params['model_name']}'")
+    devices, fp16 = setup_devices(params["devices"])
+    prepare_separation_model(model_info, fp16)
+    export_format = params["export_format"].upper()
+    name = input_name(params["input_path"])
+    get_resource_pool().acquire(["model"])
+    try:
+        job.check_cancelled()
+        if "arch" in model_info:
+            # UVR models are run by audio-separator, which writes the stems itself
+            category = next(
+                category
+                for category, models in MODELS_CONFIG.items()
+                if model_info in models
+            )
+            with uvr_separator(
+                os.path.join(now_dir, "models", category),
+                model_info["full_name"],
+                job.output_dir,
+                **uvr_settings(model_info, params["batch_size"], params["use_tta"]),
+            ) as separator:
+                separator.separate(params["input_path"])
+            return sorted(
+                os.path.join(job.output_dir, file)
+                for file in os.listdir(job.output_dir)
+            )
+        stems = separate_array(
+            model_info,
+            AudioBuffer.read(params["input_path"]),
+            devices,
+            params["extract_instrumental"],
+        )
+    finally:
+        get_resource_pool().release(["model"])
+    outputs = []
+    for instrument, stem in stems.items():
+        output_path = os.path.join(
+            job.output_dir, f"{name}_{instrument}.{export_format.lower()}"
+        )
+        encode_audio(stem.samples, stem.sample_rate, output_path, export_format)
+        outputs.append(output_path)
+    return outputs
+
+
+def run_full_inference(job):
+    """Run the full pipeline, with the stage cache, on a song."""
+    parameters = inspect.signature(full_inference_program).parameters
+    required = [
+        name
+        for name, parameter in parameters.items()
+        if parameter.default is inspect.Parameter.empty
+        and name not in ("input_audio_path", "output_path")
+    ]
+    require(job.params, "input_path", *required)
+    settings = {
+        name: value for name, value in job.params.items() if name in parameters
+    }
+    settings.setdefault("output_path", "")
+    _, final_path = full_inference_program(
+        input_audio_path=job.params["input_path"],
+        progress_callback=job.progress,
+        cancel_event=job.cancel_event,
+        **settings,
+    )
+    output_path = os.path.join(job.output_dir, os.path.basename(final_path))
+    shutil.copyfile(final_path, output_path)
+    return [output_path]
+
+
+HANDLERS = {
+    "convert": run_conversion,
+    "separate": run_separation,
+    "full": run_full_inference,
+}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the service:
+
+        GET    /health                     queue, worker and warm model state
+        POST   /uploads?filename=song.wav  stores the request body, returns its path.
+                                            Uploads are deleted after upload_max_age
+        POST   /jobs                       {"type": "convert" | "separate" | "full",
+                                            "params": {...}, "priority": 0}, returns
+                                            the job, lower priorities run first
+        GET    /jobs                       every job
+        GET    /jobs/<id>                  status, progress and outputs of a job
+        DELETE /jobs/<id>                  cancels a job
+        GET    /jobs/<id>/outputs/<index>  streams an output file
+    """
+
+    queue = None
+    max_upload_bytes = 1024 * 2**20
+    upload_max_age = 24 * 3600
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self):
+        url = urlparse(self.path)
+        return [part for part in url.path.split("/") if part], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, _ = self.route()
+        if parts == ["health"]:
+            converters = get_converter_pool().stats()
+            self.send_json(200, {"jobs": self.queue.stats(), "converters": converters})
+        elif parts == ["jobs"]:
+            self.send_json(200, [job.to_dict() for job in self.queue.list()])
+        elif len(parts) >= 2 and parts[0] == "jobs":
+            job = self.queue.get(parts[1])
+            if job is None:
+                self.send_json(404, {"error": "No such job"})
+            elif len(parts) == 2:
+                self.send_json(200, job.to_dict())
+            elif len(parts) == 4 and parts[2] == "outputs":
+                self.send_output(job, parts[3])
+            else:
+                self.send_json(404, {"error": "Not found"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def send_output(self, job, index):
+        if job.status != "done":
+            self.send_json(409, {"error": f"The job is {job.status}"})
+            return
+        if not index.isdigit() or int(index) >= len(job.outputs):
+            self.send_json(404, {"error": "No such output"})
+            return
+        path = job.outputs[int(index)]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header(
+            "Content-Disposition", f'attachment; filename="{os.path.basename(path)}"'
+        )
+        self.end_headers()
+        with open(path, "rb") as file:
+            shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+
+    def do_POST(self):
+        parts, query = self.route()
+        if parts == ["uploads"]:
+            self.receive_upload(query)
+        elif parts == ["jobs"]:
+            try:
+                request = self.read_json()
+                job = self.queue.submit(
+                    request.get("type"),
+                    request.get("params", {}),
+                    priority=int(request.get("priority", 0)),
+                )
+            except QueueFull as error:
+                self.send_json(503, {"error": str(error)}, {"Retry-After": "5"})
+            except (ValueError, TypeError, AttributeError) as error:
+                self.send_json(400, {"error": str(error)})
+            else:
+                self.send_json(202, job.to_dict())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def receive_upload(self, query):
+        remaining = int(self.headers.get("Content-Length", 0))
+        if remaining > self.max_upload_bytes:
+            # The body isn't read, so the connection can't be reused
+            self.close_connection = True
+            self.send_json(
+                413,
+                {"error": f"Uploads are limited to {self.max_upload_bytes} bytes"},
+                {"Connection": "close"},
+            )
+            return
+        clear_uploads(self.upload_max_age)
+        filename = os.path.basename(query.get("filename", ["upload.wav"])[0])
+        directory = os.path.join(UPLOAD_DIR, uuid.uuid4().hex)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename or "upload.wav")
+        with open(path, "wb") as file:
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                file.write(chunk)
+                remaining -= len(chunk)
+        self.send_json(201, {"path": path})
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        is_job = len(parts) == 2 and parts[0] == "jobs"
+        job = self.queue.cancel(parts[1]) if is_job else None
+        if job is None:
+            self.send_json(404, {"error": "No such job"})
+        else:
+            self.send_json(200, job.to_dict())
+
+
+def main():
+    parser = ArgumentParser(
+        description="Headless inference service sharing loaded models between requests."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=7866, help="Port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Maximum number of jobs running at once"
+    )
+    parser.add_argument(
+        "--max-queued", type=int, default=32, help="Maximum number of waiting jobs"
+    )
+    parser.add_argument(
+        "--max-convert", type=int, default=2, help="Conversion jobs running at once"
+    )
+    parser.add_argument(
+        "--max-separate", type=int, default=1, help="Separation jobs running at once"
+    )
+    parser.add_argument(
+        "--max-full", type=int, default=1, help="Full inference jobs running at once"
+    )
+    parser.add_argument(
+        "--max-upload-mb", type=int, default=1024, help="Maximum size of an upload"
+    )
+    parser.add_argument(
+        "--upload-hours",
+        type=float,
+        default=24,
+        help="Hours an upload is kept before it's deleted",
+    )
+    args = parser.parse_args()
+
+    ServiceHandler.max_upload_bytes = args.max_upload_mb * 2**20
+    ServiceHandler.upload_max_age = args.upload_hours * 3600
+    clear_uploads(ServiceHandler.upload_max_age)
+
+    ServiceHandler.queue = JobQueue(
+        HANDLERS,
+        os.path.join(SERVICE_DIR, "jobs"),
+        workers=args.workers,
+        max_queued=args.max_queued,
+        limits={
+            "convert": args.max_convert,
+            "separate": args.max_separate,
+            "full": args.max_full,
+        },
+    )
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ServiceHandler.queue.close()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
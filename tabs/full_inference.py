@@ -1,5 +1,6 @@
 from core import full_inference_program, download_music
-import sys, os
+from tabs.jobs import job_error, run_job
+import sys, os, inspect
 import gradio as gr
 from tabs.infer.variable import *
 
@@ -51,6 +52,30 @@ def update_hop_length_visibility(pitch_extract_value):
     return gr.update(visible=pitch_extract_value in ["crepe", "crepe-tiny"])
 
 
+def convert(*values, progress=gr.Progress()):
+    """Queue full_inference_program as an interactive job and wait for it."""
+    names = list(inspect.signature(full_inference_program).parameters)
+    job, error = run_job("full", dict(zip(names, values)), progress)
+    if job is None:
+        return error, None
+    if job.status != "done":
+        return job_error(job), None
+    return job.result, job.outputs[0]
+
+
+def convert_batch(input_folder, *values, progress=gr.Progress()):
+    """Queue full_inference_batch on a folder with the song settings of the tab."""
+    names = list(inspect.signature(full_inference_program).parameters)
+    settings = dict(zip(names, values))
+    settings.pop("input_audio_path")
+    job, error = run_job("batch", {"input_folder": input_folder, **settings}, progress)
+    if job is None:
+        return error, []
+    if job.status != "done":
+        return job_error(job), []
+    return job.result, job.outputs
+
+
 # ===========================
 # TABS
 # ===========================
@@ -662,6 +687,24 @@ def full_inference_tab():
             )
             vc_output2 = gr.Audio(label=i18n("Export Audio"))
 
+        with gr.Accordion(i18n("Batch"), open=False):
+            batch_input_folder = gr.Textbox(
+                label=i18n("Input Folder"),
+                info=i18n(
+                    "Convert every song in this folder with the settings above, overlapping the songs."
+                ),
+                interactive=True,
+            )
+            batch_button = gr.Button(i18n("Convert Batch"))
+            with gr.Row(equal_height=True):
+                batch_output_info = gr.Textbox(
+                    label=i18n("Output Information"),
+                    info=i18n("The output information will be displayed here."),
+                )
+                batch_output_files = gr.File(
+                    label=i18n("Export Audio"), file_count="multiple"
+                )
+
     with gr.Tab(i18n("Download Music")):
         download_music_tab()
 
@@ -697,62 +740,72 @@ def full_inference_tab():
     )
 
     # Main conversion
+    inference_inputs = [
+        model_file,
+        index_file,
+        audio,
+        output_path,
+        export_format_rvc,
+        split_audio,
+        autotune,
+        vocal_model,
+        karaoke_model,
+        dereverb_model,
+        deecho,
+        deeecho_model,
+        denoise,
+        denoise_model,
+        reverb,
+        vocals_volume,
+        instrumentals_volume,
+        backing_vocals_volume,
+        export_format_final,
+        devices,
+        pitch,
+        filter_radius,
+        index_rate,
+        rms_mix_rate,
+        protect,
+        pitch_extract,
+        hop_length,
+        reverb_room_size,
+        reverb_damping,
+        reverb_wet_gain,
+        reverb_dry_gain,
+        reverb_width,
+        embedder_model,
+        delete_audios,
+        use_tta,
+        batch_size,
+        infer_backing_vocals,
+        infer_backing_vocals_model,
+        infer_backing_vocals_index,
+        change_inst_pitch,
+        pitch_back,
+        filter_radius_back,
+        index_rate_back,
+        rms_mix_rate_back,
+        protect_back,
+        pitch_extract_back,
+        hop_length_back,
+        export_format_rvc_back,
+        split_audio_back,
+        autotune_back,
+        embedder_model_back,
+    ]
+    # The job queue limits how many run at once, not Gradio
     convert_button.click(
-        full_inference_program,
-        inputs=[
-            model_file,
-            index_file,
-            audio,
-            output_path,
-            export_format_rvc,
-            split_audio,
-            autotune,
-            vocal_model,
-            karaoke_model,
-            dereverb_model,
-            deecho,
-            deeecho_model,
-            denoise,
-            denoise_model,
-            reverb,
-            vocals_volume,
-            instrumentals_volume,
-            backing_vocals_volume,
-            export_format_final,
-            devices,
-            pitch,
-            filter_radius,
-            index_rate,
-            rms_mix_rate,
-            protect,
-            pitch_extract,
-            hop_length,
-            reverb_room_size,
-            reverb_damping,
-            reverb_wet_gain,
-            reverb_dry_gain,
-            reverb_width,
-            embedder_model,
-            delete_audios,
-            use_tta,
-            batch_size,
-            infer_backing_vocals,
-            infer_backing_vocals_model,
-            infer_backing_vocals_index,
-            change_inst_pitch,
-            pitch_back,
-            filter_radius_back,
-            index_rate_back,
-            rms_mix_rate_back,
-            protect_back,
-            pitch_extract_back,
-            hop_length_back,
-            export_format_rvc_back,
-            split_audio_back,
-            autotune_back,
-            embedder_model_back,
-        ],
+        convert,
+        inputs=inference_inputs,
         outputs=[vc_output1, vc_output2],
+        concurrency_limit=None,
+    )
+
+    batch_button.click(
+        convert_batch,
+        inputs=[batch_input_folder] + inference_inputs,
+        outputs=[batch_output_info, batch_output_files],
+        concurrency_limit=None,
     )
 
     # Visibility toggles
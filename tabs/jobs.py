@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+from datetime import datetime
+from functools import lru_cache
+
+import gradio as gr
+
+from assets.i18n.i18n import I18nAuto
+from core import full_inference_batch, full_inference_program
+from programs.pipeline_code.jobs import JobQueue, QueueFull
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+
+i18n = I18nAuto()
+
+config_file = os.path.join(now_dir, "assets", "config.json")
+
+# Lane and priority of the jobs of each tab. Every lane has its own workers, so short
+# TTS requests never wait for running songs, nor songs for running batches.
+JOB_LANES = {
+    "tts": ("tts", 0),
+    "full": ("interactive", 0),
+    "batch": ("batch", 0),
+}
+
+
+def run_full_inference(job):
+    """Job handler running full_inference_program with the settings of the tab."""
+    message, output_path = full_inference_program(
+        **job.params, progress_callback=job.progress, cancel_event=job.cancel_event
+    )
+    job.result = message
+    return [output_path]
+
+
+def run_batch(job):
+    """Job handler running full_inference_batch on a folder."""
+    settings = dict(job.params)
+    message, output_paths = full_inference_batch(
+        settings.pop("input_folder"),
+        progress_callback=job.progress,
+        cancel_event=job.cancel_event,
+        **settings,
+    )
+    job.result = message
+    return output_paths
+
+
+def run_tts(job):
+    """Job handler running generate_tts."""
+    from tabs.tts import generate_tts
+
+    message, output_path = generate_tts(**job.params)
+    job.result = message
+    return [output_path] if output_path else []
+
+
+@lru_cache(maxsize=1)
+def get_job_queue():
+    """
+    Job queue of the app, from the jobs section of the config: workers of the TTS,
+    interactive and batch lanes, queued jobs per lane, songs converted at once across
+    lanes (max_heavy_jobs) and TTS requests run at once (max_tts_jobs). Jobs are saved
+    to state_path, so the ones queued or running when the app stopped run again when
+    it starts, up to max_attempts times.
+    """
+    with open(config_file, "r", encoding="utf8") as file:
+        settings = json.load(file).get("jobs", {})
+    return JobQueue(
+        {"full": run_full_inference, "batch": run_batch, "tts": run_tts},
+        os.path.join(now_dir, "audio_files", "jobs"),
+        max_queued=settings.get("max_queued", 8),
+        limits={
+            "inference": settings.get("max_heavy_jobs", 2),
+            "tts": settings.get("max_tts_jobs", 2),
+        },
+        lanes={
+            "tts": settings.get("tts_workers", 2),
+            "interactive": settings.get("interactive_workers", 2),
+            "batch": settings.get("batch_workers", 1),
+        },
+        resources={"full": ["inference"], "batch": ["inference"], "tts": ["tts"]},
+        state_path=os.path.join(
+            now_dir, settings.get("state_path", "audio_files/jobs/jobs.json")
+        ),
+        max_attempts=settings.get("max_attempts", 2),
+    )
+
+
+def run_job(kind, params, progress):
+    """
+    Queues a job in its lane and waits for it, showing its place in the queue and
+    then its stages on the progress bar. Returns the job, or the error message when the
+    queue is full.
+    """
+    queue = get_job_queue()
+    lane, priority = JOB_LANES[kind]
+    try:
+        job = queue.submit(kind, params, lane, priority)
+    except QueueFull as error:
+        return None, f"Error: the queue is full ({error}), try again later"
+    while not queue.wait(job, timeout=0.5):
+        if job.status == "queued":
+            progress(0, desc=f"Queued, {queue.position(job)} jobs ahead")
+        else:
+            progress(job.fraction, desc=job.stage or "Running...")
+    return job, None
+
+
+def job_error(job):
+    if job.status == "cancelled":
+        return "The job was cancelled"
+    return f"Error: {job.error}"
+
+
+def queue_status():
+    """Queue depth of each lane, as shown in the Jobs tab."""
+    stats = get_job_queue().stats()
+    lanes = ", ".join(
+        f"{lane}: {queued}/{stats['max_queued']} queued"
+        for lane, queued in stats["queued"].items()
+    )
+    running = sum(stats["running"].values())
+    return f"**{running} running** — {lanes}"
+
+
+def list_jobs():
+    """Rows of the jobs table, the newest first."""
+    rows = []
+    for job in reversed(get_job_queue().list()):
+        created = datetime.fromtimestamp(job.created).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append(
+            [
+                job.id,
+                job.kind,
+                job.lane,
+                job.status,
+                f"{job.fraction:.0%}",
+                created,
+                job.error or job.result or "",
+                "\n".join(job.outputs),
+            ]
+        )
+    return rows
+
+
+def refresh_jobs():
+    return queue_status(), list_jobs()
+
+
+def cancel_job(job_id):
+    job = get_job_queue().cancel(job_id.strip())
+    message = f"Job {job.id} is {job.status}" if job else "Error: no such job"
+    return message, *refresh_jobs()
+
+
+def jobs_tab():
+    with gr.Column():
+        gr.Markdown(i18n("# Jobs"))
+        gr.Markdown(
+            i18n(
+                "Conversions and TTS requests of every tab. Jobs queued or running when the app stopped run again when it starts, unless restarts keep interrupting them."
+            )
+        )
+        status = gr.Markdown(queue_status())
+        jobs = gr.Dataframe(
+            headers=[
+                i18n("ID"),
+                i18n("Type"),
+                i18n("Lane"),
+                i18n("Status"),
+                i18n("Progress"),
+                i18n("Created"),
+                i18n("Message"),
+                i18n("Outputs"),
+            ],
+            value=list_jobs(),
+            interactive=False,
+            wrap=True,
+        )
+        with gr.Row():
+            job_id = gr.Textbox(label=i18n("Job ID"), lines=1)
+            cancel_button = gr.Button(i18n("Cancel Job"))
+            refresh_button = gr.Button(i18n("Refresh"))
+        cancel_output = gr.Textbox(label=i18n("Output Information"), interactive=False)
+
+    timer = gr.Timer(2)
+    timer.tick(refresh_jobs, outputs=[status, jobs])
+    refresh_button.click(refresh_jobs, outputs=[status, jobs])
+    cancel_button.click(
+        cancel_job, inputs=[job_id], outputs=[cancel_output, status, jobs]
+    )
@@ -4,6 +4,7 @@ import sys
 import json
 import subprocess
 from assets.i18n.i18n import I18nAuto
+from tabs.jobs import job_error, run_job
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -69,6 +70,22 @@ def generate_tts(text, voice_index, rate, output_file):
         return f"Error: {str(e)}", None
 
 
+def queue_tts(text, voice_index, rate, output_file, progress=gr.Progress()):
+    """Queue generate_tts as an interactive job and wait for it."""
+    params = {
+        "text": text,
+        "voice_index": voice_index,
+        "rate": rate,
+        "output_file": output_file,
+    }
+    job, error = run_job("tts", params, progress)
+    if job is None:
+        return error, None
+    if job.status != "done":
+        return job_error(job), None
+    return job.result, job.outputs[0] if job.outputs else None
+
+
 def tts_tab():
     with gr.Row():
         with gr.Column():
@@ -123,7 +140,8 @@ def tts_tab():
             )
     
     tts_button.click(
-        generate_tts,
+        queue_tts,
         inputs=[text, voice, rate, output_file],
-        outputs=[tts_output, tts_audio]
+        outputs=[tts_output, tts_audio],
+        concurrency_limit=None,
     )
\ No newline at end of file